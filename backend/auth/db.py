@@ -0,0 +1,551 @@
+'''
+Shared PostgreSQL access layer for backend functions.
+Keeps a lazily created, size-bounded connection pool at module level so warm
+invocations of the same container reuse connections instead of reconnecting.
+
+With DB_INSTRUMENT=1 every query is timed and each handler invocation emits
+one structured log line (and optionally a Server-Timing header); when it is
+off, handlers and connections are left unwrapped.
+
+Hot queries can be declared as Statement objects and run with
+execute_prepared(): each pooled connection PREPAREs them once and then only
+sends EXECUTE, so Postgres skips parsing and (for generic plans) planning.
+
+With DATABASE_REPLICA_URL set, get_read_connection() routes read-only work
+to a replica while it is healthy and not lagging; pin_primary() keeps a
+writer's reads on the primary for a short window. Pins are kept in this
+process and, with DB_READ_PIN_SECRET set, also returned to the client as a
+signed X-Read-Pin header; a client that sends it back on later requests reads
+its own writes whichever container serves them. Clients that do not echo the
+header are only covered within one process.
+'''
+import functools
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+
+INSTRUMENT = os.environ.get('DB_INSTRUMENT', '').lower() in ('1', 'true', 'yes')
+INSTRUMENT_LOG = os.environ.get('DB_INSTRUMENT_LOG', '1').lower() in ('1', 'true', 'yes')
+SERVER_TIMING = os.environ.get('DB_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK_INTERVAL', '1'))
+REPLICA_RETRY_AFTER = float(os.environ.get('DB_REPLICA_RETRY_AFTER', '10'))
+READ_PIN_SECONDS = float(os.environ.get('DB_READ_PIN_SECONDS', '5'))
+READ_PIN_SECRET = os.environ.get('DB_READ_PIN_SECRET', '')
+READ_PIN_HEADER = 'X-Read-Pin'
+
+PREPARE_STATEMENTS = os.environ.get('DB_PREPARE', '1').lower() in ('1', 'true', 'yes')
+
+_local = threading.local()
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_ms = 0.0
+        self.rows = 0
+        self.acquire_ms = 0.0
+        self.slow: List[Dict[str, Any]] = []
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'queries': self.queries,
+            'query_ms': round(self.query_ms, 3),
+            'rows': self.rows,
+            'acquire_ms': round(self.acquire_ms, 3),
+        }
+
+
+def current_stats() -> Optional[RequestStats]:
+    return getattr(_local, 'stats', None)
+
+
+def last_request_stats() -> Optional[RequestStats]:
+    '''Stats of the most recent instrumented invocation on this thread.'''
+    return getattr(_local, 'last', None)
+
+
+def _params_shape(params: Any) -> Any:
+    if isinstance(params, dict):
+        return {key: _params_shape(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        if len(params) > 10:
+            return f'{type(params).__name__}[{len(params)}]'
+        return [_params_shape(value) for value in params]
+    return type(params).__name__
+
+
+def _record(query: Any, params: Any, started: float, rowcount: int) -> None:
+    stats = current_stats()
+    if stats is None:
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    stats.queries += 1
+    stats.query_ms += elapsed
+    stats.rows += max(rowcount, 0)
+    if elapsed >= SLOW_QUERY_MS:
+        statement = query.decode() if isinstance(query, bytes) else str(query)
+        stats.slow.append({
+            'ms': round(elapsed, 3),
+            'statement': ' '.join(statement.split())[:500],
+            'params': _params_shape(params),
+        })
+
+
+def _instrumented_cursor(base: type) -> type:
+    class InstrumentedCursor(base):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                _record(query, vars, started, self.rowcount)
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                _record(query, vars_list, started, self.rowcount)
+
+    InstrumentedCursor.__name__ = 'Instrumented' + base.__name__
+    return InstrumentedCursor
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    _cursor_classes: Dict[type, type] = {}
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        wrapped = self._cursor_classes.get(base)
+        if wrapped is None:
+            wrapped = self._cursor_classes.setdefault(base, _instrumented_cursor(base))
+        kwargs['cursor_factory'] = wrapped
+        return super().cursor(*args, **kwargs)
+
+
+def _open(dsn: str) -> Any:
+    if INSTRUMENT:
+        return psycopg2.connect(dsn, connection_factory=InstrumentedConnection)
+    return psycopg2.connect(dsn)
+
+
+def instrument_handler(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''
+    Collects DB stats for one invocation, logs them as a JSON line keyed by
+    context.request_id and, with DB_SERVER_TIMING=1, adds a Server-Timing header.
+    With a replica and DB_READ_PIN_SECRET configured it also carries read pins
+    in and out through the X-Read-Pin header. Returns the handler unchanged
+    when neither applies.
+    '''
+    if REPLICA_URL and READ_PIN_SECRET:
+        handler = _carry_read_pins(handler)
+    if not INSTRUMENT:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        stats = RequestStats()
+        _local.stats = stats
+        started = time.perf_counter()
+        try:
+            response = handler(event, context)
+        finally:
+            _local.stats = None
+            _local.last = stats
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if INSTRUMENT_LOG:
+            print(json.dumps({
+                'request_id': getattr(context, 'request_id', None),
+                'function': getattr(context, 'function_name', None),
+                'method': event.get('httpMethod'),
+                'status': response.get('statusCode'),
+                'total_ms': round(total_ms, 3),
+                **stats.as_dict(),
+                'slow_queries': stats.slow,
+            }, default=str), flush=True)
+
+        if SERVER_TIMING:
+            headers = dict(response.get('headers') or {})
+            headers['Server-Timing'] = (
+                f'db;dur={stats.query_ms:.2f};desc="{stats.queries} queries", '
+                f'conn;dur={stats.acquire_ms:.2f}, total;dur={total_ms:.2f}'
+            )
+            response = {**response, 'headers': headers}
+        return response
+
+    return wrapper
+
+
+class Statement:
+    '''
+    A query written with positional %s placeholders that execute_prepared()
+    runs as a server-side prepared statement under the given name.
+    '''
+
+    def __init__(self, name: str, sql: str):
+        parts = sql.split('%s')
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = f'PREPARE {name} AS ' + ''.join(
+            part + (f'${index}' if index < len(parts) else '') for index, part in enumerate(parts, 1)
+        )
+        arity = len(parts) - 1
+        self.execute_sql = f'EXECUTE {name}' + (' (%s)' % ', '.join(['%s'] * arity) if arity else '')
+
+
+# Statement names prepared on each open connection, keyed by id(conn)
+_prepared: Dict[int, set] = {}
+
+_RECOVERABLE = (
+    psycopg2.errors.InvalidSqlStatementName,
+    psycopg2.errors.DuplicatePreparedStatement,
+    psycopg2.errors.FeatureNotSupported,
+)
+
+
+def execute_prepared(cur: Any, statement: Statement, params: Tuple[Any, ...] = ()) -> None:
+    '''
+    Runs the statement via EXECUTE, preparing it first on this connection if
+    needed. If the server no longer knows it (new session, DISCARD ALL) or its
+    result type changed after a schema change, the connection's statements are
+    deallocated and re-prepared once, provided no transaction was in progress.
+    Falls back to plain execute() when pooling or DB_PREPARE is off.
+    '''
+    if not PREPARE_STATEMENTS or POOL_SIZE <= 0:
+        cur.execute(statement.sql, params or None)
+        return
+
+    conn = cur.connection
+    prepared = _prepared.setdefault(id(conn), set())
+    fresh = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        if statement.name not in prepared:
+            cur.execute(statement.prepare_sql)
+            prepared.add(statement.name)
+        cur.execute(statement.execute_sql, params or None)
+        return
+    except _RECOVERABLE:
+        prepared.clear()
+        if not fresh:
+            raise
+
+    if not conn.autocommit:
+        conn.rollback()
+    cur.execute('DEALLOCATE ALL')
+    cur.execute(statement.prepare_sql)
+    prepared.add(statement.name)
+    cur.execute(statement.execute_sql, params or None)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn: str, size: int, timeout: float):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: Deque[Tuple[Any, float, float]] = deque()
+        self._born: dict = {}
+
+    def _connect(self) -> Any:
+        try:
+            conn = _open(self.dsn)
+        except psycopg2.OperationalError:
+            time.sleep(0.1)
+            conn = _open(self.dsn)
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn: Any) -> None:
+        self._born.pop(id(conn), None)
+        _prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn: Any) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, autocommit: bool = False) -> Any:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout('No database connection available within %.1fs' % self.timeout)
+        try:
+            conn = None
+            now = time.monotonic()
+            while conn is None:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn = self._connect()
+                    break
+                candidate, born, last_used = entry
+                if candidate.closed or now - born > POOL_MAX_LIFETIME:
+                    self._discard(candidate)
+                elif now - last_used > POOL_CHECK_AFTER and not self._is_alive(candidate):
+                    self._discard(candidate)
+                else:
+                    conn = candidate
+            conn.autocommit = autocommit
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: Any) -> None:
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+            except Exception:
+                self._discard(conn)
+                return
+            born = self._born.get(id(conn), time.monotonic())
+            with self._lock:
+                self._idle.append((conn, born, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def owns(self, conn: Any) -> bool:
+        return id(conn) in self._born
+
+    def closeall(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+
+_pool: Optional[ConnectionPool] = None
+_replica_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+# Replica routing state: when the replica was last measured, whether it was
+# lagging, until when it is considered down, and read pins per key
+_replica_checked_at = 0.0
+_replica_lagging = False
+_replica_down_until = 0.0
+_pins: Dict[str, float] = {}
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get('DATABASE_URL'), POOL_SIZE, POOL_TIMEOUT)
+    return _pool
+
+
+def get_replica_pool() -> ConnectionPool:
+    global _replica_pool
+    if _replica_pool is None:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(REPLICA_URL, POOL_SIZE, POOL_TIMEOUT)
+    return _replica_pool
+
+
+def close_pool() -> None:
+    '''Closes the idle pooled connections, e.g. when a long-running server shuts down.'''
+    for pool in (_pool, _replica_pool):
+        if pool is not None:
+            pool.closeall()
+
+
+def get_connection(autocommit: bool = False) -> Any:
+    '''
+    Checks a connection out of the warm pool. With DB_POOL_SIZE=0 pooling is
+    disabled and every call opens a fresh connection (used for benchmarks).
+    '''
+    stats = current_stats()
+    started = time.perf_counter() if stats is not None else 0.0
+    if POOL_SIZE <= 0:
+        conn = _open(os.environ.get('DATABASE_URL'))
+        conn.autocommit = autocommit
+    else:
+        conn = get_pool().getconn(autocommit)
+    if stats is not None:
+        stats.acquire_ms += (time.perf_counter() - started) * 1000
+    return conn
+
+
+def pin_primary(key: str) -> None:
+    '''
+    Sends reads for key to the primary for DB_READ_PIN_SECONDS, so a writer
+    sees its own writes. Inside a handler wrapped by instrument_handler() the
+    pin is also returned to the client as a signed X-Read-Pin entry.
+    '''
+    now = time.monotonic()
+    if len(_pins) > 10000:
+        for stale in [k for k, until in list(_pins.items()) if until <= now]:
+            _pins.pop(stale, None)
+    _pins[key] = now + READ_PIN_SECONDS
+
+    issued = getattr(_local, 'issued_pins', None)
+    if issued is not None:
+        issued[key] = int(time.time() + READ_PIN_SECONDS) + 1
+
+
+def _is_pinned(key: Optional[str]) -> bool:
+    if key is None:
+        return False
+    return _pins.get(key, 0.0) > time.monotonic() or key in (getattr(_local, 'client_pins', None) or ())
+
+
+def _sign_pin(key: str, until: int) -> str:
+    return hmac.new(READ_PIN_SECRET.encode(), f'{key}|{until}'.encode(), hashlib.sha256).hexdigest()
+
+
+def _request_pins(event: Dict[str, Any]) -> Dict[str, int]:
+    '''Unexpired pins with a valid signature from the request's X-Read-Pin header (key|until|signature, comma separated).'''
+    headers = event.get('headers') or {}
+    raw = headers.get(READ_PIN_HEADER) or headers.get(READ_PIN_HEADER.lower()) or ''
+    now = time.time()
+    pins = {}
+    for entry in raw.split(',')[:16]:
+        parts = entry.strip().rsplit('|', 2)
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        key, until = parts[0], int(parts[1])
+        if until > now and hmac.compare_digest(parts[2], _sign_pin(key, until)):
+            pins[key] = until
+    return pins
+
+
+def _carry_read_pins(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        _local.client_pins = _request_pins(event)
+        _local.issued_pins = {}
+        try:
+            response = handler(event, context)
+        finally:
+            issued = _local.issued_pins
+            _local.client_pins = None
+            _local.issued_pins = None
+        if not issued:
+            return response
+
+        headers = dict(response.get('headers') or {})
+        headers[READ_PIN_HEADER] = ','.join(f'{key}|{until}|{_sign_pin(key, until)}' for key, until in issued.items())
+        exposed = headers.get('Access-Control-Expose-Headers')
+        headers['Access-Control-Expose-Headers'] = f'{exposed}, {READ_PIN_HEADER}' if exposed else READ_PIN_HEADER
+        return {**response, 'headers': headers}
+
+    return wrapper
+
+
+def _mark_replica_down() -> None:
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+
+
+def _replica_lag(conn: Any) -> float:
+    with conn.cursor() as cur:
+        cur.execute(REPLICA_LAG_SQL)
+        lag = float(cur.fetchone()[0])
+    if not conn.autocommit:
+        conn.rollback()
+    return lag
+
+
+def _checkout_replica(autocommit: bool) -> Optional[Any]:
+    global _replica_checked_at, _replica_lagging
+    if POOL_SIZE <= 0:
+        conn = _open(REPLICA_URL)
+        conn.autocommit = autocommit
+    else:
+        conn = get_replica_pool().getconn(autocommit)
+
+    if time.monotonic() - _replica_checked_at >= REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            _replica_lagging = _replica_lag(conn) > REPLICA_MAX_LAG
+        except psycopg2.Error:
+            release_connection(conn)
+            raise
+        _replica_checked_at = time.monotonic()
+
+    if _replica_lagging:
+        release_connection(conn)
+        return None
+    return conn
+
+
+def get_read_connection(pin_key: Optional[str] = None, autocommit: bool = True) -> Any:
+    '''
+    Connection for read-only work. Uses DATABASE_REPLICA_URL when it is set,
+    reachable and no more than DB_REPLICA_MAX_LAG seconds behind (measured at
+    most every DB_REPLICA_LAG_CHECK_INTERVAL seconds), and pin_key has not
+    been pinned to the primary by a recent write; otherwise returns a primary
+    connection. Release it with release_connection().
+    '''
+    if not REPLICA_URL or _is_pinned(pin_key) or time.monotonic() < _replica_down_until:
+        return get_connection(autocommit)
+
+    stats = current_stats()
+    started = time.perf_counter() if stats is not None else 0.0
+    try:
+        conn = _checkout_replica(autocommit)
+    except PoolTimeout:
+        # A saturated replica pool is not a broken replica: only this read
+        # falls back to the primary
+        conn = None
+    except psycopg2.Error:
+        _mark_replica_down()
+        conn = None
+    if stats is not None:
+        stats.acquire_ms += (time.perf_counter() - started) * 1000
+
+    return conn if conn is not None else get_connection(autocommit)
+
+
+def release_connection(conn: Any) -> None:
+    if POOL_SIZE <= 0:
+        conn.close()
+        return
+    if _replica_pool is not None and _replica_pool.owns(conn):
+        if conn.closed:
+            _mark_replica_down()
+        _replica_pool.putconn(conn)
+        return
+    get_pool().putconn(conn)
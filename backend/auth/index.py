@@ -1,17 +1,73 @@
+import base64
 import json
-import os
 import hashlib
+import hmac
+import os
 import secrets
-from typing import Dict, Any
-import psycopg2
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Callable, Optional
 from psycopg2.extras import RealDictCursor
+from db import get_connection, instrument_handler, release_connection
+from response import json_response, preflight_response
+from user_tokens import authenticate, issue_user_token, tokens_configured
+
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', '16384'))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+PASSWORD_HASH_MAX_CONCURRENT = int(os.environ.get('PASSWORD_HASH_MAX_CONCURRENT', '0'))
+
+# A concurrency cap, not a speed-up: the request still waits for its own hash, and
+# hashlib.scrypt already releases the GIL. It bounds how many memory-hard derivations
+# (128 * N * r bytes each) run at once; throughput is set by the scrypt cost.
+_kdf_slots: Optional[threading.BoundedSemaphore] = (
+    threading.BoundedSemaphore(PASSWORD_HASH_MAX_CONCURRENT) if PASSWORD_HASH_MAX_CONCURRENT > 0 else None
+)
+
+def _b64encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+def _run_kdf(fn: Callable[..., bytes], *args: Any) -> bytes:
+    if _kdf_slots is None:
+        return fn(*args)
+    with _kdf_slots:
+        return fn(*args)
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+def hash_password(password: str, n: int = 0, r: int = 0, p: int = 0) -> str:
+    '''Hashes with salted scrypt; cost parameters are stored in the hash itself.'''
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = secrets.token_bytes(16)
+    derived = _run_kdf(_scrypt, password, salt, n, r, p)
+    return f'scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(derived)}'
 
-def generate_token() -> str:
-    return secrets.token_urlsafe(32)
+def verify_password(password: str, stored_hash: str) -> bool:
+    if stored_hash.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt, expected = stored_hash.split('$')
+            derived = _run_kdf(_scrypt, password, _b64decode(salt), int(n), int(r), int(p))
+            return hmac.compare_digest(derived, _b64decode(expected))
+        except ValueError:
+            return False
+    if len(stored_hash) == 64:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored_hash)
+    return False
 
+def needs_rehash(stored_hash: str) -> bool:
+    return not stored_hash.startswith(f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$')
+
+@lru_cache(maxsize=1)
+def dummy_hash() -> str:
+    '''Verified against when the email is unknown so both login paths cost the same.'''
+    return hash_password(secrets.token_urlsafe(16))
+
+@instrument_handler
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: User authentication and registration API
@@ -21,20 +77,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight_response('GET, POST, OPTIONS', 'Content-Type, X-Auth-Token, Authorization, X-Read-Pin')
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    conn.autocommit = True
+    if method == 'POST' and not tokens_configured():
+        # Without a signing secret no session could be verified, so nobody is signed in or registered
+        return json_response(503, {'error': 'Sign-in is not configured'})
+    
+    conn = get_connection(autocommit=True)
     
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -48,92 +97,77 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     full_name = body_data.get('full_name')
                     phone = body_data.get('phone', '')
                     
+                    if not email or not isinstance(password, str) or not password:
+                        return json_response(400, {'error': 'Missing email or password'})
+                    
                     cur.execute("SELECT id FROM users WHERE email = %s", (email,))
                     if cur.fetchone():
-                        return {
-                            'statusCode': 400,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Email already registered'})
-                        }
+                        return json_response(400, {'error': 'Email already registered'})
                     
                     password_hash = hash_password(password)
                     cur.execute(
-                        "INSERT INTO users (email, password_hash, full_name, phone) VALUES (%s, %s, %s, %s) RETURNING id, email, full_name, phone",
+                        "INSERT INTO users (email, password_hash, full_name, phone) VALUES (%s, %s, %s, %s) RETURNING id, email, full_name, phone, role",
                         (email, password_hash, full_name, phone)
                     )
                     user = dict(cur.fetchone())
-                    token = generate_token()
+                    token = issue_user_token(user['id'], user['role'])
                     
-                    return {
-                        'statusCode': 201,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'user': user, 'token': token})
-                    }
+                    return json_response(201, {'user': user, 'token': token})
                 
                 elif action == 'login':
                     email = body_data.get('email')
                     password = body_data.get('password')
-                    password_hash = hash_password(password)
+                    
+                    if not email or not isinstance(password, str):
+                        return json_response(400, {'error': 'Missing email or password'})
                     
                     cur.execute(
-                        "SELECT id, email, full_name, phone FROM users WHERE email = %s AND password_hash = %s",
-                        (email, password_hash)
+                        "SELECT id, email, full_name, phone, role, password_hash FROM users WHERE email = %s",
+                        (email,)
                     )
                     user = cur.fetchone()
                     
                     if not user:
-                        return {
-                            'statusCode': 401,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Invalid credentials'})
-                        }
+                        verify_password(password, dummy_hash())
+                    elif verify_password(password, user['password_hash']):
+                        if needs_rehash(user['password_hash']):
+                            cur.execute(
+                                "UPDATE users SET password_hash = %s WHERE id = %s",
+                                (hash_password(password), user['id'])
+                            )
+                    else:
+                        user = None
+                    
+                    if not user:
+                        return json_response(401, {'error': 'Invalid credentials'})
                     
                     user = dict(user)
-                    token = generate_token()
+                    del user['password_hash']
+                    token = issue_user_token(user['id'], user['role'])
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'user': user, 'token': token})
-                    }
+                    return json_response(200, {'user': user, 'token': token})
             
             elif method == 'GET':
-                auth_token = event.get('headers', {}).get('X-Auth-Token')
+                claims = authenticate(event.get('headers'))
                 
-                if not auth_token:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'No token provided'})
-                    }
+                if not claims:
+                    return json_response(401, {'error': 'Invalid or missing token'})
                 
-                user_id = event.get('queryStringParameters', {}).get('user_id')
+                user_id = claims['uid']
                 
                 if user_id:
                     cur.execute(
-                        "SELECT id, email, full_name, phone FROM users WHERE id = %s",
+                        "SELECT id, email, full_name, phone, role FROM users WHERE id = %s",
                         (user_id,)
                     )
                     user = cur.fetchone()
                     
                     if user:
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'user': dict(user)})
-                        }
+                        return json_response(200, {'user': dict(user)})
                 
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User not found'})
-                }
+                return json_response(404, {'error': 'User not found'})
     
     finally:
-        conn.close()
+        release_connection(conn)
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return json_response(405, {'error': 'Method not allowed'})
@@ -0,0 +1,147 @@
+'''
+Shared HTTP response builder for backend functions: precomputed CORS/JSON
+headers, one JSON encoder that understands Decimal, datetime and date, an
+accelerated JSON backend when orjson is installed, and optional gzip of large
+bodies for clients that accept it.
+'''
+import base64
+import gzip
+import json
+import os
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+GZIP_MIN_BYTES = int(os.environ.get('RESPONSE_GZIP_MIN_BYTES', '2048'))
+STREAM_MAX_BYTES = int(os.environ.get('RESPONSE_STREAM_MAX_BYTES', str(32 * 1024 * 1024)))
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(payload: Any) -> str:
+        return orjson.dumps(payload, default=_default).decode()
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(payload: Any) -> str:
+        return _encoder.encode(payload)
+
+
+def gzip_body(body: str) -> str:
+    '''Base64 of the gzipped body, as raw_response() sends it.'''
+    return base64.b64encode(gzip.compress(body.encode(), compresslevel=5)).decode()
+
+
+def _accepts_gzip(event: Optional[Dict[str, Any]]) -> bool:
+    if not event:
+        return False
+    headers = event.get('headers') or {}
+    return 'gzip' in (headers.get('Accept-Encoding') or headers.get('accept-encoding') or '')
+
+
+def etag_matches(event: Optional[Dict[str, Any]], etag: str) -> bool:
+    '''True when the request's If-None-Match lists the given ETag.'''
+    headers = (event or {}).get('headers') or {}
+    if_none_match = headers.get('If-None-Match') or headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def preflight_response(methods: str, allowed_headers: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allowed_headers,
+            'Access-Control-Max-Age': '86400'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+
+def raw_response(status: int, body: str, event: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 gzipped: Optional[Callable[[], str]] = None) -> Dict[str, Any]:
+    '''
+    Wraps an already serialized JSON body, gzipping it when large and accepted.
+    gzipped can supply a compressed copy the caller keeps (see gzip_body()).
+    '''
+    response_headers = {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS)
+    if len(body) >= GZIP_MIN_BYTES and _accepts_gzip(event):
+        response_headers['Content-Encoding'] = 'gzip'
+        response_headers['Vary'] = 'Accept-Encoding'
+        encoded = gzipped() if gzipped is not None else gzip_body(body)
+        return {'statusCode': status, 'headers': response_headers, 'body': encoded, 'isBase64Encoded': True}
+    return {'statusCode': status, 'headers': response_headers, 'body': body, 'isBase64Encoded': False}
+
+
+def json_response(status: int, payload: Any, event: Optional[Dict[str, Any]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return raw_response(status, dumps(payload), event, headers)
+
+
+def empty_response(status: int, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    response_headers = {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS)
+    return {'statusCode': status, 'headers': response_headers, 'body': '', 'isBase64Encoded': False}
+
+
+def stream_response(status: int, chunks: Iterable[str], event: Optional[Dict[str, Any]] = None,
+                    headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Builds a response from text chunks (the function runtime needs the whole
+    body before it can reply). For clients that accept gzip, once the output
+    reaches GZIP_MIN_BYTES every further chunk is compressed as it is
+    produced, so only the compressed body is held in memory; smaller output
+    and clients without gzip get the plain body, as with raw_response(). Once
+    the body being built passes RESPONSE_STREAM_MAX_BYTES the chunk iterator
+    is closed and a 413 is returned instead.
+    '''
+    accepts_gzip = _accepts_gzip(event)
+    compressor = None
+    body = bytearray()
+    try:
+        for chunk in chunks:
+            if compressor is not None:
+                body += compressor.compress(chunk.encode())
+            else:
+                body += chunk.encode()
+                if accepts_gzip and len(body) >= GZIP_MIN_BYTES:
+                    compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+                    body = bytearray(compressor.compress(bytes(body)))
+            if len(body) > STREAM_MAX_BYTES:
+                break
+        else:
+            if compressor is not None:
+                body += compressor.flush()
+        if len(body) > STREAM_MAX_BYTES:
+            return json_response(413, {'error': 'Response too large, narrow the filters'})
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+    response_headers = {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS)
+    if compressor is None:
+        return {'statusCode': status, 'headers': response_headers, 'body': body.decode(), 'isBase64Encoded': False}
+    response_headers['Content-Encoding'] = 'gzip'
+    response_headers['Vary'] = 'Accept-Encoding'
+    return {'statusCode': status, 'headers': response_headers, 'body': base64.b64encode(body).decode(), 'isBase64Encoded': True}
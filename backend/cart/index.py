@@ -1,9 +1,123 @@
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import Statement, execute_prepared, get_connection, get_read_connection, instrument_handler, pin_primary, release_connection
+from response import json_response, preflight_response
+from user_tokens import authenticate
 
+CART_OPERATIONS = ('add', 'set', 'remove')
+RESERVATION_TTL = int(os.environ.get('CART_RESERVATION_TTL', '900'))
+
+RESERVE_SQL = """
+    WITH refreshed AS (
+        UPDATE cart_items SET reserved_until = CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s)
+        WHERE user_id = %(user_id)s AND plant_id = ANY(%(plant_ids)s)
+        RETURNING plant_id, quantity
+    )
+    SELECT r.plant_id, r.quantity AS requested,
+           GREATEST(p.stock - COALESCE(SUM(other.quantity), 0), 0) AS available
+    FROM refreshed r
+    JOIN plants p ON p.id = r.plant_id
+    LEFT JOIN cart_items other ON other.plant_id = r.plant_id
+        AND other.user_id <> %(user_id)s AND other.reserved_until > CURRENT_TIMESTAMP
+    WHERE p.stock IS NOT NULL
+    GROUP BY r.plant_id, r.quantity, p.stock
+    HAVING r.quantity > p.stock - COALESCE(SUM(other.quantity), 0)
+"""
+
+LOAD_CART = Statement('cart_load', """
+    SELECT ci.id, ci.quantity, ci.reserved_until, p.id as plant_id, p.name, p.price, p.image, p.category, p.stock
+    FROM cart_items ci
+    JOIN plants p ON ci.plant_id = p.id
+    WHERE ci.user_id = %s
+""")
+
+def load_cart(cur: Any, user_id: int) -> Dict[str, Any]:
+    execute_prepared(cur, LOAD_CART, (user_id,))
+    
+    items = [dict(row) for row in cur.fetchall()]
+    
+    total = sum(item['price'] * item['quantity'] for item in items)
+    
+    return {'items': items, 'total': float(total)}
+
+def fold_operations(operations: List[Dict[str, Any]]) -> Tuple[Dict[int, int], Dict[int, int]]:
+    '''
+    Collapses an ordered list of add/set/remove operations into the final
+    absolute quantity or relative delta per plant.
+    '''
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('operations must be a non-empty list')
+    
+    absolute: Dict[int, int] = {}
+    relative: Dict[int, int] = {}
+    for operation in operations:
+        try:
+            op = operation['op']
+            plant_id = int(operation['plant_id'])
+            quantity = int(operation.get('quantity', 1 if op == 'add' else 0))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Each operation needs op and plant_id')
+        if op not in CART_OPERATIONS:
+            raise ValueError('op must be one of: ' + ', '.join(CART_OPERATIONS))
+        if op == 'set' and quantity < 0:
+            raise ValueError('set quantity must not be negative')
+        
+        if op == 'add':
+            if plant_id in absolute:
+                absolute[plant_id] = max(0, absolute[plant_id] + quantity)
+            else:
+                relative[plant_id] = relative.get(plant_id, 0) + quantity
+        else:
+            relative.pop(plant_id, None)
+            absolute[plant_id] = quantity if op == 'set' else 0
+    
+    return absolute, {plant_id: delta for plant_id, delta in relative.items() if delta}
+
+def apply_operations(cur: Any, user_id: int, absolute: Dict[int, int], relative: Dict[int, int]) -> None:
+    removed = [plant_id for plant_id, quantity in absolute.items() if quantity == 0]
+    if removed:
+        cur.execute("DELETE FROM cart_items WHERE user_id = %s AND plant_id = ANY(%s)", (user_id, removed))
+    
+    updates = [
+        ({plant_id: q for plant_id, q in absolute.items() if q > 0}, 'EXCLUDED.quantity'),
+        (relative, 'cart_items.quantity + EXCLUDED.quantity'),
+    ]
+    for quantities, new_quantity in updates:
+        if not quantities:
+            continue
+        cur.execute(f"""
+            INSERT INTO cart_items (user_id, plant_id, quantity)
+            SELECT %s, unnest(%s::int[]), unnest(%s::int[])
+            ON CONFLICT (user_id, plant_id) DO UPDATE SET quantity = {new_quantity}
+        """, (user_id, list(quantities), list(quantities.values())))
+    
+    if relative:
+        cur.execute("DELETE FROM cart_items WHERE user_id = %s AND quantity <= 0", (user_id,))
+
+def reserve_items(cur: Any, user_id: int, plant_ids: List[int]) -> List[Dict[str, Any]]:
+    '''
+    Renews the reservation of the user's cart lines for the given plants for
+    CART_RESERVATION_TTL seconds and returns the lines asking for more than the
+    stock left after other carts' unexpired reservations. The plant rows are
+    locked like at checkout, which in turn only sells stock not reserved by
+    other carts, so a granted reservation holds until it expires.
+    '''
+    if not plant_ids:
+        return []
+    cur.execute(
+        "SELECT id FROM plants WHERE id = ANY(%s) AND stock IS NOT NULL ORDER BY id FOR NO KEY UPDATE",
+        (sorted(plant_ids),)
+    )
+    cur.execute(RESERVE_SQL, {'ttl': RESERVATION_TTL, 'user_id': user_id, 'plant_ids': plant_ids})
+    return [dict(row) for row in cur.fetchall()]
+
+def shortfall_response(shortfalls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return json_response(409, {'error': 'Not enough stock', 'shortfalls': shortfalls})
+
+@instrument_handler
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Shopping cart management API
@@ -13,105 +127,114 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    user_id = event.get('headers', {}).get('X-User-Id')
-    
-    if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'User not authenticated'})
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    conn.autocommit = True
+        return preflight_response('GET, POST, PUT, DELETE, OPTIONS', 'Content-Type, X-Auth-Token, Authorization, X-Read-Pin')
+    
+    claims = authenticate(event.get('headers'))
+    
+    if not claims:
+        return json_response(401, {'error': 'User not authenticated'})
+    
+    user_id = claims['uid']
+    
+    read_key = f'user:{user_id}'
+    
+    if method == 'GET':
+        conn = get_read_connection(read_key)
+    else:
+        # Writes that reserve stock run in a transaction so a shortfall can be rolled back
+        conn = get_connection(autocommit=method not in ('POST', 'PUT'))
+        pin_primary(read_key)
     
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if method == 'GET':
-                cur.execute("""
-                    SELECT ci.id, ci.quantity, p.id as plant_id, p.name, p.price, p.image, p.category
-                    FROM cart_items ci
-                    JOIN plants p ON ci.plant_id = p.id
-                    WHERE ci.user_id = %s
-                """, (user_id,))
-                
-                items = [dict(row) for row in cur.fetchall()]
-                
-                total = sum(item['price'] * item['quantity'] for item in items)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'items': items, 'total': float(total)})
-                }
+                return json_response(200, load_cart(cur, user_id), event)
             
             elif method == 'POST':
                 body_data = json.loads(event.get('body', '{}'))
-                plant_id = body_data.get('plant_id')
-                quantity = body_data.get('quantity', 1)
                 
-                cur.execute(
-                    "SELECT id, quantity FROM cart_items WHERE user_id = %s AND plant_id = %s",
-                    (user_id, plant_id)
-                )
-                existing = cur.fetchone()
+                if 'operations' in body_data:
+                    try:
+                        absolute, relative = fold_operations(body_data['operations'])
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                    
+                    increased = [plant_id for plant_id, quantity in absolute.items() if quantity > 0]
+                    increased += [plant_id for plant_id, delta in relative.items() if delta > 0]
+                    try:
+                        apply_operations(cur, user_id, absolute, relative)
+                        shortfalls = reserve_items(cur, user_id, increased)
+                        if shortfalls:
+                            conn.rollback()
+                            return shortfall_response(shortfalls)
+                        cart = load_cart(cur, user_id)
+                        conn.commit()
+                    except psycopg2.IntegrityError:
+                        conn.rollback()
+                        return json_response(400, {'error': 'Unknown plant in operations'})
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    
+                    return json_response(200, cart, event)
                 
-                if existing:
-                    new_quantity = existing['quantity'] + quantity
-                    cur.execute(
-                        "UPDATE cart_items SET quantity = %s WHERE id = %s RETURNING id, quantity",
-                        (new_quantity, existing['id'])
-                    )
-                else:
-                    cur.execute(
-                        "INSERT INTO cart_items (user_id, plant_id, quantity) VALUES (%s, %s, %s) RETURNING id, quantity",
-                        (user_id, plant_id, quantity)
-                    )
+                try:
+                    plant_id = int(body_data['plant_id'])
+                    quantity = int(body_data.get('quantity', 1))
+                except (KeyError, TypeError, ValueError):
+                    return json_response(400, {'error': 'plant_id and quantity must be integers'})
+                if quantity < 1:
+                    return json_response(400, {'error': 'quantity must be positive'})
                 
-                result = dict(cur.fetchone())
+                try:
+                    cur.execute("""
+                        INSERT INTO cart_items (user_id, plant_id, quantity) VALUES (%s, %s, %s)
+                        ON CONFLICT (user_id, plant_id)
+                        DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+                        RETURNING id, plant_id, quantity
+                    """, (user_id, plant_id, quantity))
+                    result = dict(cur.fetchone())
+                    shortfalls = reserve_items(cur, user_id, [result.pop('plant_id')])
+                    if shortfalls:
+                        conn.rollback()
+                        return shortfall_response(shortfalls)
+                    conn.commit()
+                except psycopg2.IntegrityError:
+                    conn.rollback()
+                    return json_response(400, {'error': 'Unknown plant'})
+                except Exception:
+                    conn.rollback()
+                    raise
                 
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(result)
-                }
+                return json_response(201, result)
             
             elif method == 'PUT':
                 body_data = json.loads(event.get('body', '{}'))
                 item_id = body_data.get('id')
                 quantity = body_data.get('quantity')
                 
-                cur.execute(
-                    "UPDATE cart_items SET quantity = %s WHERE id = %s AND user_id = %s RETURNING id, quantity",
-                    (quantity, item_id, user_id)
-                )
-                
-                result = cur.fetchone()
-                
-                if result:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(dict(result))
-                    }
+                try:
+                    cur.execute(
+                        "UPDATE cart_items SET quantity = %s WHERE id = %s AND user_id = %s RETURNING id, plant_id, quantity",
+                        (quantity, item_id, user_id)
+                    )
+                    result = cur.fetchone()
+                    
+                    if not result:
+                        conn.rollback()
+                        return json_response(404, {'error': 'Item not found'})
+                    
+                    result = dict(result)
+                    shortfalls = reserve_items(cur, user_id, [result.pop('plant_id')])
+                    if shortfalls:
+                        conn.rollback()
+                        return shortfall_response(shortfalls)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
                 
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Item not found'})
-                }
+                return json_response(200, result)
             
             elif method == 'DELETE':
                 params = event.get('queryStringParameters', {})
@@ -122,17 +245,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 else:
                     cur.execute("DELETE FROM cart_items WHERE user_id = %s", (user_id,))
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True})
     
     finally:
-        conn.close()
+        release_connection(conn)
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return json_response(405, {'error': 'Method not allowed'})
@@ -0,0 +1,189 @@
+'''
+Sales analytics for admins, served from summary tables instead of raw order
+history. Triggers on orders and order_items only append to sales_changes;
+catch_up() folds that log into the per-day summaries in batches (each batch
+is consumed with DELETE ... RETURNING, so concurrent folds never double count
+and late-committing transactions are not skipped), and rebuild() recomputes
+everything from scratch. Cancelled orders count towards the status
+breakdown only: moving an order into (or out of) cancelled logs signed
+reversals of its revenue and plant quantities.
+
+Usage: DATABASE_URL=... python backend/orders/analytics.py catch-up|rebuild
+'''
+import sys
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+CATCH_UP_BATCH = 50000
+DEFAULT_DAYS = 30
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+FOLD_SQL = """
+    WITH batch AS (
+        DELETE FROM sales_changes
+        WHERE id IN (SELECT id FROM sales_changes ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING kind, day, plant_id, quantity, amount, old_status, new_status, sign
+    ), daily AS (
+        INSERT INTO sales_daily (day, orders, revenue)
+        SELECT day, SUM(sign), COALESCE(SUM(amount), 0) FROM batch WHERE kind = 'order' GROUP BY day
+        ON CONFLICT (day) DO UPDATE
+        SET orders = sales_daily.orders + EXCLUDED.orders, revenue = sales_daily.revenue + EXCLUDED.revenue
+    ), statuses AS (
+        INSERT INTO sales_status_daily (day, status, orders)
+        SELECT day, status, SUM(delta) FROM (
+            SELECT day, new_status AS status, 1 AS delta FROM batch WHERE new_status IS NOT NULL
+            UNION ALL
+            SELECT day, old_status, -1 FROM batch WHERE old_status IS NOT NULL
+        ) changes
+        GROUP BY day, status
+        ON CONFLICT (day, status) DO UPDATE SET orders = sales_status_daily.orders + EXCLUDED.orders
+    ), plants AS (
+        INSERT INTO sales_plants_daily (day, plant_id, quantity, revenue)
+        SELECT day, plant_id, SUM(quantity), SUM(amount) FROM batch
+        WHERE kind = 'item' AND plant_id IS NOT NULL
+        GROUP BY day, plant_id
+        ON CONFLICT (day, plant_id) DO UPDATE
+        SET quantity = sales_plants_daily.quantity + EXCLUDED.quantity,
+            revenue = sales_plants_daily.revenue + EXCLUDED.revenue
+    )
+    SELECT COUNT(*) FROM batch
+"""
+
+REBUILD_SQL = [
+    "LOCK TABLE orders, order_items IN SHARE MODE",
+    "DELETE FROM sales_changes",
+    "TRUNCATE sales_daily, sales_status_daily, sales_plants_daily",
+    """
+    INSERT INTO sales_daily (day, orders, revenue)
+    SELECT created_at::date, COUNT(*), COALESCE(SUM(total_amount), 0) FROM orders
+    WHERE status IS DISTINCT FROM 'cancelled'
+    GROUP BY created_at::date
+    """,
+    """
+    INSERT INTO sales_status_daily (day, status, orders)
+    SELECT created_at::date, status, COUNT(*) FROM orders WHERE status IS NOT NULL GROUP BY created_at::date, status
+    """,
+    """
+    INSERT INTO sales_plants_daily (day, plant_id, quantity, revenue)
+    SELECT o.created_at::date, oi.plant_id, SUM(oi.quantity), SUM(oi.quantity * oi.price)
+    FROM order_items oi
+    JOIN orders o ON o.id = oi.order_id
+    WHERE oi.plant_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY o.created_at::date, oi.plant_id
+    """,
+]
+
+
+def catch_up(cur: Any, max_batches: Optional[int] = None) -> int:
+    '''Folds pending sales_changes into the summaries; returns how many changes were applied.'''
+    applied = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        cur.execute(FOLD_SQL, (CATCH_UP_BATCH,))
+        count = cur.fetchone()[0]
+        if not cur.connection.autocommit:
+            cur.connection.commit()
+        applied += count
+        batches += 1
+        if count < CATCH_UP_BATCH:
+            break
+    return applied
+
+
+def rebuild(conn: Any) -> None:
+    '''
+    Recomputes the summaries from orders and order_items in one transaction.
+    Order writes wait on the SHARE lock until it commits, so run it off-peak.
+    '''
+    with conn.cursor() as cur:
+        for statement in REBUILD_SQL:
+            cur.execute(statement)
+    conn.commit()
+
+
+def parse_day(value: Optional[str], default: date, name: str) -> date:
+    '''A day boundary; summaries are per day, so a time other than midnight is rejected.'''
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}, expected ISO date')
+    if parsed.time() != time.min:
+        raise ValueError(f'{name} must be a date, analytics are kept per day')
+    return parsed.date()
+
+
+def report(cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Daily revenue and order counts, order counts by status and top plants by
+    quantity from date_from (inclusive) to date_to (exclusive), like the order
+    feed and export filters; the default is the last 30 days including today.
+    Revenue, order counts and plants leave out cancelled orders. Reads only
+    the summary tables. Expects a RealDictCursor.
+    '''
+    date_to = parse_day(params.get('date_to'), date.today() + timedelta(days=1), 'date_to')
+    date_from = parse_day(params.get('date_from'), date_to - timedelta(days=DEFAULT_DAYS), 'date_from')
+    try:
+        top = max(1, min(int(params.get('top') or DEFAULT_TOP), MAX_TOP))
+    except ValueError:
+        raise ValueError('top must be an integer')
+
+    cur.execute(
+        "SELECT day, orders, revenue FROM sales_daily WHERE day >= %s AND day < %s ORDER BY day",
+        (date_from, date_to)
+    )
+    daily = [dict(row) for row in cur.fetchall()]
+
+    cur.execute("""
+        SELECT status, SUM(orders) AS orders FROM sales_status_daily
+        WHERE day >= %s AND day < %s
+        GROUP BY status
+        HAVING SUM(orders) <> 0
+        ORDER BY orders DESC
+    """, (date_from, date_to))
+    statuses = [dict(row) for row in cur.fetchall()]
+
+    cur.execute("""
+        SELECT s.plant_id, p.name, SUM(s.quantity) AS quantity, SUM(s.revenue) AS revenue
+        FROM sales_plants_daily s
+        LEFT JOIN plants p ON p.id = s.plant_id
+        WHERE s.day >= %s AND s.day < %s
+        GROUP BY s.plant_id, p.name
+        HAVING SUM(s.quantity) > 0
+        ORDER BY quantity DESC, s.plant_id
+        LIMIT %s
+    """, (date_from, date_to, top))
+    top_plants = [dict(row) for row in cur.fetchall()]
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'revenue': sum(row['revenue'] for row in daily),
+        'orders': sum(row['orders'] for row in daily),
+        'daily': daily,
+        'statuses': statuses,
+        'top_plants': top_plants,
+    }
+
+
+def main(argv: List[str]) -> None:
+    from db import get_connection, release_connection
+
+    if len(argv) != 1 or argv[0] not in ('catch-up', 'rebuild'):
+        raise SystemExit(__doc__)
+    conn = get_connection()
+    try:
+        if argv[0] == 'rebuild':
+            rebuild(conn)
+            print('summaries rebuilt')
+        else:
+            with conn.cursor() as cur:
+                print('applied %d changes' % catch_up(cur))
+    finally:
+        release_connection(conn)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
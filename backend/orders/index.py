@@ -1,9 +1,395 @@
+import base64
+import csv
+import io
 import json
 import os
-from typing import Dict, Any
-import psycopg2
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import psycopg2.errors
 from psycopg2.extras import RealDictCursor
+from db import Statement, execute_prepared, get_connection, get_read_connection, instrument_handler, pin_primary, release_connection
+from admin_session import has_admin_credentials, is_admin
+from user_tokens import authenticate
+from analytics import catch_up, report
+from ledger import balance_history, charge_order
+from response import dumps, json_response, preflight_response, stream_response
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_ITERSIZE = int(os.environ.get('ORDERS_EXPORT_ITERSIZE', '2000'))
+EXPORT_CHUNK_CHARS = 64 * 1024
+STOCK_LOCK_TIMEOUT_MS = int(os.environ.get('ORDERS_STOCK_LOCK_TIMEOUT_MS', '2000'))
+ANALYTICS_CATCH_UP_BATCHES = int(os.environ.get('ORDERS_ANALYTICS_CATCH_UP_BATCHES', '4'))
+BULK_STATUS_LIMIT = int(os.environ.get('ORDERS_BULK_STATUS_LIMIT', '10000'))
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+def attach_items(cur: Any, orders: List[Dict[str, Any]], with_image: bool) -> None:
+    '''Loads items for all given orders in one query and attaches them as order['items'].'''
+    items_by_order: Dict[int, List[Dict[str, Any]]] = {}
+    for order in orders:
+        order['items'] = items_by_order.setdefault(order['id'], [])
+    
+    if not orders:
+        return
+    
+    image_column = ', p.image' if with_image else ''
+    cur.execute(f"""
+        SELECT oi.order_id, oi.quantity, oi.price, p.name{image_column}
+        FROM order_items oi
+        LEFT JOIN plants p ON oi.plant_id = p.id
+        WHERE oi.order_id = ANY(%s)
+        ORDER BY oi.id
+    """, (list(items_by_order),))
+    
+    for row in cur.fetchall():
+        item = dict(row)
+        items_by_order[item.pop('order_id')].append(item)
+
+def encode_cursor(order: Dict[str, Any]) -> str:
+    raw = json.dumps([order['created_at'].isoformat(), order['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def parse_date(value: str, name: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}, expected ISO date')
+
+def order_filters(params: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    '''Status, user_id, date_from (inclusive) and date_to (exclusive) conditions on orders o.'''
+    conditions: List[str] = []
+    args: List[Any] = []
+    
+    if params.get('status'):
+        conditions.append('o.status = %s')
+        args.append(params['status'])
+    if params.get('user_id'):
+        conditions.append('o.user_id = %s')
+        args.append(params['user_id'])
+    if params.get('date_from'):
+        conditions.append('o.created_at >= %s')
+        args.append(parse_date(params['date_from'], 'date_from'))
+    if params.get('date_to'):
+        conditions.append('o.created_at < %s')
+        args.append(parse_date(params['date_to'], 'date_to'))
+    
+    return conditions, args
+
+def admin_feed_filters(params: Dict[str, Any]) -> Tuple[int, str, List[Any]]:
+    '''
+    Builds the WHERE clause for the admin orders feed.
+    Supports limit, cursor (from X-Next-Cursor) and the order_filters fields.
+    '''
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    
+    conditions, args = order_filters(params)
+    if params.get('cursor'):
+        conditions.append('(o.created_at, o.id) < (%s, %s)')
+        args.extend(decode_cursor(params['cursor']))
+    
+    where_sql = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return limit, where_sql, args
+
+EXPORT_COLUMNS = [
+    'order_id', 'created_at', 'status', 'user_id', 'email', 'full_name', 'phone',
+    'delivery_address', 'total_amount', 'plant_id', 'plant_name', 'quantity', 'price'
+]
+ORDER_FIELDS = 9
+
+def iter_order_export(conn: Any, export_format: str, params: Dict[str, Any]) -> Iterator[str]:
+    '''
+    Streams orders with their items as CSV (one line per item) or NDJSON (one
+    object per order) text chunks. Rows come from a named server-side cursor in
+    batches of EXPORT_ITERSIZE, so memory stays flat regardless of table size.
+    The connection must not be in autocommit mode.
+    '''
+    conditions, args = order_filters(params)
+    where_sql = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if export_format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    
+    current: Optional[Dict[str, Any]] = None
+    with conn.cursor(name='orders_export') as cur:
+        cur.itersize = EXPORT_ITERSIZE
+        cur.execute(f"""
+            SELECT o.id, o.created_at, o.status, o.user_id, u.email, u.full_name, u.phone,
+                   o.delivery_address, o.total_amount, oi.plant_id, p.name, oi.quantity, oi.price
+            FROM orders o
+            JOIN users u ON o.user_id = u.id
+            LEFT JOIN order_items oi ON oi.order_id = o.id
+            LEFT JOIN plants p ON oi.plant_id = p.id
+            {where_sql}
+            ORDER BY o.created_at, o.id, oi.id
+        """, args)
+        
+        for row in cur:
+            if export_format == 'csv':
+                writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+            else:
+                if current is None or current['order_id'] != row[0]:
+                    if current is not None:
+                        buffer.write(dumps(current) + '\n')
+                    current = dict(zip(EXPORT_COLUMNS[:ORDER_FIELDS], row[:ORDER_FIELDS]))
+                    current['items'] = []
+                if row[9] is not None:
+                    current['items'].append(dict(zip(EXPORT_COLUMNS[ORDER_FIELDS:], row[ORDER_FIELDS:])))
+            
+            if buffer.tell() >= EXPORT_CHUNK_CHARS:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    
+    if current is not None:
+        buffer.write(dumps(current) + '\n')
+    if buffer.tell():
+        yield buffer.getvalue()
+
+ORDER_DETAIL = Statement('orders_detail', """
+    SELECT o.id, o.user_id, o.total_amount, o.status, o.delivery_address, o.created_at,
+           u.full_name, u.email, u.phone
+    FROM orders o
+    JOIN users u ON o.user_id = u.id
+    WHERE o.id = %s
+""")
+
+ORDER_DETAIL_ITEMS = Statement('orders_detail_items', """
+    SELECT oi.quantity, oi.price, p.name, p.image
+    FROM order_items oi
+    LEFT JOIN plants p ON oi.plant_id = p.id
+    WHERE oi.order_id = %s
+""")
+
+PLACE_ORDER_SQL = """
+    WITH lines AS (
+        SELECT l.plant_id, l.quantity, p.price
+        FROM jsonb_to_recordset(%(lines)s::jsonb) AS l(plant_id INTEGER, quantity INTEGER)
+        JOIN plants p ON p.id = l.plant_id
+    ), new_order AS (
+        INSERT INTO orders (user_id, total_amount, delivery_address, status)
+        SELECT %(user_id)s, COALESCE(SUM(price * quantity), 0), %(delivery_address)s, %(status)s
+        FROM lines
+        RETURNING id, total_amount
+    ), new_items AS (
+        INSERT INTO order_items (order_id, plant_id, quantity, price)
+        SELECT new_order.id, lines.plant_id, lines.quantity, lines.price
+        FROM new_order, lines
+        RETURNING plant_id
+    ), cleared_cart AS (
+        DELETE FROM cart_items WHERE user_id = %(user_id)s
+    ), queued AS (
+        INSERT INTO outbox (topic, payload)
+        SELECT 'order_confirmation', jsonb_build_object('order_id', new_order.id) FROM new_order
+    )
+    SELECT new_order.id, new_order.total_amount, (SELECT COUNT(*) FROM new_items) AS item_count
+    FROM new_order
+"""
+
+def take_stock(cur: Any, user_id: int, lines: List[Dict[str, int]]) -> List[Dict[str, int]]:
+    '''
+    Locks the stock-tracked plants of an order in plant id order (so concurrent
+    checkouts cannot deadlock) and decrements them with a conditional UPDATE.
+    Stock held by other users' unexpired cart reservations is not available;
+    the buyer's own reservation is consumed with the cart in PLACE_ORDER_SQL.
+    Returns the shortfalls; when there are any nothing has been decremented and
+    the caller must roll back. Plants with stock NULL are not limited.
+    '''
+    quantities = {line['plant_id']: line['quantity'] for line in lines}
+    cur.execute("""
+        SELECT p.id, p.stock - COALESCE((
+            SELECT SUM(c.quantity) FROM cart_items c
+            WHERE c.plant_id = p.id AND c.user_id <> %s AND c.reserved_until > CURRENT_TIMESTAMP
+        ), 0) AS available
+        FROM plants p
+        WHERE p.id = ANY(%s) AND p.stock IS NOT NULL
+        ORDER BY p.id
+        FOR NO KEY UPDATE OF p
+    """, (user_id, sorted(quantities)))
+    available = {row['id']: row['available'] for row in cur.fetchall()}
+    
+    shortfalls = [
+        {'plant_id': plant_id, 'requested': quantities[plant_id], 'available': max(left, 0)}
+        for plant_id, left in available.items() if left < quantities[plant_id]
+    ]
+    if shortfalls or not available:
+        return shortfalls
+    
+    cur.execute("""
+        UPDATE plants SET stock = plants.stock - r.quantity, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::int[], %s::int[]) AS r(plant_id, quantity)
+        WHERE plants.id = r.plant_id AND plants.stock >= r.quantity
+    """, (list(available), [quantities[plant_id] for plant_id in available]))
+    return []
+
+def merge_order_lines(items: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+    '''Validates client line items and merges duplicates; client prices are ignored.'''
+    quantities: Dict[int, int] = {}
+    for item in items:
+        try:
+            plant_id = int(item['plant_id'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Each item needs plant_id and quantity')
+        if quantity <= 0:
+            raise ValueError('Item quantity must be positive')
+        quantities[plant_id] = quantities.get(plant_id, 0) + quantity
+    return [{'plant_id': plant_id, 'quantity': quantity} for plant_id, quantity in quantities.items()]
+
+CHANGE_STATUS_SQL = """
+    WITH changed AS (
+        UPDATE orders o SET status = %(status)s
+        FROM unnest(%(ids)s::int[], %(old_statuses)s::varchar[]) AS c(id, old_status)
+        WHERE o.id = c.id AND o.status = c.old_status
+        RETURNING o.id, c.old_status
+    ), history AS (
+        INSERT INTO order_status_history (order_id, old_status, new_status)
+        SELECT id, old_status, %(status)s FROM changed
+    ), restocked AS (
+        UPDATE plants p SET stock = p.stock + r.quantity, updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT oi.plant_id, SUM(oi.quantity) AS quantity
+            FROM order_items oi
+            JOIN changed ON changed.id = oi.order_id
+            WHERE %(cancelling)s
+            GROUP BY oi.plant_id
+        ) r
+        WHERE p.id = r.plant_id AND p.stock IS NOT NULL
+    ), refunds AS (
+        SELECT l.email, l.order_id, -SUM(l.balance_delta) AS balance_delta, -SUM(l.cashback_delta) AS cashback_delta
+        FROM balance_ledger l
+        JOIN changed ON changed.id = l.order_id
+        WHERE %(cancelling)s
+        GROUP BY l.email, l.order_id
+        HAVING SUM(l.balance_delta) <> 0 OR SUM(l.cashback_delta) <> 0
+    ), refund_entries AS (
+        INSERT INTO balance_ledger (email, order_id, kind, balance_delta, cashback_delta)
+        SELECT email, order_id, 'refund', balance_delta, cashback_delta FROM refunds
+    ), refunded AS (
+        UPDATE user_balances b
+        SET balance = b.balance + r.balance_delta, cashback = b.cashback + r.cashback_delta, updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT email, SUM(balance_delta) AS balance_delta, SUM(cashback_delta) AS cashback_delta
+            FROM refunds
+            GROUP BY email
+        ) r
+        WHERE b.email = r.email
+    )
+    SELECT COUNT(*) AS changed FROM changed
+"""
+
+def parse_status_targets(body_data: Dict[str, Any]) -> Tuple[Optional[List[int]], Optional[Dict[str, Any]]]:
+    '''Returns (order_ids, None) or (None, filters) from a bulk status request body.'''
+    order_ids = body_data.get('order_ids')
+    filters = body_data.get('filter')
+    
+    if order_ids is not None:
+        if not isinstance(order_ids, list) or not order_ids:
+            raise ValueError('order_ids must be a non-empty list')
+        try:
+            order_ids = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+        except (TypeError, ValueError):
+            raise ValueError('order_ids must be integers')
+        if len(order_ids) > BULK_STATUS_LIMIT:
+            raise ValueError(f'At most {BULK_STATUS_LIMIT} orders per request')
+        return order_ids, None
+    
+    if not isinstance(filters, dict):
+        raise ValueError('Missing order_ids or filter')
+    if not order_filters(filters)[0]:
+        raise ValueError('filter needs at least one of status, user_id, date_from, date_to')
+    return None, filters
+
+def change_order_status(cur: Any, status: str, order_ids: Optional[List[int]], filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Moves orders to status along order_status_transitions in one statement and
+    records order_status_history; cancelling returns items to tracked stock and
+    reverses balance payments and cashback through the ledger. Orders, plants
+    and balances are locked in that order (and by key) first, so concurrent
+    bulk calls and checkouts cannot deadlock. Must run inside a transaction; a ValueError
+    leaves it for the caller to roll back.
+    '''
+    cur.execute("SELECT from_status FROM order_status_transitions WHERE to_status = %s", (status,))
+    allowed = {row['from_status'] for row in cur.fetchall()}
+    if not allowed:
+        raise ValueError(f'Unknown status: {status}')
+    
+    if order_ids is not None:
+        cur.execute("SELECT id, status FROM orders WHERE id = ANY(%s) ORDER BY id FOR NO KEY UPDATE", (order_ids,))
+    else:
+        conditions, args = order_filters(filters)
+        cur.execute(f"""
+            SELECT o.id, o.status FROM orders o
+            WHERE {' AND '.join(conditions)}
+            ORDER BY o.id
+            LIMIT %s
+            FOR NO KEY UPDATE
+        """, args + [BULK_STATUS_LIMIT + 1])
+    current = {row['id']: row['status'] for row in cur.fetchall()}
+    
+    if order_ids is None:
+        if len(current) > BULK_STATUS_LIMIT:
+            raise ValueError(f'filter matches more than {BULK_STATUS_LIMIT} orders')
+        order_ids = list(current)
+    
+    movable = [order_id for order_id, old_status in current.items() if old_status in allowed]
+    if movable:
+        cancelling = status == 'cancelled'
+        if cancelling:
+            cur.execute("""
+                SELECT id FROM plants
+                WHERE stock IS NOT NULL AND id IN (SELECT plant_id FROM order_items WHERE order_id = ANY(%s))
+                ORDER BY id
+                FOR NO KEY UPDATE
+            """, (movable,))
+            cur.execute("""
+                SELECT id FROM user_balances
+                WHERE email IN (SELECT email FROM balance_ledger WHERE order_id = ANY(%s))
+                ORDER BY email
+                FOR NO KEY UPDATE
+            """, (movable,))
+        cur.execute(CHANGE_STATUS_SQL, {
+            'status': status,
+            'ids': movable,
+            'old_statuses': [current[order_id] for order_id in movable],
+            'cancelling': cancelling
+        })
+    
+    results: List[Dict[str, Any]] = []
+    counts = {'updated': 0, 'unchanged': 0, 'rejected': 0, 'not_found': 0}
+    for order_id in order_ids:
+        if order_id not in current:
+            result = {'order_id': order_id, 'result': 'not_found'}
+        elif current[order_id] == status:
+            result = {'order_id': order_id, 'result': 'unchanged', 'status': status}
+        elif current[order_id] in allowed:
+            result = {'order_id': order_id, 'result': 'updated', 'previous_status': current[order_id], 'status': status}
+        else:
+            result = {
+                'order_id': order_id,
+                'result': 'rejected',
+                'status': current[order_id],
+                'error': f'Cannot change status from {current[order_id]} to {status}'
+            }
+        counts[result['result']] += 1
+        results.append(result)
+    
+    return {'status': status, **counts, 'results': results}
+
+@instrument_handler
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Order management API for users and admin
@@ -13,198 +399,241 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Admin-Password',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    conn.autocommit = True
+        return preflight_response('GET, POST, PUT, OPTIONS', 'Content-Type, X-Auth-Token, Authorization, X-Admin-Password, X-Admin-Token, X-Read-Pin')
+    
+    params = event.get('queryStringParameters') or {}
+    export_format = params.get('export') if method == 'GET' else None
+    
+    claims = authenticate(event.get('headers'))
+    analytics_requested = method == 'GET' and bool(params.get('analytics'))
+    
+    if analytics_requested:
+        # Folding pending sales changes writes the summaries, so this goes to the primary
+        conn = get_connection(autocommit=True)
+    elif method == 'GET':
+        # Exports use a named cursor, which needs a transaction
+        conn = get_read_connection(f"user:{claims['uid']}" if claims else 'orders', autocommit=not export_format)
+    else:
+        # Order placement and status changes each run in one transaction
+        conn = get_connection(autocommit=method not in ('POST', 'PUT'))
+        pin_primary(f"user:{claims['uid']}" if claims and method == 'POST' else 'orders')
     
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if method == 'GET':
-                user_id = event.get('queryStringParameters', {}).get('user_id')
-                order_id = event.get('queryStringParameters', {}).get('order_id')
-                admin_password = event.get('headers', {}).get('X-Admin-Password')
+                order_id = params.get('order_id')
+                admin_requested = has_admin_credentials(event.get('headers'))
                 
                 if order_id:
-                    cur.execute("""
-                        SELECT o.id, o.user_id, o.total_amount, o.status, o.delivery_address, o.created_at,
-                               u.full_name, u.email, u.phone
-                        FROM orders o
-                        JOIN users u ON o.user_id = u.id
-                        WHERE o.id = %s
-                    """, (order_id,))
+                    execute_prepared(cur, ORDER_DETAIL, (order_id,))
                     order = cur.fetchone()
+                    is_owner = order is not None and claims is not None and claims['uid'] == order['user_id']
                     
-                    if not order:
-                        return {
-                            'statusCode': 404,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Order not found'})
-                        }
+                    if not order or not (is_owner or (admin_requested and is_admin(event.get('headers'), conn))):
+                        return json_response(404, {'error': 'Order not found'})
                     
-                    cur.execute("""
-                        SELECT oi.quantity, oi.price, p.name, p.image
-                        FROM order_items oi
-                        LEFT JOIN plants p ON oi.plant_id = p.id
-                        WHERE oi.order_id = %s
-                    """, (order_id,))
+                    execute_prepared(cur, ORDER_DETAIL_ITEMS, (order_id,))
                     items = [dict(row) for row in cur.fetchall()]
                     
                     order = dict(order)
                     order['items'] = items
                     
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(order)
-                    }
+                    return json_response(200, order)
                 
-                if admin_password:
-                    cur.execute("""
+                if params.get('balance'):
+                    if admin_requested and params.get('email'):
+                        if not is_admin(event.get('headers'), conn):
+                            return json_response(401, {'error': 'Unauthorized'})
+                        email = params['email']
+                    elif claims:
+                        cur.execute("SELECT email FROM users WHERE id = %s", (claims['uid'],))
+                        user = cur.fetchone()
+                        if not user:
+                            return json_response(404, {'error': 'User not found'})
+                        email = user['email']
+                    else:
+                        return json_response(401, {'error': 'User not authenticated'})
+                    
+                    try:
+                        payload, next_cursor = balance_history(cur, email, params)
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                    
+                    headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+                    if next_cursor:
+                        headers['X-Next-Cursor'] = next_cursor
+                    return json_response(200, payload, event, headers)
+                
+                if analytics_requested:
+                    if not (admin_requested and is_admin(event.get('headers'), conn)):
+                        return json_response(401, {'error': 'Unauthorized'})
+                    
+                    with conn.cursor() as log_cur:
+                        catch_up(log_cur, max_batches=ANALYTICS_CATCH_UP_BATCHES)
+                    try:
+                        return json_response(200, report(cur, params), event)
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                
+                if export_format:
+                    if not (admin_requested and is_admin(event.get('headers'), conn)):
+                        return json_response(401, {'error': 'Unauthorized'})
+                    if export_format not in EXPORT_CONTENT_TYPES:
+                        return json_response(400, {'error': 'export must be csv or ndjson'})
+                    
+                    try:
+                        order_filters(params)
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                    
+                    filename = 'orders-%s.%s' % (datetime.now().strftime('%Y%m%d'), export_format)
+                    return stream_response(200, iter_order_export(conn, export_format, params), event, {
+                        'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+                        'Content-Disposition': f'attachment; filename="{filename}"',
+                        'Access-Control-Expose-Headers': 'Content-Disposition'
+                    })
+                
+                if admin_requested:
+                    if not is_admin(event.get('headers'), conn):
+                        return json_response(401, {'error': 'Unauthorized'})
+                    
+                    try:
+                        limit, where_sql, where_args = admin_feed_filters(params)
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                    
+                    cur.execute(f"""
                         SELECT o.id, o.user_id, o.total_amount, o.status, o.delivery_address, o.created_at,
                                u.full_name, u.email, u.phone
                         FROM orders o
                         JOIN users u ON o.user_id = u.id
-                        ORDER BY o.created_at DESC
-                    """)
+                        {where_sql}
+                        ORDER BY o.created_at DESC, o.id DESC
+                        LIMIT %s
+                    """, where_args + [limit + 1])
                     orders = [dict(row) for row in cur.fetchall()]
                     
-                    for order in orders:
-                        cur.execute("""
-                            SELECT oi.quantity, oi.price, p.name
-                            FROM order_items oi
-                            LEFT JOIN plants p ON oi.plant_id = p.id
-                            WHERE oi.order_id = %s
-                        """, (order['id'],))
-                        order['items'] = [dict(row) for row in cur.fetchall()]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(orders)
-                    }
-                
-                if user_id:
+                    headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+                    if len(orders) > limit:
+                        orders = orders[:limit]
+                        headers['X-Next-Cursor'] = encode_cursor(orders[-1])
+                    
+                    attach_items(cur, orders, with_image=False)
+                    
+                    return json_response(200, orders, event, headers)
+                
+                if claims:
                     cur.execute("""
                         SELECT o.id, o.total_amount, o.status, o.delivery_address, o.created_at
                         FROM orders o
                         WHERE o.user_id = %s
                         ORDER BY o.created_at DESC
-                    """, (user_id,))
+                    """, (claims['uid'],))
                     orders = [dict(row) for row in cur.fetchall()]
+                    attach_items(cur, orders, with_image=True)
                     
-                    for order in orders:
-                        cur.execute("""
-                            SELECT oi.quantity, oi.price, p.name, p.image
-                            FROM order_items oi
-                            LEFT JOIN plants p ON oi.plant_id = p.id
-                            WHERE oi.order_id = %s
-                        """, (order['id'],))
-                        order['items'] = [dict(row) for row in cur.fetchall()]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(orders)
-                    }
-                
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required parameters'})
-                }
+                    return json_response(200, orders, event)
+                
+                return json_response(401, {'error': 'User not authenticated'})
             
             elif method == 'POST':
+                if not claims:
+                    return json_response(401, {'error': 'User not authenticated'})
+                
                 body_data = json.loads(event.get('body', '{}'))
-                user_id = body_data.get('user_id')
+                user_id = claims['uid']
                 items = body_data.get('items', [])
                 delivery_address = body_data.get('delivery_address', '')
+                payment_method = body_data.get('payment_method') or 'card'
+                
+                if not items:
+                    return json_response(400, {'error': 'Missing items'})
+                if payment_method not in ('card', 'balance'):
+                    return json_response(400, {'error': 'payment_method must be card or balance'})
                 
-                if not user_id or not items:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Missing user_id or items'})
-                    }
-                
-                total_amount = sum(item['price'] * item['quantity'] for item in items)
-                
-                cur.execute(
-                    "INSERT INTO orders (user_id, total_amount, delivery_address, status) VALUES (%s, %s, %s, %s) RETURNING id",
-                    (user_id, total_amount, delivery_address, 'pending')
-                )
-                order_id = cur.fetchone()['id']
-                
-                for item in items:
-                    cur.execute(
-                        "INSERT INTO order_items (order_id, plant_id, quantity, price) VALUES (%s, %s, %s, %s)",
-                        (order_id, item['plant_id'], item['quantity'], item['price'])
-                    )
-                
-                cur.execute("DELETE FROM cart_items WHERE user_id = %s", (user_id,))
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'order_id': order_id, 'total_amount': float(total_amount)})
-                }
+                try:
+                    lines = merge_order_lines(items)
+                except ValueError as e:
+                    return json_response(400, {'error': str(e)})
+                
+                try:
+                    cur.execute(PLACE_ORDER_SQL, {
+                        'lines': json.dumps(lines),
+                        'user_id': user_id,
+                        'delivery_address': delivery_address,
+                        'status': 'paid' if payment_method == 'balance' else 'pending'
+                    })
+                    placed = cur.fetchone()
+                    
+                    if placed['item_count'] != len(lines):
+                        conn.rollback()
+                        return json_response(400, {'error': 'Unknown plant in order items'})
+                    
+                    # Stock rows are locked last so they are held only until the commit below
+                    if STOCK_LOCK_TIMEOUT_MS > 0:
+                        cur.execute("SELECT set_config('lock_timeout', %s, true)", (f'{STOCK_LOCK_TIMEOUT_MS}ms',))
+                    shortfalls = take_stock(cur, user_id, lines)
+                    if shortfalls:
+                        conn.rollback()
+                        return json_response(409, {'error': 'Not enough stock', 'shortfalls': shortfalls})
+                    
+                    charged = None
+                    if payment_method == 'balance':
+                        # The balance row is locked last, after stock, and held only until the commit
+                        charged = charge_order(cur, user_id, placed['id'], placed['total_amount'])
+                        if charged is None:
+                            conn.rollback()
+                            return json_response(402, {'error': 'Insufficient balance'})
+                    
+                    conn.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    conn.rollback()
+                    return json_response(503, {'error': 'Stock is busy, please retry'}, headers={'Retry-After': '1'})
+                except Exception:
+                    conn.rollback()
+                    raise
+                
+                result = {'order_id': placed['id'], 'total_amount': float(placed['total_amount'])}
+                if charged:
+                    result.update(balance=charged['balance'], cashback=charged['cashback'])
+                return json_response(201, result)
             
             elif method == 'PUT':
-                admin_password = event.get('headers', {}).get('X-Admin-Password')
-                
-                if not admin_password:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Unauthorized'})
-                    }
+                if not is_admin(event.get('headers'), conn):
+                    return json_response(401, {'error': 'Unauthorized'})
                 
                 body_data = json.loads(event.get('body', '{}'))
                 order_id = body_data.get('order_id')
                 status = body_data.get('status')
                 
-                if not order_id or not status:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Missing order_id or status'})
-                    }
-                
-                cur.execute(
-                    "UPDATE orders SET status = %s WHERE id = %s RETURNING id, status",
-                    (status, order_id)
-                )
-                
-                result = cur.fetchone()
-                
-                if result:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(dict(result))
-                    }
-                
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Order not found'})
-                }
+                if not status or not (order_id or 'order_ids' in body_data or 'filter' in body_data):
+                    return json_response(400, {'error': 'Missing order_id or status'})
+                
+                try:
+                    if order_id:
+                        order_ids, filters = parse_status_targets({'order_ids': [order_id]})
+                    else:
+                        order_ids, filters = parse_status_targets(body_data)
+                    outcome = change_order_status(cur, status, order_ids, filters)
+                    conn.commit()
+                except ValueError as e:
+                    conn.rollback()
+                    return json_response(400, {'error': str(e)})
+                except Exception:
+                    conn.rollback()
+                    raise
+                
+                if not order_id:
+                    return json_response(200, outcome, event)
+                
+                result = outcome['results'][0]
+                if result['result'] == 'not_found':
+                    return json_response(404, {'error': 'Order not found'})
+                if result['result'] == 'rejected':
+                    return json_response(409, {'error': result['error'], 'status': result['status']})
+                return json_response(200, {'id': result['order_id'], 'status': result['status']})
     
     finally:
-        conn.close()
+        release_connection(conn)
     
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'})
-    }
+    return json_response(405, {'error': 'Method not allowed'})
@@ -0,0 +1,209 @@
+'''
+Balance and cashback ledger on top of user_balances (keyed by email). Every
+change is an appended balance_ledger row; user_balances keeps the running
+totals and is changed in the same statement with relative increments
+(balance = balance + delta), so concurrent orders for one user queue on that
+row instead of overwriting each other. reconcile() recomputes the totals from
+the ledger in one pass.
+
+Usage:
+    DATABASE_URL=... python backend/orders/ledger.py reconcile [--fix]
+    DATABASE_URL=... python backend/orders/ledger.py adjust EMAIL BALANCE_DELTA [CASHBACK_DELTA] [--comment TEXT]
+'''
+import argparse
+import os
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+CASHBACK_PERCENT = Decimal(os.environ.get('ORDERS_CASHBACK_PERCENT', '5'))
+DEFAULT_HISTORY = 50
+MAX_HISTORY = 500
+
+POST_ENTRY_SQL = """
+    WITH entry AS (
+        INSERT INTO balance_ledger (email, order_id, kind, balance_delta, cashback_delta, comment)
+        VALUES (%(email)s, %(order_id)s, %(kind)s, %(balance_delta)s, %(cashback_delta)s, %(comment)s)
+        RETURNING email, balance_delta, cashback_delta
+    )
+    INSERT INTO user_balances (email, balance, cashback)
+    SELECT email, balance_delta, cashback_delta FROM entry
+    ON CONFLICT (email) DO UPDATE
+    SET balance = COALESCE(user_balances.balance, 0) + EXCLUDED.balance,
+        cashback = COALESCE(user_balances.cashback, 0) + EXCLUDED.cashback,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING balance, cashback
+"""
+
+CHARGE_ORDER_SQL = """
+    WITH debited AS (
+        UPDATE user_balances b
+        SET balance = b.balance - %(amount)s,
+            cashback = COALESCE(b.cashback, 0) + %(cashback)s,
+            updated_at = CURRENT_TIMESTAMP
+        FROM users u
+        WHERE u.id = %(user_id)s AND b.email = u.email AND b.balance >= %(amount)s
+        RETURNING b.email, b.balance, b.cashback
+    ), entries AS (
+        INSERT INTO balance_ledger (email, order_id, kind, balance_delta, cashback_delta)
+        SELECT debited.email, %(order_id)s, e.kind, e.balance_delta, e.cashback_delta
+        FROM debited,
+             (VALUES ('payment', -%(amount)s, 0), ('cashback', 0, %(cashback)s)) AS e(kind, balance_delta, cashback_delta)
+        WHERE e.balance_delta <> 0 OR e.cashback_delta <> 0
+    )
+    SELECT balance, cashback FROM debited
+"""
+
+DRIFT_SQL = """
+    WITH totals AS (
+        SELECT email, SUM(balance_delta) AS balance, SUM(cashback_delta) AS cashback
+        FROM balance_ledger
+        GROUP BY email
+    )
+    SELECT COALESCE(b.email, t.email) AS email,
+           b.balance AS stored_balance, COALESCE(t.balance, 0) AS ledger_balance,
+           b.cashback AS stored_cashback, COALESCE(t.cashback, 0) AS ledger_cashback
+    FROM user_balances b
+    FULL JOIN totals t ON t.email = b.email
+    WHERE COALESCE(b.balance, 0) <> COALESCE(t.balance, 0)
+       OR COALESCE(b.cashback, 0) <> COALESCE(t.cashback, 0)
+    ORDER BY 1
+"""
+
+FIX_SQL = """
+    INSERT INTO user_balances (email, balance, cashback)
+    SELECT * FROM unnest(%s::varchar[], %s::int[], %s::int[])
+    ON CONFLICT (email) DO UPDATE
+    SET balance = EXCLUDED.balance, cashback = EXCLUDED.cashback, updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def order_charge(total_amount: Any) -> Tuple[int, int]:
+    '''Whole rubles to debit for an order total (rounded up) and the cashback it earns (rounded down).'''
+    total = Decimal(str(total_amount))
+    amount = int(total.to_integral_value(rounding=ROUND_CEILING))
+    cashback = int((total * CASHBACK_PERCENT / 100).to_integral_value(rounding=ROUND_FLOOR))
+    return amount, cashback
+
+
+def charge_order(cur: Any, user_id: int, order_id: int, total_amount: Any) -> Optional[Dict[str, Any]]:
+    '''
+    Debits the order total from the user's balance and credits cashback, with
+    ledger entries, in the caller's transaction. Returns the new totals, or
+    None when the balance is too low (nothing was changed then).
+    '''
+    amount, cashback = order_charge(total_amount)
+    cur.execute(CHARGE_ORDER_SQL, {'user_id': user_id, 'order_id': order_id, 'amount': amount, 'cashback': cashback})
+    return cur.fetchone()
+
+
+def post_entry(cur: Any, email: str, kind: str, balance_delta: int, cashback_delta: int = 0,
+               order_id: Optional[int] = None, comment: Optional[str] = None) -> Any:
+    '''Appends one ledger entry and applies it to user_balances; returns the new (balance, cashback) row.'''
+    cur.execute(POST_ENTRY_SQL, {
+        'email': email,
+        'order_id': order_id,
+        'kind': kind,
+        'balance_delta': balance_delta,
+        'cashback_delta': cashback_delta,
+        'comment': comment,
+    })
+    return cur.fetchone()
+
+
+def balance_history(cur: Any, email: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    '''
+    Current balance and cashback plus ledger entries newest first, paged by
+    limit and cursor (the last entry id of the previous page). Returns the
+    payload and the next cursor. Expects a RealDictCursor.
+    '''
+    try:
+        limit = max(1, min(int(params.get('limit') or DEFAULT_HISTORY), MAX_HISTORY))
+        before = int(params['cursor']) if params.get('cursor') else None
+    except ValueError:
+        raise ValueError('Invalid limit or cursor')
+
+    cur.execute("SELECT balance, cashback FROM user_balances WHERE email = %s", (email,))
+    totals = cur.fetchone()
+
+    cur.execute("""
+        SELECT id, order_id, kind, balance_delta, cashback_delta, comment, created_at
+        FROM balance_ledger
+        WHERE email = %s AND (%s::bigint IS NULL OR id < %s)
+        ORDER BY id DESC
+        LIMIT %s
+    """, (email, before, before, limit + 1))
+    entries = [dict(row) for row in cur.fetchall()]
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = str(entries[-1]['id'])
+
+    return {
+        'email': email,
+        'balance': (totals['balance'] or 0) if totals else 0,
+        'cashback': (totals['cashback'] or 0) if totals else 0,
+        'history': entries,
+    }, next_cursor
+
+
+def reconcile(conn: Any, fix: bool = False) -> List[Tuple[Any, ...]]:
+    '''
+    Compares user_balances with the ledger sums for every email and, with
+    fix=True, overwrites the drifted rows with the ledger totals. Fixing takes
+    a SHARE lock on balance_ledger so no balance change is in flight while the
+    totals are written. Returns the drifted rows as
+    (email, stored_balance, ledger_balance, stored_cashback, ledger_cashback).
+    '''
+    with conn.cursor() as cur:
+        if fix:
+            cur.execute('LOCK TABLE balance_ledger IN SHARE MODE')
+        cur.execute(DRIFT_SQL)
+        drift = cur.fetchall()
+        if fix and drift:
+            cur.execute(FIX_SQL, (
+                [row[0] for row in drift],
+                [row[2] for row in drift],
+                [row[4] for row in drift],
+            ))
+    conn.commit()
+    return drift
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    reconcile_parser = commands.add_parser('reconcile', help='compare user_balances with the ledger')
+    reconcile_parser.add_argument('--fix', action='store_true', help='rewrite drifted balances from the ledger')
+    adjust_parser = commands.add_parser('adjust', help='post a manual top-up or correction')
+    adjust_parser.add_argument('email')
+    adjust_parser.add_argument('balance_delta', type=int)
+    adjust_parser.add_argument('cashback_delta', type=int, nargs='?', default=0)
+    adjust_parser.add_argument('--comment')
+    args = parser.parse_args()
+
+    from db import get_connection, release_connection
+
+    conn = get_connection()
+    try:
+        if args.command == 'reconcile':
+            drift = reconcile(conn, fix=args.fix)
+            for email, stored_balance, ledger_balance, stored_cashback, ledger_cashback in drift:
+                print('%s: balance %s -> %s, cashback %s -> %s' % (
+                    email, stored_balance, ledger_balance, stored_cashback, ledger_cashback))
+            print('%d balances %s' % (len(drift), 'fixed' if args.fix else 'drifted'))
+        else:
+            with conn.cursor() as cur:
+                balance, cashback = post_entry(cur, args.email, 'adjustment', args.balance_delta,
+                                               args.cashback_delta, comment=args.comment)
+                if balance < 0 or cashback < 0:
+                    conn.rollback()
+                    raise SystemExit('Refusing to leave %s with balance %d, cashback %d' % (args.email, balance, cashback))
+            conn.commit()
+            print('%s: balance %d, cashback %d' % (args.email, balance, cashback))
+    finally:
+        release_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
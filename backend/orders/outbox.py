@@ -0,0 +1,259 @@
+'''
+Transactional outbox for work that should not slow down checkout. The order
+transaction inserts a row into outbox (see PLACE_ORDER_SQL in index.py), so a
+job exists exactly when its order committed. Worker threads claim due jobs in
+batches with FOR UPDATE SKIP LOCKED, run them and mark them processed in the
+same transaction; a failing job is retried with exponential backoff and is
+parked with failed_at after OUTBOX_MAX_ATTEMPTS. Any number of worker
+processes can run side by side since claimed rows are skipped by the others.
+
+Delivery is at least once: a worker that dies after sending but before its
+commit leaves the job to be run again, so sinks get a stable message id.
+
+Without OUTBOX_SMTP_HOST mail goes to a local JSON-lines file
+(OUTBOX_MAIL_FILE) instead of a real server.
+
+Usage: DATABASE_URL=... python backend/orders/outbox.py [--workers 4] [--batch 50] [--once]
+'''
+import argparse
+import json
+import os
+import random
+import signal
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '1'))
+MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', '5'))
+BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', '3600'))
+MAIL_FROM = os.environ.get('OUTBOX_MAIL_FROM', 'shop@localhost')
+
+CLAIM_SQL = """
+    SELECT id, topic, payload, attempts FROM outbox
+    WHERE processed_at IS NULL AND failed_at IS NULL AND available_at <= CURRENT_TIMESTAMP
+    ORDER BY available_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+DONE_SQL = """
+    UPDATE outbox SET processed_at = CURRENT_TIMESTAMP, attempts = attempts + 1, last_error = NULL
+    WHERE id = ANY(%s)
+"""
+
+RETRY_SQL = """
+    UPDATE outbox
+    SET attempts = attempts + 1,
+        last_error = %(error)s,
+        available_at = CURRENT_TIMESTAMP + make_interval(secs => %(delay)s),
+        failed_at = CASE WHEN attempts + 1 >= %(max_attempts)s THEN CURRENT_TIMESTAMP END
+    WHERE id = %(id)s
+"""
+
+
+class FileMailSink:
+    '''Local stand-in for a mail server: appends each message as a JSON line.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, to: str, subject: str, body: str, message_id: str) -> None:
+        line = json.dumps({'message_id': message_id, 'from': MAIL_FROM, 'to': to, 'subject': subject, 'body': body},
+                          ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as sink:
+                sink.write(line + '\n')
+
+
+class SmtpMailSink:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    def send(self, to: str, subject: str, body: str, message_id: str) -> None:
+        message = EmailMessage()
+        message['From'] = MAIL_FROM
+        message['To'] = to
+        message['Subject'] = subject
+        message['Message-ID'] = f'<{message_id}@{MAIL_FROM.split("@")[-1]}>'
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+def make_mail_sink() -> Any:
+    if os.environ.get('OUTBOX_SMTP_HOST'):
+        return SmtpMailSink(os.environ['OUTBOX_SMTP_HOST'], int(os.environ.get('OUTBOX_SMTP_PORT', '25')))
+    return FileMailSink(os.environ.get('OUTBOX_MAIL_FILE', 'outbox-mail.jsonl'))
+
+
+mail_sink = make_mail_sink()
+
+
+def send_order_confirmation(cur: Any, job: Dict[str, Any]) -> None:
+    cur.execute("""
+        SELECT o.id, o.total_amount, o.delivery_address, u.email, u.full_name
+        FROM orders o
+        JOIN users u ON o.user_id = u.id
+        WHERE o.id = %s
+    """, (job['payload']['order_id'],))
+    order = cur.fetchone()
+    if order is None:
+        return
+
+    cur.execute("""
+        SELECT p.name, oi.quantity, oi.price
+        FROM order_items oi
+        LEFT JOIN plants p ON oi.plant_id = p.id
+        WHERE oi.order_id = %s
+        ORDER BY oi.id
+    """, (order['id'],))
+    lines = ['%s × %d — %s ₽' % (item['name'], item['quantity'], item['price']) for item in cur.fetchall()]
+
+    body = '\n'.join([
+        f"Здравствуйте, {order['full_name']}!",
+        '',
+        f"Ваш заказ №{order['id']} принят.",
+        *lines,
+        '',
+        f"Итого: {order['total_amount']} ₽",
+        f"Адрес доставки: {order['delivery_address'] or '—'}",
+    ])
+    mail_sink.send(order['email'], f"Заказ №{order['id']} принят", body, f"outbox-{job['id']}")
+
+
+HANDLERS: Dict[str, Callable[[Any, Dict[str, Any]], None]] = {
+    'order_confirmation': send_order_confirmation,
+}
+
+
+def backoff_seconds(attempts: int) -> float:
+    '''Delay before retry number `attempts`: exponential with jitter, capped at OUTBOX_BACKOFF_MAX.'''
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def process_batch(conn: Any, batch_size: int = BATCH_SIZE) -> int:
+    '''
+    Claims up to batch_size due jobs, runs each under a savepoint and records
+    the outcomes in the claiming transaction. Returns how many were claimed.
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(CLAIM_SQL, (batch_size,))
+        jobs = cur.fetchall()
+        done: List[int] = []
+
+        for job in jobs:
+            cur.execute('SAVEPOINT outbox_job')
+            try:
+                handler = HANDLERS.get(job['topic'])
+                if handler is None:
+                    raise LookupError(f"No handler for topic {job['topic']}")
+                handler(cur, job)
+                cur.execute('RELEASE SAVEPOINT outbox_job')
+                done.append(job['id'])
+            except Exception as e:
+                cur.execute('ROLLBACK TO SAVEPOINT outbox_job')
+                attempts = job['attempts'] + 1
+                delay = backoff_seconds(attempts)
+                cur.execute(RETRY_SQL, {'id': job['id'], 'error': repr(e)[:1000], 'delay': delay, 'max_attempts': MAX_ATTEMPTS})
+                print(json.dumps({
+                    'outbox_job': job['id'],
+                    'topic': job['topic'],
+                    'attempts': attempts,
+                    'error': repr(e),
+                    'retry_in': round(delay, 1) if attempts < MAX_ATTEMPTS else None,
+                }), flush=True)
+
+        if done:
+            cur.execute(DONE_SQL, (done,))
+    conn.commit()
+    return len(jobs)
+
+
+def work(stop: threading.Event, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL,
+         once: bool = False) -> int:
+    '''
+    Worker loop: claims batches back to back while they come back full and
+    sleeps poll_interval when the queue is drained. A connection is taken from
+    the pool per batch. With once=True it returns as soon as the queue is empty.
+    Returns the number of jobs claimed.
+    '''
+    from db import get_connection, release_connection
+
+    claimed_total = 0
+    while not stop.is_set():
+        try:
+            conn = get_connection()
+            try:
+                claimed = process_batch(conn, batch_size)
+            finally:
+                release_connection(conn)
+        except Exception as e:
+            print(json.dumps({'outbox_worker_error': repr(e)}), flush=True)
+            stop.wait(poll_interval)
+            continue
+
+        claimed_total += claimed
+        if claimed < batch_size:
+            if once:
+                break
+            stop.wait(poll_interval)
+    return claimed_total
+
+
+def run_workers(workers: int, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL,
+                once: bool = False, stop: Optional[threading.Event] = None) -> int:
+    '''Runs `workers` worker threads until stop is set (or the queue drains with once=True).'''
+    stop = stop or threading.Event()
+    counts = [0] * workers
+
+    def run(index: int) -> None:
+        counts[index] = work(stop, batch_size, poll_interval, once)
+
+    threads = [threading.Thread(target=run, args=(i,), name=f'outbox-{i}') for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('OUTBOX_WORKERS', '4')),
+                        help='worker threads; keep DB_POOL_SIZE at least this large')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL, help='seconds to sleep when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='exit once the queue is drained')
+    args = parser.parse_args()
+
+    from db import close_pool
+
+    stop = threading.Event()
+
+    def on_signal(signum: int, frame: Any) -> None:
+        print('received signal %d, finishing current batches' % signum, flush=True)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    print('outbox: %d workers, batch %d' % (args.workers, args.batch), flush=True)
+    started = time.monotonic()
+    try:
+        claimed = run_workers(args.workers, args.batch, args.poll, args.once, stop)
+    finally:
+        close_pool()
+    print('outbox: %d jobs claimed in %.1fs' % (claimed, time.monotonic() - started), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Stateless signed user tokens shared by the auth, cart and orders functions.
+A token carries the user id, role and expiry and is verified in-process with
+HMAC-SHA256, so authenticating a request needs no database lookup.
+
+Keys come from USER_TOKEN_KEYS as "kid:secret,kid:secret"; the first key signs
+new tokens and every listed key is accepted, which allows rotation. A single
+USER_TOKEN_SECRET is the key "default", and stays accepted under that kid when
+USER_TOKEN_KEYS is added, so moving a secret into the list keeps its tokens
+valid. Every secret is derived to a signing key the same way; tokens signed
+with a listed secret's raw bytes (the earlier scheme) still verify. With
+neither set no token is issued or accepted.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+USER_TOKEN_TTL = int(os.environ.get('USER_TOKEN_TTL', '2592000'))
+
+
+class TokenKeysMissing(RuntimeError):
+    pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode((data + '=' * (-len(data) % 4)).encode())
+
+
+def _derive_key(secret: str) -> bytes:
+    return hashlib.sha256(secret.encode()).digest()
+
+
+def _load_keys() -> Dict[str, Tuple[bytes, ...]]:
+    '''Maps kid to its accepted keys; the first one signs.'''
+    keys: Dict[str, Tuple[bytes, ...]] = {}
+    for entry in os.environ.get('USER_TOKEN_KEYS', '').split(','):
+        kid, _, secret = entry.strip().partition(':')
+        if kid and secret:
+            keys[kid] = (_derive_key(secret), secret.encode())
+    if os.environ.get('USER_TOKEN_SECRET') and 'default' not in keys:
+        keys['default'] = (_derive_key(os.environ['USER_TOKEN_SECRET']),)
+    return keys
+
+
+_keys = _load_keys()
+_active_kid = next(iter(_keys), None)
+
+
+def tokens_configured() -> bool:
+    return _active_kid is not None
+
+
+def _sign(key: bytes, payload: str) -> str:
+    return _b64encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_user_token(user_id: int, role: Optional[str] = 'user') -> str:
+    if _active_kid is None:
+        raise TokenKeysMissing('Set USER_TOKEN_KEYS or USER_TOKEN_SECRET to issue user tokens')
+    claims = {'uid': user_id, 'role': role or 'user', 'exp': int(time.time()) + USER_TOKEN_TTL, 'kid': _active_kid}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_sign(_keys[_active_kid][0], payload)}'
+
+
+def verify_user_token(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    '''Returns the token claims if the signature and expiry are valid, otherwise None.'''
+    if not token or _active_kid is None:
+        return None
+    try:
+        payload, signature = token.split('.', 1)
+        claims = json.loads(_b64decode(payload))
+        keys = _keys.get(claims.get('kid'), ())
+        if not any(hmac.compare_digest(_sign(key, payload), signature) for key in keys):
+            return None
+        if claims.get('exp', 0) <= time.time():
+            return None
+        claims['uid'] = int(claims['uid'])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return claims
+
+
+def authenticate(headers: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    headers = headers or {}
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if not token:
+        authorization = headers.get('Authorization') or headers.get('authorization') or ''
+        if authorization.startswith('Bearer '):
+            token = authorization[len('Bearer '):]
+    return verify_user_token(token)
@@ -0,0 +1,106 @@
+'''
+Signed admin sessions shared by the plants, settings and orders functions.
+Admin login issues an HMAC-signed, expiring token that is verified in-process;
+the admin password it is keyed on is cached and refreshed periodically.
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from db import Statement, execute_prepared
+
+ADMIN_TOKEN_TTL = int(os.environ.get('ADMIN_TOKEN_TTL', '43200'))
+ADMIN_SECRET_TTL = float(os.environ.get('ADMIN_SECRET_TTL', '300'))
+DEFAULT_ADMIN_PASSWORD = 'admin123'
+
+ADMIN_PASSWORD_QUERY = Statement('admin_password', "SELECT value FROM site_settings WHERE key = 'admin_password'")
+
+_lock = threading.Lock()
+_cached_password: Optional[str] = None
+_cached_at = 0.0
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode((data + '=' * (-len(data) % 4)).encode())
+
+
+def load_admin_password(conn: Any) -> str:
+    with conn.cursor() as cur:
+        execute_prepared(cur, ADMIN_PASSWORD_QUERY)
+        row = cur.fetchone()
+    password = row[0] if row else DEFAULT_ADMIN_PASSWORD
+    remember_admin_password(password)
+    return password
+
+
+def remember_admin_password(password: str) -> None:
+    global _cached_password, _cached_at
+    with _lock:
+        _cached_password = password
+        _cached_at = time.monotonic()
+
+
+def get_admin_password(conn: Any) -> str:
+    '''Returns the admin password, hitting the database only when the cached copy is stale.'''
+    password = _cached_password
+    if password is None or time.monotonic() - _cached_at > ADMIN_SECRET_TTL:
+        password = load_admin_password(conn)
+    return password
+
+
+def _signing_key(password: str) -> bytes:
+    secret = os.environ.get('ADMIN_TOKEN_SECRET', '')
+    return hashlib.sha256(f'{secret}:{password}'.encode()).digest()
+
+
+def issue_admin_token(password: str) -> str:
+    payload = _b64encode(json.dumps({'role': 'admin', 'exp': int(time.time()) + ADMIN_TOKEN_TTL}).encode())
+    signature = hmac.new(_signing_key(password), payload.encode(), hashlib.sha256).digest()
+    return f'{payload}.{_b64encode(signature)}'
+
+
+def verify_admin_token(token: str, password: str) -> bool:
+    try:
+        payload, signature = token.split('.', 1)
+        expected = hmac.new(_signing_key(password), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return False
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return False
+    return claims.get('role') == 'admin' and claims.get('exp', 0) > time.time()
+
+
+def _credentials(headers: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    headers = headers or {}
+    token = headers.get('X-Admin-Token') or headers.get('x-admin-token')
+    password = headers.get('X-Admin-Password') or headers.get('x-admin-password')
+    return token, password
+
+
+def has_admin_credentials(headers: Optional[Dict[str, Any]]) -> bool:
+    return any(_credentials(headers))
+
+
+def is_admin(headers: Optional[Dict[str, Any]], conn: Any) -> bool:
+    '''
+    Accepts X-Admin-Token (signed session) or, for older clients,
+    X-Admin-Password checked against the cached password.
+    '''
+    token, password = _credentials(headers)
+    if not token and not password:
+        return False
+
+    stored_password = get_admin_password(conn)
+    if token:
+        return verify_admin_token(token, stored_password)
+    return hmac.compare_digest(password.encode(), stored_password.encode())
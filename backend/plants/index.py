@@ -1,9 +1,337 @@
+import base64
+import csv
+import hashlib
+import io
 import json
 import os
-import psycopg2
+import threading
+import time
+from datetime import datetime
 from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+from db import Statement, execute_prepared, get_connection, get_read_connection, instrument_handler, pin_primary, release_connection
+from admin_session import is_admin
+from response import dumps, empty_response, etag_matches, gzip_body, json_response, preflight_response, raw_response
 
+CATALOG_CACHE_TTL = float(os.environ.get('PLANTS_CACHE_TTL', '30'))
+CATALOG_CACHE_CONTROL = os.environ.get('PLANTS_CACHE_CONTROL', 'no-cache')
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+CATALOG_FILTERS = ('category', 'min_price', 'max_price', 'q', 'sort', 'limit', 'cursor')
+IMPORT_MIN_PRICE = int(os.environ.get('PLANTS_IMPORT_MIN_PRICE', '1'))
+IMPORT_MAX_PRICE = int(os.environ.get('PLANTS_IMPORT_MAX_PRICE', '10000000'))
+IMPORT_MAX_ERRORS = 1000
+IMPORT_COLUMNS = ('id', 'name', 'price', 'category', 'image', 'description', 'stock')
+PLANT_BY_ID = Statement('plants_by_id', 'SELECT * FROM plants WHERE id = %s')
+CATALOG_VERSION = Statement('plants_version', 'SELECT COUNT(*), MAX(updated_at) FROM plants')
+CATALOG_ROWS = Statement('plants_catalog', 'SELECT * FROM plants ORDER BY id')
+SORT_ORDERS = {
+    'id': ('id', 'ASC'),
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+    'name': ('name', 'ASC'),
+    'newest': ('created_at', 'DESC')
+}
+
+
+class CatalogCache:
+    '''
+    Process-level cache of the serialized plant catalog. Within the TTL reads are
+    served from memory; after it expires a cheap COUNT/MAX(updated_at) check
+    decides whether the rows must be reloaded. Admin writes invalidate eagerly.
+    The gzipped body is kept for the current ETag only.
+    '''
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.body: Optional[str] = None
+        self.etag = ''
+        self.version: Optional[Tuple[Any, ...]] = None
+        self.expires_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.gzip_entry: Optional[Tuple[str, str]] = None
+    
+    def get_fresh(self) -> Optional[Tuple[str, str]]:
+        body, etag = self.body, self.etag
+        if body is not None and time.monotonic() < self.expires_at:
+            self.hits += 1
+            return body, etag
+        return None
+    
+    def load(self, conn: Any) -> Tuple[str, str, str]:
+        with self.lock:
+            with conn.cursor() as cur:
+                execute_prepared(cur, CATALOG_VERSION)
+                version = tuple(cur.fetchone())
+            
+            if self.body is not None and version == self.version:
+                self.revalidations += 1
+                state = 'REVALIDATED'
+            else:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    execute_prepared(cur, CATALOG_ROWS)
+                    plants = cur.fetchall()
+                self.body = dumps([dict(p) for p in plants])
+                self.etag = '"%s"' % hashlib.sha1(self.body.encode()).hexdigest()
+                self.version = version
+                self.misses += 1
+                state = 'MISS'
+            
+            self.expires_at = time.monotonic() + self.ttl
+            return self.body, self.etag, state
+    
+    def gzipped(self, body: str, etag: str) -> str:
+        entry = self.gzip_entry
+        if entry is None or entry[0] != etag:
+            entry = (etag, gzip_body(body))
+            self.gzip_entry = entry
+        return entry[1]
+    
+    def invalidate(self) -> None:
+        with self.lock:
+            self.body = None
+            self.etag = ''
+            self.version = None
+            self.expires_at = 0.0
+            self.gzip_entry = None
+    
+    def stats(self) -> Dict[str, Any]:
+        served = self.hits + self.revalidations + self.misses
+        return {
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.revalidations) / served, 4) if served else 0.0,
+            'ttl': self.ttl
+        }
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL)
+
+def catalog_response(event: Dict[str, Any], body: str, etag: str, cache_state: str) -> Dict[str, Any]:
+    headers = {
+        'Access-Control-Expose-Headers': 'ETag, X-Cache',
+        'Cache-Control': CATALOG_CACHE_CONTROL,
+        'ETag': etag,
+        'X-Cache': cache_state
+    }
+    if etag_matches(event, etag):
+        return empty_response(304, headers)
+    return raw_response(200, body, event, headers, lambda: catalog_cache.gzipped(body, etag))
+
+def encode_cursor(value: Any, plant_id: int) -> str:
+    raw = json.dumps([value, plant_id], default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, sort_column: str = 'id') -> Tuple[Any, int]:
+    '''Decodes a page cursor and checks its value against the type of the sort column.'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, plant_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(plant_id, int) or isinstance(plant_id, bool):
+            raise ValueError
+        if sort_column == 'price' and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError
+        if sort_column == 'name' and not isinstance(value, str):
+            raise ValueError
+        if sort_column == 'created_at':
+            value = datetime.fromisoformat(value)
+        return value, plant_id
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def catalog_query(params: Dict[str, Any]) -> Tuple[str, List[Any], int, str]:
+    '''
+    Builds a filtered catalog page query from category, min_price, max_price,
+    q (substring search over name/description), sort, limit and cursor.
+    '''
+    sort = params.get('sort') or 'id'
+    if sort not in SORT_ORDERS:
+        raise ValueError('Invalid sort, expected one of: ' + ', '.join(SORT_ORDERS))
+    sort_column, direction = SORT_ORDERS[sort]
+    
+    try:
+        limit = max(1, min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        min_price = int(params['min_price']) if params.get('min_price') else None
+        max_price = int(params['max_price']) if params.get('max_price') else None
+    except ValueError:
+        raise ValueError('limit, min_price and max_price must be integers')
+    
+    conditions: List[str] = []
+    args: List[Any] = []
+    
+    if params.get('category'):
+        conditions.append('category = %s')
+        args.append(params['category'])
+    if min_price is not None:
+        conditions.append('price >= %s')
+        args.append(min_price)
+    if max_price is not None:
+        conditions.append('price <= %s')
+        args.append(max_price)
+    if params.get('q'):
+        pattern = '%' + params['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append('(name ILIKE %s OR description ILIKE %s)')
+        args.extend([pattern, pattern])
+    if params.get('cursor'):
+        value, last_id = decode_cursor(params['cursor'], sort_column)
+        comparison = '>' if direction == 'ASC' else '<'
+        if sort_column == 'id':
+            conditions.append(f'id {comparison} %s')
+            args.append(last_id)
+        else:
+            conditions.append(f'({sort_column}, id) {comparison} (%s, %s)')
+            args.extend([value, last_id])
+    
+    where_sql = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    order_sql = f'{sort_column} {direction}' if sort_column == 'id' else f'{sort_column} {direction}, id {direction}'
+    sql = f'SELECT * FROM plants {where_sql} ORDER BY {order_sql} LIMIT %s'
+    args.append(limit + 1)
+    return sql, args, limit, sort_column
+
+def iter_import_rows(body: str, import_format: str) -> Iterator[Tuple[int, Any]]:
+    '''Yields (row number, raw row) pairs from a CSV document with a header line or a JSON array.'''
+    if import_format == 'json':
+        try:
+            rows = json.loads(body)
+        except ValueError:
+            raise ValueError('Body must be a JSON array of plants')
+        if not isinstance(rows, list):
+            raise ValueError('Body must be a JSON array of plants')
+        return enumerate(rows, 1)
+    
+    reader = csv.DictReader(io.StringIO(body.lstrip('\ufeff')))
+    if not reader.fieldnames or not {'name', 'price', 'category'} <= set(reader.fieldnames):
+        raise ValueError('CSV header must include name, price and category')
+    return enumerate(reader, 1)
+
+def validate_import_row(raw: Any, categories: Set[str], seen_ids: Set[int]) -> Tuple[Any, ...]:
+    '''Returns the row as an IMPORT_COLUMNS tuple or raises ValueError describing the first problem.'''
+    if not isinstance(raw, dict):
+        raise ValueError('Row must be an object')
+    values = {column: raw.get(column) for column in IMPORT_COLUMNS}
+    for column, value in values.items():
+        if isinstance(value, str):
+            values[column] = value.strip() or None
+    
+    plant_id = values['id']
+    if plant_id is not None:
+        try:
+            plant_id = int(plant_id)
+        except (TypeError, ValueError):
+            raise ValueError('id must be an integer')
+        if plant_id in seen_ids:
+            raise ValueError(f'Duplicate id {plant_id}')
+        seen_ids.add(plant_id)
+    
+    name = values['name']
+    if not name or len(str(name)) > 255:
+        raise ValueError('name is required and must be at most 255 characters')
+    
+    try:
+        price = int(values['price'])
+    except (TypeError, ValueError):
+        raise ValueError('price must be an integer')
+    if not IMPORT_MIN_PRICE <= price <= IMPORT_MAX_PRICE:
+        raise ValueError(f'price must be between {IMPORT_MIN_PRICE} and {IMPORT_MAX_PRICE}')
+    
+    if not isinstance(values['category'], str) or values['category'] not in categories:
+        raise ValueError(f"Unknown category {values['category']!r}")
+    
+    image = values['image']
+    if image is not None and len(str(image)) > 500:
+        raise ValueError('image must be at most 500 characters')
+    
+    stock = values['stock']
+    if stock is not None:
+        try:
+            stock = int(stock)
+        except (TypeError, ValueError):
+            raise ValueError('stock must be an integer')
+        if stock < 0:
+            raise ValueError('stock must not be negative')
+    
+    return plant_id, str(name), price, values['category'], image, values['description'], stock
+
+def _copy_field(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+MERGE_IMPORT_SQL = """
+    WITH merged AS (
+        INSERT INTO plants (id, name, price, category, image, description, stock)
+        SELECT COALESCE(s.id, nextval(pg_get_serial_sequence('plants', 'id'))), s.name, s.price, s.category,
+               COALESCE(s.image, p.image, ''), COALESCE(s.description, p.description, ''), COALESCE(s.stock, p.stock)
+        FROM plant_import s
+        LEFT JOIN plants p ON p.id = s.id
+        ORDER BY s.row_number
+        ON CONFLICT (id) DO UPDATE
+        SET name = EXCLUDED.name, price = EXCLUDED.price, category = EXCLUDED.category,
+            image = EXCLUDED.image, description = EXCLUDED.description, stock = EXCLUDED.stock,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+def import_plants(conn: Any, body: str, import_format: str) -> Dict[str, Any]:
+    '''
+    Bulk create/update: validates rows in one pass while writing the good ones
+    to a COPY buffer, loads them into a temporary staging table and merges it
+    into plants with a single upsert. Rows with an id update that plant (empty
+    image/description/stock keep the current value), rows without one are
+    inserted. Returns counts and per-row errors; the caller commits.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT name FROM categories')
+        categories = {row[0] for row in cur.fetchall()}
+    
+    errors: List[Dict[str, Any]] = []
+    error_count = 0
+    seen_ids: Set[int] = set()
+    buffer = io.StringIO()
+    
+    for row_number, raw in iter_import_rows(body, import_format):
+        try:
+            row = validate_import_row(raw, categories, seen_ids)
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'row': row_number, 'error': str(e)})
+            continue
+        buffer.write(str(row_number) + '\t' + '\t'.join(_copy_field(value) for value in row) + '\n')
+    
+    inserted = updated = 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE plant_import (
+                row_number INTEGER, id INTEGER, name VARCHAR(255), price INTEGER,
+                category VARCHAR(50), image VARCHAR(500), description TEXT, stock INTEGER
+            ) ON COMMIT DROP
+        """)
+        buffer.seek(0)
+        cur.copy_expert('COPY plant_import (row_number, %s) FROM STDIN' % ', '.join(IMPORT_COLUMNS), buffer)
+        
+        cur.execute("""
+            DELETE FROM plant_import s
+            WHERE s.id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM plants p WHERE p.id = s.id)
+            RETURNING s.row_number, s.id
+        """)
+        for row_number, plant_id in sorted(cur.fetchall()):
+            error_count += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'row': row_number, 'error': f'Plant {plant_id} not found'})
+        
+        cur.execute(MERGE_IMPORT_SQL)
+        inserted, updated = cur.fetchone()
+    
+    errors.sort(key=lambda error: error['row'])
+    return {'inserted': inserted, 'updated': updated, 'error_count': error_count, 'errors': errors}
+
+@instrument_handler
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления растениями - получение, создание, обновление, удаление
@@ -14,55 +342,75 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Password',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+        return preflight_response('GET, POST, PUT, DELETE, OPTIONS', 'Content-Type, X-Admin-Password, X-Admin-Token, If-None-Match, X-Read-Pin')
+    
+    params = event.get('queryStringParameters') or {}
+    
+    if method == 'GET' and params.get('cache_stats'):
+        return json_response(200, catalog_cache.stats())
+    
+    catalog_page = any(params.get(name) for name in CATALOG_FILTERS)
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
+    if method == 'GET' and not params.get('id') and not catalog_page:
+        cached = catalog_cache.get_fresh()
+        if cached is not None:
+            return catalog_response(event, cached[0], cached[1], 'HIT')
+    
+    conn = get_read_connection('catalog') if method == 'GET' else get_connection()
     
     try:
         if method == 'GET':
-            plant_id = event.get('queryStringParameters', {}).get('id')
+            plant_id = params.get('id')
             
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 if plant_id:
-                    cur.execute('SELECT * FROM plants WHERE id = %s', (plant_id,))
+                    execute_prepared(cur, PLANT_BY_ID, (plant_id,))
                     plant = cur.fetchone()
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps(dict(plant) if plant else None, default=str)
-                    }
+                    return json_response(200, dict(plant) if plant else None)
+                elif catalog_page:
+                    try:
+                        sql, args, limit, sort_column = catalog_query(params)
+                    except ValueError as e:
+                        return json_response(400, {'error': str(e)})
+                    
+                    cur.execute(sql, args)
+                    plants = [dict(p) for p in cur.fetchall()]
+                    
+                    headers = {'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+                    if len(plants) > limit:
+                        plants = plants[:limit]
+                        headers['X-Next-Cursor'] = encode_cursor(plants[-1][sort_column], plants[-1]['id'])
+                    
+                    return json_response(200, plants, event, headers)
                 else:
-                    cur.execute('SELECT * FROM plants ORDER BY id')
-                    plants = cur.fetchall()
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps([dict(p) for p in plants], default=str)
-                    }
+                    body, etag, cache_state = catalog_cache.load(conn)
+                    return catalog_response(event, body, etag, cache_state)
         
-        admin_password = event.get('headers', {}).get('X-Admin-Password') or event.get('headers', {}).get('x-admin-password')
+        if not is_admin(event.get('headers'), conn):
+            return json_response(401, {'error': 'Unauthorized'})
         
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT value FROM site_settings WHERE key = 'admin_password'")
-            result = cur.fetchone()
-            stored_password = result['value'] if result else 'admin123'
-        
-        if admin_password != stored_password:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Unauthorized'})
-            }
+        if method == 'POST' and params.get('bulk'):
+            import_format = params['bulk']
+            if import_format not in ('csv', 'json'):
+                return json_response(400, {'error': 'bulk must be csv or json'})
+            
+            body = event.get('body') or ''
+            if event.get('isBase64Encoded'):
+                body = base64.b64decode(body).decode('utf-8-sig')
+            
+            try:
+                result = import_plants(conn, body, import_format)
+            except ValueError as e:
+                conn.rollback()
+                return json_response(400, {'error': str(e)})
+            except Exception:
+                conn.rollback()
+                raise
+            
+            conn.commit()
+            catalog_cache.invalidate()
+            pin_primary('catalog')
+            return json_response(200, result)
         
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -71,20 +419,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             category = body_data.get('category')
             image = body_data.get('image')
             description = body_data.get('description')
+            stock = body_data.get('stock')
             
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
-                    'INSERT INTO plants (name, price, category, image, description) VALUES (%s, %s, %s, %s, %s) RETURNING *',
-                    (name, price, category, image, description)
+                    'INSERT INTO plants (name, price, category, image, description, stock) VALUES (%s, %s, %s, %s, %s, %s) RETURNING *',
+                    (name, price, category, image, description, stock)
                 )
                 new_plant = cur.fetchone()
                 conn.commit()
+                catalog_cache.invalidate()
+                pin_primary('catalog')
                 
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(dict(new_plant), default=str)
-                }
+                return json_response(201, dict(new_plant))
         
         if method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
@@ -95,40 +442,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             image = body_data.get('image')
             description = body_data.get('description')
             
+            # stock is only changed when sent, so editing a plant does not reset its inventory
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     '''UPDATE plants 
-                       SET name = %s, price = %s, category = %s, image = %s, description = %s, updated_at = CURRENT_TIMESTAMP 
+                       SET name = %s, price = %s, category = %s, image = %s, description = %s,
+                           stock = CASE WHEN %s THEN %s ELSE stock END, updated_at = CURRENT_TIMESTAMP 
                        WHERE id = %s RETURNING *''',
-                    (name, price, category, image, description, plant_id)
+                    (name, price, category, image, description, 'stock' in body_data, body_data.get('stock'), plant_id)
                 )
                 updated_plant = cur.fetchone()
                 conn.commit()
+                catalog_cache.invalidate()
+                pin_primary('catalog')
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(dict(updated_plant) if updated_plant else None, default=str)
-                }
+                return json_response(200, dict(updated_plant) if updated_plant else None)
         
         if method == 'DELETE':
-            plant_id = event.get('queryStringParameters', {}).get('id')
+            plant_id = params.get('id')
             
             with conn.cursor() as cur:
                 cur.execute('DELETE FROM plants WHERE id = %s', (plant_id,))
                 conn.commit()
+                catalog_cache.invalidate()
+                pin_primary('catalog')
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True})
-                }
+                return json_response(200, {'success': True})
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'})
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_connection(conn)
\ No newline at end of file
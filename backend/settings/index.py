@@ -1,9 +1,25 @@
+import hmac
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
+from db import get_connection, get_read_connection, instrument_handler, pin_primary, release_connection
+from admin_session import ADMIN_TOKEN_TTL, is_admin, issue_admin_token, load_admin_password
+from response import empty_response, etag_matches, json_response, preflight_response, raw_response
+from settings_snapshot import PRIVATE_KEYS, SettingsSnapshot, cache_stats, get_cached_snapshot, get_snapshot, invalidate
 
+SETTINGS_CACHE_CONTROL = os.environ.get('SETTINGS_CACHE_CONTROL', 'no-cache')
+
+def settings_response(event: Dict[str, Any], snapshot: SettingsSnapshot) -> Dict[str, Any]:
+    headers = {
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': SETTINGS_CACHE_CONTROL,
+        'ETag': snapshot.etag
+    }
+    if etag_matches(event, snapshot.etag):
+        return empty_response(304, headers)
+    return raw_response(200, snapshot.body, event, headers)
+
+@instrument_handler
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления настройками сайта - получение и обновление
@@ -14,103 +30,65 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Password',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+        return preflight_response('GET, POST, PUT, OPTIONS', 'Content-Type, X-Admin-Password, X-Admin-Token, If-None-Match, X-Read-Pin')
+    
+    if method == 'GET':
+        params = event.get('queryStringParameters') or {}
+        if params.get('cache_stats'):
+            return json_response(200, cache_stats())
+        
+        snapshot = get_cached_snapshot()
+        if snapshot is not None:
+            return settings_response(event, snapshot)
     
-    db_url = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(db_url)
+    conn = get_read_connection('settings') if method == 'GET' else get_connection()
     
     try:
         if method == 'GET':
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute('SELECT key, value FROM site_settings WHERE key != %s', ('admin_password',))
-                settings = cur.fetchall()
-                
-                settings_dict = {s['key']: s['value'] for s in settings}
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(settings_dict),
-                    'isBase64Encoded': False
-                }
+            return settings_response(event, get_snapshot(conn))
         
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             password = body_data.get('password')
             
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT value FROM site_settings WHERE key = 'admin_password'")
-                result = cur.fetchone()
-                stored_password = result['value'] if result else 'admin123'
-                
-                if password == stored_password:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'authenticated': True}),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'authenticated': False}),
-                        'isBase64Encoded': False
-                    }
-        
-        admin_password = event.get('headers', {}).get('X-Admin-Password') or event.get('headers', {}).get('x-admin-password')
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT value FROM site_settings WHERE key = 'admin_password'")
-            result = cur.fetchone()
-            stored_password = result['value'] if result else 'admin123'
+            stored_password = load_admin_password(conn)
+            
+            if isinstance(password, str) and hmac.compare_digest(password.encode(), stored_password.encode()):
+                return json_response(200, {
+                    'authenticated': True,
+                    'token': issue_admin_token(stored_password),
+                    'expires_in': ADMIN_TOKEN_TTL
+                })
+            else:
+                return json_response(401, {'authenticated': False})
         
-        if admin_password != stored_password:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Unauthorized'}),
-                'isBase64Encoded': False
-            }
+        if not is_admin(event.get('headers'), conn):
+            return json_response(401, {'error': 'Unauthorized'})
         
         if method == 'PUT':
             body_data = json.loads(event.get('body', '{}'))
             
+            updates = {key: value for key, value in body_data.items() if key not in PRIVATE_KEYS}
+            
+            if any(value is None or isinstance(value, (dict, list)) for value in updates.values()):
+                return json_response(400, {'error': 'Setting values must be strings or numbers'})
+            
             with conn.cursor() as cur:
-                for key, value in body_data.items():
-                    if key != 'admin_password':
-                        cur.execute(
-                            '''INSERT INTO site_settings (key, value) 
-                               VALUES (%s, %s) 
-                               ON CONFLICT (key) 
-                               DO UPDATE SET value = %s, updated_at = CURRENT_TIMESTAMP''',
-                            (key, value, value)
-                        )
+                if updates:
+                    cur.execute(
+                        '''INSERT INTO site_settings (key, value) 
+                           SELECT unnest(%s::text[]), unnest(%s::text[]) 
+                           ON CONFLICT (key) 
+                           DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP''',
+                        (list(updates), [str(value) for value in updates.values()])
+                    )
                 conn.commit()
+                invalidate()
+                pin_primary('settings')
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                return json_response(200, {'success': True})
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+        return json_response(405, {'error': 'Method not allowed'})
     
     finally:
-        conn.close()
\ No newline at end of file
+        release_connection(conn)
\ No newline at end of file
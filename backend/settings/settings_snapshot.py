@@ -0,0 +1,87 @@
+'''
+Immutable in-process snapshot of the public site settings. Reads within the
+TTL need no query; after it expires a COUNT/MAX(updated_at) check decides
+whether to reload, and writes through the settings function invalidate it.
+'''
+import hashlib
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple
+
+from db import Statement, execute_prepared
+from response import dumps
+
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '60'))
+PRIVATE_KEYS = ('admin_password',)
+
+VERSION_QUERY = Statement('settings_version', 'SELECT COUNT(*), MAX(updated_at) FROM site_settings WHERE key != ALL(%s)')
+VALUES_QUERY = Statement('settings_values', 'SELECT key, value FROM site_settings WHERE key != ALL(%s)')
+
+
+class SettingsSnapshot(NamedTuple):
+    values: Mapping[str, str]
+    body: str
+    etag: str
+    version: Tuple[Any, ...]
+
+
+_lock = threading.Lock()
+_snapshot: Optional[SettingsSnapshot] = None
+_expires_at = 0.0
+_stats = {'hits': 0, 'revalidations': 0, 'misses': 0}
+
+
+def get_cached_snapshot() -> Optional[SettingsSnapshot]:
+    '''Returns the snapshot if it is still within its TTL, without touching the database.'''
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() < _expires_at:
+        _stats['hits'] += 1
+        return snapshot
+    return None
+
+
+def get_snapshot(conn: Any) -> SettingsSnapshot:
+    global _snapshot, _expires_at
+    snapshot = get_cached_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    with _lock:
+        with conn.cursor() as cur:
+            execute_prepared(cur, VERSION_QUERY, (list(PRIVATE_KEYS),))
+            version = tuple(cur.fetchone())
+
+            if _snapshot is not None and _snapshot.version == version:
+                _stats['revalidations'] += 1
+            else:
+                execute_prepared(cur, VALUES_QUERY, (list(PRIVATE_KEYS),))
+                values = {key: value for key, value in cur.fetchall()}
+                body = dumps(values)
+                _snapshot = SettingsSnapshot(
+                    values=MappingProxyType(values),
+                    body=body,
+                    etag='"%s"' % hashlib.sha1(body.encode()).hexdigest(),
+                    version=version
+                )
+                _stats['misses'] += 1
+
+        _expires_at = time.monotonic() + SETTINGS_CACHE_TTL
+        return _snapshot
+
+
+def invalidate() -> None:
+    global _snapshot, _expires_at
+    with _lock:
+        _snapshot = None
+        _expires_at = 0.0
+
+
+def cache_stats() -> Dict[str, Any]:
+    served = sum(_stats.values())
+    return {
+        **_stats,
+        'hit_ratio': round((_stats['hits'] + _stats['revalidations']) / served, 4) if served else 0.0,
+        'ttl': SETTINGS_CACHE_TTL
+    }
@@ -0,0 +1,45 @@
+'''
+Measures the admin authorization round trip on settings PUT: the previous
+per-request admin_password lookup against the cached password and signed
+admin tokens.
+
+Usage: DATABASE_URL=... python benchmarks/admin_auth.py [--requests N] [--concurrency C]
+'''
+import argparse
+import json
+
+from common import load_function, make_context, print_table, run_load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    settings = load_function('settings')
+    import admin_session
+
+    login = settings.handler({'httpMethod': 'POST', 'body': json.dumps({'password': 'admin123'})}, make_context())
+    token = json.loads(login['body']).get('token')
+    assert token, 'admin login failed, check the admin_password setting'
+
+    modes = {
+        'password, lookup per request (before)': (-1.0, {'X-Admin-Password': 'admin123'}),
+        'password, cached': (admin_session.ADMIN_SECRET_TTL, {'X-Admin-Password': 'admin123'}),
+        'signed token': (admin_session.ADMIN_SECRET_TTL, {'X-Admin-Token': token}),
+    }
+
+    rows = []
+    for label, (secret_ttl, headers) in modes.items():
+        admin_session.ADMIN_SECRET_TTL = secret_ttl
+        event = {'httpMethod': 'PUT', 'headers': headers, 'body': '{}'}
+        assert settings.handler(event, make_context())['statusCode'] == 200
+        result = run_load(lambda i: settings.handler(event, make_context()), args.requests, args.concurrency)
+        rows.append({'mode': label, **result})
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+'''
+Balance ledger stress test: one user places many orders paid from balance at
+the same time through orders.handler.
+  1. With enough funds, every order must succeed. The balance and cashback
+     must then equal the top-up minus the charges, plus the cashback earned.
+  2. With funds for only --affordable orders, exactly that many may succeed,
+     the rest get 402, and the balance ends at zero and never goes negative.
+  3. Half of the paid orders are cancelled by concurrent bulk PUTs, and the
+     refunds must restore the matching balance and cashback.
+After each round user_balances must match the ledger sums (no drift).
+
+The ledger is append-only, so every run uses a fresh user.
+
+Usage: DATABASE_URL=... DB_POOL_SIZE=32 python benchmarks/balance_ledger.py [--orders 500] [--concurrency 32]
+'''
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_function, make_context, percentile, print_table
+
+PRICE = 100
+ADMIN_HEADERS = {'X-Admin-Password': 'admin123'}
+
+
+def seed(conn, email: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password_hash, full_name) VALUES (%s, '', 'Ledger bench') RETURNING id",
+            (email,)
+        )
+        user_id = cur.fetchone()[0]
+        cur.execute(
+            "INSERT INTO plants (name, price, category, image, description) "
+            "VALUES ('ledger bench plant', %s, 'decorative', '', 'ledger bench') RETURNING id",
+            (PRICE,)
+        )
+        plant_id = cur.fetchone()[0]
+    conn.commit()
+    return user_id, plant_id
+
+
+def totals(conn, email: str):
+    '''(stored balance, stored cashback, ledger balance, ledger cashback)'''
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.balance, b.cashback,
+                   (SELECT COALESCE(SUM(balance_delta), 0) FROM balance_ledger WHERE email = %s),
+                   (SELECT COALESCE(SUM(cashback_delta), 0) FROM balance_ledger WHERE email = %s)
+            FROM user_balances b WHERE b.email = %s
+        """, (email, email, email))
+        row = cur.fetchone()
+    conn.rollback()
+    return tuple(int(value) for value in row)
+
+
+def run_orders(orders, token: str, plant_id: int, count: int, concurrency: int):
+    statuses = {}
+    order_ids = []
+    latencies = []
+    lock = threading.Lock()
+
+    def buy(i: int) -> None:
+        started = time.perf_counter()
+        response = orders.handler({
+            'httpMethod': 'POST',
+            'headers': {'X-Auth-Token': token},
+            'body': json.dumps({'items': [{'plant_id': plant_id, 'quantity': 1}], 'payment_method': 'balance'})
+        }, make_context('ledger-%d' % i))
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+            if response['statusCode'] == 201:
+                order_ids.append(json.loads(response['body'])['order_id'])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(buy, range(count)))
+    return statuses, order_ids, time.perf_counter() - started, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--affordable', type=int, default=120, help='orders the balance covers in round 2')
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    orders = load_function('orders')
+    import ledger
+    from user_tokens import issue_user_token
+
+    email = 'bench-ledger-%d@example.com' % int(time.time() * 1000)
+    cashback_each = ledger.order_charge(PRICE)[1]
+    conn = orders.get_connection()
+    rows = []
+    failures = []
+    try:
+        user_id, plant_id = seed(conn, email)
+        token = issue_user_token(user_id)
+
+        def top_up(amount: int) -> None:
+            with conn.cursor() as cur:
+                ledger.post_entry(cur, email, 'adjustment', amount, comment='ledger bench')
+            conn.commit()
+
+        def check(name: str, statuses, elapsed, latencies, expected_balance: int, expected_cashback: int) -> None:
+            balance, cashback, ledger_balance, ledger_cashback = totals(conn, email)
+            if (balance, cashback) != (expected_balance, expected_cashback):
+                failures.append('%s: expected balance %d / cashback %d, got %d / %d' % (
+                    name, expected_balance, expected_cashback, balance, cashback))
+            if (balance, cashback) != (ledger_balance, ledger_cashback):
+                failures.append('%s: drift, stored %d / %d vs ledger %d / %d' % (
+                    name, balance, cashback, ledger_balance, ledger_cashback))
+            rows.append({
+                'round': name,
+                'paid_201': statuses.get(201, 0),
+                'refused_402': statuses.get(402, 0),
+                'other': sum(count for status, count in statuses.items() if status not in (200, 201, 402)),
+                'balance': balance,
+                'cashback': cashback,
+                'seconds': round(elapsed, 2),
+                'p50_ms': round(percentile(latencies, 50), 1) if latencies else '',
+                'p99_ms': round(percentile(latencies, 99), 1) if latencies else '',
+            })
+
+        top_up(PRICE * args.orders)
+        statuses, paid, elapsed, latencies = run_orders(orders, token, plant_id, args.orders, args.concurrency)
+        if statuses.get(201, 0) != args.orders:
+            failures.append('ample funds: %s' % statuses)
+        check('ample funds', statuses, elapsed, latencies, 0, cashback_each * args.orders)
+
+        top_up(PRICE * args.affordable)
+        statuses, more_paid, elapsed, latencies = run_orders(orders, token, plant_id, args.orders, args.concurrency)
+        paid += more_paid
+        if statuses.get(201, 0) != args.affordable or statuses.get(402, 0) != args.orders - args.affordable:
+            failures.append('scarce funds: expected %d paid, got %s' % (args.affordable, statuses))
+        check('scarce funds', statuses, elapsed, latencies, 0, cashback_each * len(paid))
+
+        cancelled = paid[::2]
+        chunks = [cancelled[i::8] for i in range(8)]
+
+        def cancel(chunk) -> int:
+            response = orders.handler({
+                'httpMethod': 'PUT',
+                'headers': ADMIN_HEADERS,
+                'body': json.dumps({'order_ids': chunk, 'status': 'cancelled'})
+            }, make_context('ledger-cancel'))
+            return response['statusCode']
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            cancel_statuses = list(pool.map(cancel, chunks))
+        elapsed = time.perf_counter() - started
+        statuses = {status: cancel_statuses.count(status) for status in set(cancel_statuses)}
+        check('concurrent cancellations', statuses, elapsed, [], PRICE * len(cancelled),
+              cashback_each * (len(paid) - len(cancelled)))
+
+        drift = [row for row in ledger.reconcile(conn) if row[0] == email]
+        if drift:
+            failures.append('reconcile reports drift: %s' % drift)
+    finally:
+        orders.release_connection(conn)
+
+    print_table(rows)
+    for failure in failures:
+        print('FAIL', failure)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
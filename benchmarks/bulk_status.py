@@ -0,0 +1,90 @@
+'''
+Bulk order status transitions: moves --orders pending orders to processing
+and then cancels them (which also returns their items to tracked stock)
+through single PUT calls to orders.handler, and compares that with the old
+one-request-per-order flow. Checks that every order got exactly one history
+row per transition.
+
+Expects data from dataset.py (--scale 10000 or more, so there are enough
+pending orders); each run consumes --orders pending orders.
+
+Usage: DATABASE_URL=... python benchmarks/bulk_status.py [--orders 10000] [--single 300]
+'''
+import argparse
+import json
+import time
+
+import dataset
+from common import load_function, make_context, print_table
+
+ADMIN_HEADERS = {'X-Admin-Password': 'admin123'}
+
+
+def put(orders, body):
+    started = time.perf_counter()
+    response = orders.handler({'httpMethod': 'PUT', 'headers': ADMIN_HEADERS, 'body': json.dumps(body)}, make_context())
+    elapsed = (time.perf_counter() - started) * 1000
+    if response['statusCode'] != 200:
+        raise SystemExit('PUT failed: %s %s' % (response['statusCode'], response['body'][:200]))
+    return json.loads(response['body']), elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--single', type=int, default=300, help='orders moved one request at a time for the baseline')
+    args = parser.parse_args()
+
+    conn = dataset.connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM orders WHERE status = 'pending' ORDER BY id LIMIT %s", (args.orders + args.single,))
+            pending = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+        if len(pending) < args.orders + args.single:
+            raise SystemExit('Only %d pending orders, seed more with dataset.py' % len(pending))
+        bulk_ids, single_ids = pending[:args.orders], pending[args.orders:]
+
+        orders = load_function('orders')
+        rows = []
+
+        for status in ('processing', 'cancelled'):
+            outcome, elapsed = put(orders, {'order_ids': bulk_ids, 'status': status})
+            rows.append({'mode': 'bulk PUT', 'transition': status, 'orders': len(bulk_ids),
+                         'updated': outcome['updated'], 'rejected': outcome['rejected'], 'total_ms': round(elapsed, 1)})
+
+        outcome, elapsed = put(orders, {'order_ids': bulk_ids, 'status': 'shipped'})
+        rows.append({'mode': 'bulk PUT', 'transition': 'shipped (all rejected)', 'orders': len(bulk_ids),
+                     'updated': outcome['updated'], 'rejected': outcome['rejected'], 'total_ms': round(elapsed, 1)})
+
+        started = time.perf_counter()
+        for order_id in single_ids:
+            put(orders, {'order_id': order_id, 'status': 'processing'})
+        elapsed = (time.perf_counter() - started) * 1000
+        rows.append({'mode': 'one PUT per order', 'transition': 'processing', 'orders': len(single_ids),
+                     'updated': len(single_ids), 'rejected': 0, 'total_ms': round(elapsed, 1)})
+        rows.append({'mode': 'one PUT per order (scaled)', 'transition': 'processing', 'orders': len(bulk_ids),
+                     'updated': '', 'rejected': '', 'total_ms': round(elapsed / len(single_ids) * len(bulk_ids), 1)})
+
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT order_id FROM order_status_history
+                    WHERE order_id = ANY(%s)
+                    GROUP BY order_id
+                    HAVING COUNT(*) = 2
+                ) complete
+            """, (bulk_ids,))
+            broken = len(bulk_ids) - cur.fetchone()[0]
+        conn.rollback()
+    finally:
+        conn.close()
+
+    print_table(rows)
+    print('orders without exactly two history rows: %d' % broken)
+    if broken:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Checkout latency for 1, 50 and 500-line carts: the previous per-row insert
+path (reproduced below as the baseline) against orders.handler POST.
+
+Usage: DATABASE_URL=... python benchmarks/checkout.py [--repeat N] [--lines 1,50,500]
+'''
+import argparse
+import json
+import statistics
+import time
+
+from psycopg2.extras import execute_values
+
+from common import load_function, make_context, percentile, print_table
+
+SEED_EMAIL = 'bench-checkout@example.com'
+
+
+def legacy_checkout(conn, user_id: int, items) -> int:
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        total_amount = sum(item['price'] * item['quantity'] for item in items)
+        cur.execute(
+            "INSERT INTO orders (user_id, total_amount, delivery_address, status) VALUES (%s, %s, %s, %s) RETURNING id",
+            (user_id, total_amount, '', 'pending')
+        )
+        order_id = cur.fetchone()[0]
+        for item in items:
+            cur.execute(
+                "INSERT INTO order_items (order_id, plant_id, quantity, price) VALUES (%s, %s, %s, %s)",
+                (order_id, item['plant_id'], item['quantity'], item['price'])
+            )
+        cur.execute("DELETE FROM cart_items WHERE user_id = %s", (user_id,))
+    conn.autocommit = False
+    return order_id
+
+
+def seed(conn, plant_count: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password_hash, full_name) VALUES (%s, '', 'Bench') "
+            "ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id",
+            (SEED_EMAIL,)
+        )
+        user_id = cur.fetchone()[0]
+        rows = execute_values(
+            cur,
+            'INSERT INTO plants (name, price, category, image, description) VALUES %s RETURNING id, price',
+            [('bench plant %d' % i, 100 + i, 'decorative', '', 'bench') for i in range(plant_count)],
+            fetch=True
+        )
+    conn.commit()
+    return user_id, rows
+
+
+def cleanup(conn, plant_ids) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            'DELETE FROM order_items WHERE order_id IN (SELECT o.id FROM orders o JOIN users u ON o.user_id = u.id WHERE u.email = %s)',
+            (SEED_EMAIL,)
+        )
+        cur.execute('DELETE FROM orders WHERE user_id IN (SELECT id FROM users WHERE email = %s)', (SEED_EMAIL,))
+        cur.execute('DELETE FROM users WHERE email = %s', (SEED_EMAIL,))
+        cur.execute('DELETE FROM plants WHERE id = ANY(%s)', (list(plant_ids),))
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--lines', default='1,50,500')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.lines.split(',')]
+    orders = load_function('orders')
+    import db
+    from user_tokens import issue_user_token
+
+    conn = db.get_connection()
+    user_id, plants = seed(conn, max(sizes))
+    rows = []
+    try:
+        for size in sizes:
+            items = [{'plant_id': p[0], 'quantity': 2, 'price': p[1]} for p in plants[:size]]
+            event = {
+                'httpMethod': 'POST',
+                'headers': {'X-Auth-Token': issue_user_token(user_id)},
+                'body': json.dumps({'items': items})
+            }
+            paths = {
+                'per-row (before)': lambda: legacy_checkout(conn, user_id, items),
+                'single statement (after)': lambda: orders.handler(event, make_context()),
+            }
+            for label, call in paths.items():
+                call()
+                samples = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    call()
+                    samples.append((time.perf_counter() - started) * 1000)
+                rows.append({
+                    'lines': size,
+                    'path': label,
+                    'mean_ms': round(statistics.mean(samples), 2),
+                    'p99_ms': round(percentile(samples, 99), 2),
+                })
+    finally:
+        cleanup(conn, [p[0] for p in plants])
+        db.release_connection(conn)
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
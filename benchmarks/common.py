@@ -0,0 +1,82 @@
+'''
+Helpers shared by the local benchmarks: loading function handlers in-process
+and timing them under concurrency.
+'''
+import importlib.util
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from dataset import use_schema
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+
+
+def load_function(name: str) -> Any:
+    '''
+    Imports backend/<name>/index.py under a unique module name, with every
+    connection of the process pointed at the project schema.
+    '''
+    use_schema()
+    fn_dir = str(BACKEND_DIR / name)
+    if fn_dir not in sys.path:
+        sys.path.insert(0, fn_dir)
+    module_name = '%s_index' % name
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_context(request_id: str = 'bench') -> Any:
+    return SimpleNamespace(request_id=request_id, function_name='bench')
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_load(call: Callable[[int], Any], requests: int, concurrency: int) -> Dict[str, float]:
+    '''Runs call(i) for i in range(requests) on a thread pool and summarizes latencies in ms.'''
+    latencies: List[float] = []
+
+    def timed(i: int) -> None:
+        started = time.perf_counter()
+        call(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(statistics.mean(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
@@ -0,0 +1,144 @@
+'''
+Prepares a local Postgres for benchmarking: applies db_migrations/ into the
+project schema and seeds synthetic users, plants and orders.
+
+Usage: DATABASE_URL=postgresql://localhost/bench python benchmarks/dataset.py [--reset] [--scale N]
+'''
+import argparse
+import hashlib
+import io
+import os
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict
+
+import psycopg2
+
+SCHEMA = 't_p64494902_farm_registry_system'
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'db_migrations'
+BENCH_PASSWORD = 'bench-password'
+STATUSES = ['pending', 'processing', 'shipped', 'delivered', 'cancelled']
+
+
+def use_schema() -> None:
+    '''Points every libpq connection in this process (including the handlers' pool) at the project schema.'''
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA},public'
+
+
+def connect() -> Any:
+    use_schema()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def apply_migrations(conn: Any, reset: bool = False) -> None:
+    with conn.cursor() as cur:
+        if reset:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cur.execute('CREATE TABLE IF NOT EXISTS bench_migrations (version TEXT PRIMARY KEY)')
+        cur.execute('SELECT version FROM bench_migrations')
+        applied = {row[0] for row in cur.fetchall()}
+    conn.commit()
+
+    for path in sorted(MIGRATIONS_DIR.glob('V*.sql')):
+        version = path.name.split('__')[0]
+        if version in applied:
+            continue
+        with conn.cursor() as cur:
+            cur.execute(path.read_text(encoding='utf-8'))
+            cur.execute('INSERT INTO bench_migrations (version) VALUES (%s)', (version,))
+        conn.commit()
+        print('applied', path.name)
+
+
+def _copy(cur: Any, table: str, columns: str, rows) -> None:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join('\\N' if value is None else str(value) for value in row) + '\n')
+    buffer.seek(0)
+    cur.copy_expert(f'COPY {table} ({columns}) FROM STDIN', buffer)
+
+
+def seed(conn: Any, scale: int, seed_value: int = 7) -> Dict[str, int]:
+    '''Seeds scale users, scale plants and 10 * scale orders with 1-5 items each.'''
+    rng = random.Random(seed_value)
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+    started = datetime(2024, 1, 1)
+
+    with conn.cursor() as cur:
+        cur.execute('SELECT COALESCE(MAX(id), 0) FROM users')
+        first_user = cur.fetchone()[0] + 1
+        _copy(cur, 'users', 'email, password_hash, full_name, phone', (
+            (f'bench-user-{first_user + i}@example.com', password_hash, f'Bench User {i}', '+7 900 000-00-00')
+            for i in range(scale)
+        ))
+        _copy(cur, 'plants', 'name, price, category, image, description', (
+            (f'Растение {i}', rng.randint(100, 10000), rng.choice(['decorative', 'fruit']), '', f'Синтетическое растение {i}')
+            for i in range(scale)
+        ))
+        cur.execute('SELECT MIN(id), MAX(id) FROM users WHERE id >= %s', (first_user,))
+        user_min, user_max = cur.fetchone()
+        cur.execute('SELECT MIN(id), MAX(id) FROM plants')
+        plant_min, plant_max = cur.fetchone()
+
+        cur.execute('SELECT COALESCE(MAX(id), 0) FROM orders')
+        first_order = cur.fetchone()[0] + 1
+        order_count = scale * 10
+        _copy(cur, 'orders', 'user_id, total_amount, status, delivery_address, created_at', (
+            (rng.randint(user_min, user_max), rng.randint(100, 50000), rng.choice(STATUSES), 'Bench address',
+             started + timedelta(seconds=i * 37))
+            for i in range(order_count)
+        ))
+        cur.execute('SELECT MIN(id), MAX(id) FROM orders WHERE id >= %s', (first_order,))
+        order_min, order_max = cur.fetchone()
+        _copy(cur, 'order_items', 'order_id, plant_id, quantity, price', (
+            (order_id, rng.randint(plant_min, plant_max), rng.randint(1, 3), rng.randint(100, 10000))
+            for order_id in range(order_min, order_max + 1)
+            for _ in range(rng.randint(1, 5))
+        ))
+        cur.execute('ANALYZE')
+    conn.commit()
+
+    return {
+        'user_min': user_min, 'user_max': user_max,
+        'plant_min': plant_min, 'plant_max': plant_max,
+        'order_min': order_min, 'order_max': order_max,
+    }
+
+
+def seeded_ranges(conn: Any) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT MIN(id), MAX(id) FROM users WHERE email LIKE 'bench-user-%'")
+        user_min, user_max = cur.fetchone()
+        cur.execute('SELECT MIN(id), MAX(id) FROM plants')
+        plant_min, plant_max = cur.fetchone()
+        cur.execute('SELECT MIN(id), MAX(id) FROM orders')
+        order_min, order_max = cur.fetchone()
+    conn.rollback()
+    if user_min is None or order_min is None:
+        raise SystemExit('No synthetic data found, run benchmarks/dataset.py --scale N first')
+    return {
+        'user_min': user_min, 'user_max': user_max,
+        'plant_min': plant_min, 'plant_max': plant_max,
+        'order_min': order_min, 'order_max': order_max,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate the project schema first')
+    parser.add_argument('--scale', type=int, default=1000, help='users and plants to seed; orders are 10x')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        apply_migrations(conn, args.reset)
+        if args.scale > 0:
+            print('seeded', seed(conn, args.scale))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
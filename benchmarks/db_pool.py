@@ -0,0 +1,54 @@
+'''
+Compares handler throughput and tail latency with and without the warm
+connection pool. The settings and catalog caches are given a zero TTL so
+every request reaches the database (at least the version check); the
+plant-by-id lookup is never cached.
+
+Usage: DATABASE_URL=postgresql://localhost/plants python benchmarks/db_pool.py [--requests N] [--concurrency C]
+'''
+import argparse
+import os
+
+from common import load_function, make_context, print_table, run_load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    settings = load_function('settings')
+    plants = load_function('plants')
+    import db
+    import settings_snapshot
+
+    settings_snapshot.SETTINGS_CACHE_TTL = 0
+    plants.catalog_cache.ttl = 0
+
+    scenarios = {
+        'settings GET': lambda i: settings.handler({'httpMethod': 'GET'}, make_context()),
+        'plants GET': lambda i: plants.handler({'httpMethod': 'GET', 'queryStringParameters': {}}, make_context()),
+        'plant by id': lambda i: plants.handler({'httpMethod': 'GET', 'queryStringParameters': {'id': '1'}}, make_context()),
+    }
+
+    pool_size = max(db.POOL_SIZE, args.concurrency)
+    rows = []
+    for name, call in scenarios.items():
+        for label, size in (('no pool', 0), ('pool', pool_size)):
+            db.POOL_SIZE = size
+            if size:
+                db._pool = db.ConnectionPool(os.environ.get('DATABASE_URL'), size, db.POOL_TIMEOUT)
+            call(0)
+            result = run_load(call, args.requests, args.concurrency)
+            rows.append({'scenario': name, 'mode': label, **result})
+            if size:
+                db.get_pool().closeall()
+
+    print_table(rows)
+    print('catalog cache hits: %d, settings cache hits: %d (both should be 0)' % (
+        plants.catalog_cache.hits, settings_snapshot.cache_stats()['hits']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Exports at least a million synthetic orders through orders.handler, once with
+Accept-Encoding: gzip (compressed while it is produced) and once without
+(plain body), and fails if Python memory grows past a fixed ceiling. The
+body is capped at --max-body-mb; past it the handler answers 413, which is
+the expected outcome for very large exports, especially without gzip.
+Seeds the missing orders with dataset.py first (10 orders per scale unit).
+
+Usage: DATABASE_URL=... python benchmarks/orders_export.py [--rows 1000000] [--max-mb 64] [--max-body-mb 16] [--format csv]
+'''
+import argparse
+import base64
+import resource
+import sys
+import time
+import tracemalloc
+import zlib
+
+import dataset
+from common import load_function, make_context, print_table
+
+
+def ensure_orders(rows: int) -> int:
+    conn = dataset.connect()
+    try:
+        dataset.apply_migrations(conn)
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM orders')
+            existing = cur.fetchone()[0]
+        conn.rollback()
+        if existing < rows:
+            scale = -(-(rows - existing) // 10)
+            print('seeding %d orders' % (scale * 10))
+            dataset.seed(conn, scale)
+            existing += scale * 10
+        return existing
+    finally:
+        conn.close()
+
+
+def export(orders, export_format: str, accept_gzip: bool):
+    headers = {'X-Admin-Password': 'admin123'}
+    if accept_gzip:
+        headers['Accept-Encoding'] = 'gzip'
+    event = {'httpMethod': 'GET', 'headers': headers, 'queryStringParameters': {'export': export_format}}
+    started = time.perf_counter()
+    response = orders.handler(event, make_context('export'))
+    return time.perf_counter() - started, response
+
+
+def count_lines(response) -> int:
+    if not response.get('isBase64Encoded'):
+        return response['body'].count('\n')
+    decompressor = zlib.decompressobj(31)
+    data = base64.b64decode(response['body'])
+    lines = 0
+    for offset in range(0, len(data), 1 << 20):
+        lines += decompressor.decompress(data[offset:offset + (1 << 20)]).count(b'\n')
+    return lines + decompressor.flush().count(b'\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000, help='minimum number of orders to export')
+    parser.add_argument('--max-mb', type=float, default=64, help='allowed peak of traced Python memory')
+    parser.add_argument('--max-body-mb', type=float, default=16, help='RESPONSE_STREAM_MAX_BYTES for the run')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    args = parser.parse_args()
+
+    order_count = ensure_orders(args.rows)
+    orders = load_function('orders')
+    import response as response_module
+    response_module.STREAM_MAX_BYTES = int(args.max_body_mb * 1024 * 1024)
+
+    rows = []
+    failed = False
+    for accept_gzip in (True, False):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        elapsed, response = export(orders, args.format, accept_gzip)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        peak_mb = peak / 1024 / 1024
+        failed = failed or peak_mb > args.max_mb or response['statusCode'] not in (200, 413)
+        rows.append({
+            'accept_gzip': accept_gzip,
+            'format': args.format,
+            'orders': order_count,
+            'status': response['statusCode'],
+            'content_type': response['headers'].get('Content-Type'),
+            'lines': count_lines(response),
+            'body_mb': round(len(response['body']) / 1024 / 1024, 1),
+            'seconds': round(elapsed, 2),
+            'peak_traced_mb': round(peak_mb, 2),
+            'max_rss_growth_mb': round((rss_after - rss_before) / 1024, 1),
+        })
+        del response
+
+    print_table(rows)
+    if failed:
+        print('FAIL: peak memory above %.1f MB or unexpected status' % args.max_mb)
+        sys.exit(1)
+    print('OK: memory stayed under %.1f MB (a 413 means the export passed the %.1f MB body cap)' % (
+        args.max_mb, args.max_body_mb))
+
+
+if __name__ == '__main__':
+    main()
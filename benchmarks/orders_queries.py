@@ -0,0 +1,107 @@
+'''
+Seeds thousands of orders and checks that the orders listings run a constant
+number of queries regardless of how many orders they return.
+
+Usage: DATABASE_URL=... python benchmarks/orders_queries.py [--sizes 10,1000,5000]
+'''
+import argparse
+import time
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from common import load_function, make_context, print_table
+
+SEED_EMAIL = 'bench-orders@example.com'
+
+
+class CountingCursor(RealDictCursor):
+    executed = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.executed += 1
+        return super().execute(query, vars)
+
+
+def seed(conn, count: int) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password_hash, full_name) VALUES (%s, '', 'Bench') "
+            "ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id",
+            (SEED_EMAIL,)
+        )
+        user_id = cur.fetchone()[0]
+        cur.execute('SELECT id FROM plants ORDER BY id LIMIT 1')
+        plant_id = cur.fetchone()[0]
+        order_ids = execute_values(
+            cur,
+            'INSERT INTO orders (user_id, total_amount, status) VALUES %s RETURNING id',
+            [(user_id, 100, 'pending')] * count,
+            fetch=True,
+            page_size=1000
+        )
+        execute_values(
+            cur,
+            'INSERT INTO order_items (order_id, plant_id, quantity, price) VALUES %s',
+            [(row[0], plant_id, q, 50) for row in order_ids for q in (1, 2)],
+            page_size=1000
+        )
+    conn.commit()
+    return user_id
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            'DELETE FROM order_items WHERE order_id IN '
+            '(SELECT o.id FROM orders o JOIN users u ON o.user_id = u.id WHERE u.email = %s)',
+            (SEED_EMAIL,)
+        )
+        cur.execute('DELETE FROM orders WHERE user_id IN (SELECT id FROM users WHERE email = %s)', (SEED_EMAIL,))
+        cur.execute('DELETE FROM users WHERE email = %s', (SEED_EMAIL,))
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10,1000,5000')
+    args = parser.parse_args()
+
+    orders = load_function('orders')
+    orders.RealDictCursor = CountingCursor
+    import db
+    from user_tokens import issue_user_token
+
+    conn = db.get_connection()
+    rows = []
+    try:
+        for size in (int(s) for s in args.sizes.split(',')):
+            cleanup(conn)
+            user_id = seed(conn, size)
+            events = {
+                'user listing': {'httpMethod': 'GET', 'queryStringParameters': {}, 'headers': {'X-Auth-Token': issue_user_token(user_id)}},
+                'admin listing': {'httpMethod': 'GET', 'queryStringParameters': {}, 'headers': {'X-Admin-Password': 'admin123'}},
+            }
+            for name, event in events.items():
+                CountingCursor.executed = 0
+                started = time.perf_counter()
+                response = orders.handler(event, make_context())
+                rows.append({
+                    'scenario': name,
+                    'orders': size,
+                    'status': response['statusCode'],
+                    'queries': CountingCursor.executed,
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                })
+    finally:
+        cleanup(conn)
+        db.release_connection(conn)
+
+    print_table(rows)
+    for name in ('user listing', 'admin listing'):
+        counts = {r['queries'] for r in rows if r['scenario'] == name}
+        assert len(counts) == 1, '%s query count depends on order count: %s' % (name, sorted(counts))
+    print('OK: query counts are constant')
+
+
+if __name__ == '__main__':
+    main()
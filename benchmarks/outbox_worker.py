@@ -0,0 +1,142 @@
+'''
+Outbox worker throughput: queues --jobs order confirmation jobs for seeded
+orders and drains them with 1, 2, 4 and 8 worker threads, with the mail sink
+replaced by an in-memory one that sleeps --mail-ms per message. Checks that
+every job was delivered exactly once and marked processed. A last round
+queues jobs whose handler fails on the first attempt to check the backoff
+and retry path.
+
+Run it against a benchmark database: the workers also pick up any other
+pending outbox jobs.
+
+Usage: DATABASE_URL=... DB_POOL_SIZE=8 python benchmarks/outbox_worker.py [--jobs 5000] [--mail-ms 2]
+'''
+import argparse
+import collections
+import random
+import threading
+import time
+
+import dataset
+from common import load_function, print_table
+
+
+class MemorySink:
+    def __init__(self, delay_ms: float):
+        self.delay = delay_ms / 1000
+        self.lock = threading.Lock()
+        self.sent = collections.Counter()
+
+    def send(self, to: str, subject: str, body: str, message_id: str) -> None:
+        time.sleep(self.delay)
+        with self.lock:
+            self.sent[message_id] += 1
+
+
+def enqueue(conn, topic: str, order_ids) -> list:
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO outbox (topic, payload)
+            SELECT %s, jsonb_build_object('order_id', order_id, 'bench', true)
+            FROM unnest(%s::int[]) AS order_id
+            RETURNING id
+        """, (topic, list(order_ids)))
+        job_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return job_ids
+
+
+def job_states(conn, job_ids):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COUNT(*) FILTER (WHERE processed_at IS NOT NULL),
+                   COUNT(*) FILTER (WHERE failed_at IS NOT NULL),
+                   COALESCE(MAX(attempts), 0)
+            FROM outbox WHERE id = ANY(%s)
+        """, (job_ids,))
+        state = cur.fetchone()
+    conn.rollback()
+    return state
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM outbox WHERE payload ? 'bench'")
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--mail-ms', type=float, default=2.0, help='simulated latency of the mail sink')
+    args = parser.parse_args()
+
+    load_function('orders')
+    import outbox
+
+    sink = MemorySink(args.mail_ms)
+    outbox.mail_sink = sink
+
+    conn = dataset.connect()
+    rows = []
+    failures = []
+    try:
+        ranges = dataset.seeded_ranges(conn)
+        rng = random.Random(5)
+        order_ids = [rng.randint(ranges['order_min'], ranges['order_max']) for _ in range(args.jobs)]
+
+        for workers in (1, 2, 4, 8):
+            sink.sent.clear()
+            job_ids = enqueue(conn, 'order_confirmation', order_ids)
+            started = time.perf_counter()
+            outbox.run_workers(workers, args.batch, poll_interval=0.05, once=True)
+            elapsed = time.perf_counter() - started
+
+            processed, failed, _ = job_states(conn, job_ids)
+            duplicates = sum(1 for count in sink.sent.values() if count > 1)
+            rows.append({
+                'workers': workers,
+                'jobs': len(job_ids),
+                'processed': processed,
+                'duplicates': duplicates,
+                'seconds': round(elapsed, 2),
+                'jobs_per_s': round(len(job_ids) / elapsed),
+            })
+            if processed != len(job_ids) or failed or duplicates:
+                failures.append('%d workers: %d/%d processed, %d failed, %d duplicates' % (
+                    workers, processed, len(job_ids), failed, duplicates))
+            cleanup(conn)
+
+        seen = set()
+
+        def flaky(cur, job) -> None:
+            if job['id'] not in seen:
+                seen.add(job['id'])
+                raise RuntimeError('simulated sink outage')
+
+        outbox.HANDLERS['bench_flaky'] = flaky
+        outbox.BACKOFF_BASE = 0.05
+        job_ids = enqueue(conn, 'bench_flaky', order_ids[:200])
+        deadline = time.monotonic() + 30
+        while job_states(conn, job_ids)[0] < len(job_ids) and time.monotonic() < deadline:
+            outbox.run_workers(4, args.batch, poll_interval=0.05, once=True)
+            time.sleep(0.05)
+        processed, failed, max_attempts = job_states(conn, job_ids)
+        print('retry round: %d/%d processed after one failure each, max attempts %d' % (
+            processed, len(job_ids), max_attempts))
+        if processed != len(job_ids) or max_attempts != 2:
+            failures.append('retry round: %d/%d processed, max attempts %d' % (processed, len(job_ids), max_attempts))
+        cleanup(conn)
+    finally:
+        conn.close()
+
+    print_table(rows)
+    for failure in failures:
+        print('FAIL', failure)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Login hashing at different scrypt cost settings, uncapped and with the auth
+PASSWORD_HASH_MAX_CONCURRENT cap. Reports throughput, latency and the peak
+number of derivations in flight with the memory they held. The cost is what
+moves throughput; the cap only bounds peak KDF memory, and logins beyond it
+queue, which shows up as higher p99. Needs no database.
+
+Usage: python benchmarks/password_hashing.py [--logins N] [--concurrency C] [--cap K]
+'''
+import argparse
+import os
+import threading
+
+from common import load_function, print_table, run_load
+
+COSTS = [(2 ** 12, 8, 1), (2 ** 14, 8, 1), (2 ** 15, 8, 1), (2 ** 16, 8, 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cap', type=int, default=max(1, (os.cpu_count() or 4) // 2))
+    args = parser.parse_args()
+
+    auth = load_function('auth')
+    scrypt = auth._scrypt
+    lock = threading.Lock()
+    in_flight = {'now': 0, 'peak': 0}
+
+    def counted_scrypt(*kdf_args):
+        with lock:
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+        try:
+            return scrypt(*kdf_args)
+        finally:
+            with lock:
+                in_flight['now'] -= 1
+
+    auth._scrypt = counted_scrypt
+    rows = []
+    try:
+        for n, r, p in COSTS:
+            stored = auth.hash_password('correct horse battery staple', n, r, p)
+            for label, slots in (('uncapped', None), ('cap %d' % args.cap, threading.BoundedSemaphore(args.cap))):
+                auth._kdf_slots = slots
+                in_flight['peak'] = 0
+                result = run_load(lambda i: auth.verify_password('correct horse battery staple', stored), args.logins, args.concurrency)
+                rows.append({'cost': 'N=%d r=%d p=%d' % (n, r, p), 'mode': label, 'logins_per_s': result['rps'],
+                             'p50_ms': result['p50_ms'], 'p99_ms': result['p99_ms'],
+                             'peak_kdfs': in_flight['peak'],
+                             'peak_kdf_mb': round(in_flight['peak'] * 128 * n * r * p / 1024 / 1024)})
+    finally:
+        auth._scrypt = scrypt
+        auth._kdf_slots = None
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
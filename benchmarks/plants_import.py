@@ -0,0 +1,97 @@
+'''
+Imports a synthetic supplier catalog (100k rows by default, a few percent of
+them invalid) through the bulk endpoint of plants.handler and compares it with
+one POST per plant, the only way to load a catalog before.
+
+Usage: DATABASE_URL=... python benchmarks/plants_import.py [--rows 100000] [--baseline-rows 1000]
+'''
+import argparse
+import csv
+import io
+import json
+import random
+import time
+
+from common import load_function, make_context, print_table
+
+NAME_PREFIX = 'bench import'
+ADMIN_HEADERS = {'X-Admin-Password': 'admin123'}
+
+
+def build_csv(rows: int, existing_ids, rng: random.Random) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'name', 'price', 'category', 'image', 'description'])
+    updates = rng.sample(existing_ids, min(len(existing_ids), rows // 5))
+    for i in range(rows):
+        plant_id = updates[i] if i < len(updates) else ''
+        price = rng.randint(100, 10000) if i % 50 else -1
+        category = rng.choice(['decorative', 'fruit']) if i % 70 else 'unknown'
+        writer.writerow([plant_id, f'{NAME_PREFIX} {i}', price, category, '', f'Импортированное растение {i}'])
+    return buffer.getvalue()
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute('DELETE FROM plants WHERE name LIKE %s AND id NOT IN (SELECT plant_id FROM order_items)',
+                    (NAME_PREFIX + '%',))
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--baseline-rows', type=int, default=1000, help='rows sent one POST at a time')
+    args = parser.parse_args()
+
+    plants = load_function('plants')
+    conn = plants.get_connection()
+    rng = random.Random(3)
+    try:
+        cleanup(conn)
+        with conn.cursor() as cur:
+            cur.execute('SELECT id FROM plants ORDER BY id')
+            existing_ids = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+    finally:
+        plants.release_connection(conn)
+
+    body = build_csv(args.rows, existing_ids, rng)
+    started = time.perf_counter()
+    response = plants.handler(
+        {'httpMethod': 'POST', 'headers': ADMIN_HEADERS, 'queryStringParameters': {'bulk': 'csv'}, 'body': body},
+        make_context()
+    )
+    bulk_seconds = time.perf_counter() - started
+    result = json.loads(response['body'])
+    if response['statusCode'] != 200:
+        raise SystemExit('bulk import failed: %s' % result)
+
+    started = time.perf_counter()
+    for i in range(args.baseline_rows):
+        plants.handler({
+            'httpMethod': 'POST',
+            'headers': ADMIN_HEADERS,
+            'body': json.dumps({'name': f'{NAME_PREFIX} single {i}', 'price': 100 + i, 'category': 'decorative',
+                                'image': '', 'description': ''})
+        }, make_context())
+    single_seconds = time.perf_counter() - started
+    single_rate = args.baseline_rows / single_seconds
+
+    print_table([
+        {'path': 'POST per plant', 'rows': args.baseline_rows, 'seconds': round(single_seconds, 2),
+         'rows_per_s': round(single_rate), 'estimate_for_all_rows_s': round(args.rows / single_rate, 1)},
+        {'path': 'bulk COPY + upsert', 'rows': args.rows, 'seconds': round(bulk_seconds, 2),
+         'rows_per_s': round(args.rows / bulk_seconds), 'estimate_for_all_rows_s': round(bulk_seconds, 1)},
+    ])
+    print('inserted %(inserted)d, updated %(updated)d, rejected %(error_count)d' % result)
+
+    conn = plants.get_connection()
+    try:
+        cleanup(conn)
+    finally:
+        plants.release_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
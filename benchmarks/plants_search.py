@@ -0,0 +1,88 @@
+'''
+Seeds a large synthetic catalog and measures latency of typical filtered
+plants.handler GET queries.
+
+Usage: DATABASE_URL=... python benchmarks/plants_search.py [--plants 100000] [--repeat 50]
+'''
+import argparse
+import io
+import random
+import statistics
+import time
+
+from common import load_function, make_context, percentile, print_table
+
+SEED_MARKER = 'bench-search'
+WORDS = ['монстера', 'фикус', 'лимон', 'кактус', 'орхидея', 'суккулент', 'пальма', 'папоротник', 'мандарин', 'алоэ']
+
+QUERIES = {
+    'first page': {},
+    'category': {'category': 'fruit'},
+    'category + price range': {'category': 'decorative', 'min_price': '1000', 'max_price': '2000', 'sort': 'price_asc'},
+    'text search': {'q': 'орхид'},
+    'text search + category': {'q': 'лимон', 'category': 'fruit', 'sort': 'price_desc'},
+    'newest': {'sort': 'newest'},
+}
+
+
+def seed(conn, count: int) -> None:
+    rng = random.Random(42)
+    buffer = io.StringIO()
+    for i in range(count):
+        word = rng.choice(WORDS)
+        buffer.write('%s %d\t%d\t%s\t\t%s %s\n' % (
+            word.capitalize(), i, rng.randint(100, 10000), rng.choice(['decorative', 'fruit']),
+            SEED_MARKER, ' '.join(rng.sample(WORDS, 3))
+        ))
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert('COPY plants (name, price, category, image, description) FROM STDIN', buffer)
+        cur.execute('ANALYZE plants')
+    conn.commit()
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute('DELETE FROM plants WHERE description LIKE %s', (SEED_MARKER + '%',))
+    conn.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--plants', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    plants = load_function('plants')
+    import db
+
+    conn = db.get_connection()
+    rows = []
+    try:
+        cleanup(conn)
+        seed(conn, args.plants)
+        for name, params in QUERIES.items():
+            event = {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': params}
+            response = plants.handler(event, make_context())
+            assert response['statusCode'] == 200, response
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                plants.handler(event, make_context())
+                samples.append((time.perf_counter() - started) * 1000)
+            rows.append({
+                'query': name,
+                'mean_ms': round(statistics.mean(samples), 2),
+                'p95_ms': round(percentile(samples, 95), 2),
+                'p99_ms': round(percentile(samples, 99), 2),
+            })
+    finally:
+        cleanup(conn)
+        db.release_connection(conn)
+
+    print('catalog size: %d synthetic plants' % args.plants)
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Planning-time and latency savings of the prepared hot queries: the cart GET
+join and the order detail lookup, run as plain SQL and via EXECUTE of the
+Statement registered in the handler. Planning time comes from
+EXPLAIN (ANALYZE) on the server; latency is measured client-side.
+
+Expects data from dataset.py (--scale 1000 or more).
+
+Usage: DATABASE_URL=... python benchmarks/prepared_statements.py [--repeat 2000]
+'''
+import argparse
+import random
+import re
+import statistics
+import time
+
+import dataset
+from common import load_function, percentile, print_table
+
+PLANNING = re.compile(r'Planning Time: ([\d.]+) ms')
+
+
+def planning_ms(cur, sql: str, params) -> float:
+    cur.execute('EXPLAIN (ANALYZE, SUMMARY) ' + sql, params)
+    plan = '\n'.join(row[0] for row in cur.fetchall())
+    return float(PLANNING.search(plan).group(1))
+
+
+def measure(conn, statement, ids, repeat: int):
+    with conn.cursor() as cur:
+        cur.execute(statement.prepare_sql)
+        rows = {}
+        for label, sql in (('plain SQL', statement.sql), ('prepared', statement.execute_sql)):
+            plans = []
+            latencies = []
+            for i in range(repeat):
+                params = (ids[i % len(ids)],)
+                started = time.perf_counter()
+                cur.execute(sql, params)
+                cur.fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+                if i % 20 == 0:
+                    plans.append(planning_ms(cur, sql, params))
+            rows[label] = {
+                'query': statement.name,
+                'mode': label,
+                'planning_ms': round(statistics.mean(plans), 4),
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'qps': round(repeat / (sum(latencies) / 1000)),
+            }
+        cur.execute('DEALLOCATE ' + statement.name)
+    conn.rollback()
+    return list(rows.values())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = dataset.connect()
+    try:
+        ranges = dataset.seeded_ranges(conn)
+        rng = random.Random(11)
+        users = range(ranges['user_min'], ranges['user_max'] + 1)
+        user_ids = rng.sample(users, min(200, len(users)))
+        order_ids = [rng.randint(ranges['order_min'], ranges['order_max']) for _ in range(200)]
+
+        with conn.cursor() as cur:
+            cur.execute('SELECT id FROM plants ORDER BY id LIMIT 5')
+            plant_ids = [row[0] for row in cur.fetchall()]
+            cur.execute('DELETE FROM cart_items WHERE user_id = ANY(%s)', (user_ids,))
+            cur.execute(
+                'INSERT INTO cart_items (user_id, plant_id, quantity) '
+                'SELECT u, p, 1 FROM unnest(%s::int[]) AS u, unnest(%s::int[]) AS p '
+                'ON CONFLICT (user_id, plant_id) DO NOTHING',
+                (user_ids, plant_ids)
+            )
+        conn.commit()
+
+        cart = load_function('cart')
+        orders = load_function('orders')
+        rows = measure(conn, cart.LOAD_CART, user_ids, args.repeat)
+        rows += measure(conn, orders.ORDER_DETAIL, order_ids, args.repeat)
+        rows += measure(conn, orders.ORDER_DETAIL_ITEMS, order_ids, args.repeat)
+
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM cart_items WHERE user_id = ANY(%s)', (user_ids,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
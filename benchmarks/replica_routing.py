@@ -0,0 +1,125 @@
+'''
+Checks read routing against two local Postgres instances (or a primary and
+a hot standby): reads go to DATABASE_REPLICA_URL, a pinned key reads from the
+primary (also from another process when the client echoes the signed
+X-Read-Pin header), a lagging replica is skipped, a saturated replica pool
+sends only the waiting read to the primary, and an unreachable replica falls
+back to the primary. Also times catalog reads on each route.
+
+Usage:
+    DATABASE_URL=postgresql://localhost:5432/farm DATABASE_REPLICA_URL=postgresql://localhost:5433/farm \
+        python benchmarks/replica_routing.py
+'''
+import os
+import time
+
+from common import load_function, make_context, print_table
+
+
+def server_of(conn) -> str:
+    with conn.cursor() as cur:
+        cur.execute("SELECT current_setting('port') || CASE WHEN pg_is_in_recovery() THEN ' (standby)' ELSE '' END")
+        port = cur.fetchone()[0]
+    return port
+
+
+def route(db, key=None) -> str:
+    conn = db.get_read_connection(key)
+    try:
+        return server_of(conn)
+    finally:
+        db.release_connection(conn)
+
+
+def server_of_primary(db) -> str:
+    conn = db.get_connection(autocommit=True)
+    try:
+        return server_of(conn)
+    finally:
+        db.release_connection(conn)
+
+
+def main() -> None:
+    if not os.environ.get('DATABASE_REPLICA_URL'):
+        raise SystemExit('Set DATABASE_REPLICA_URL to a second instance or a standby')
+
+    plants = load_function('plants')
+    import db
+
+    primary = server_of_primary(db)
+    checks = []
+
+    checks.append(('unpinned read uses replica', route(db, 'user:1'), lambda server: server != primary))
+
+    db.pin_primary('user:1')
+    checks.append(('pinned read uses primary', route(db, 'user:1'), lambda server: server == primary))
+    checks.append(('other keys stay on replica', route(db, 'user:2'), lambda server: server != primary))
+
+    # A pin carried by the client: issued on a write, then presented to a
+    # process that holds no pin of its own (simulated by clearing _pins)
+    db.READ_PIN_SECRET = db.READ_PIN_SECRET or 'replica-routing-bench'
+    served = {}
+
+    def pinned_handler(event, context):
+        if event['httpMethod'] == 'POST':
+            db.pin_primary('user:5')
+        else:
+            served['server'] = route(db, 'user:5')
+        return {'statusCode': 200, 'headers': {}, 'body': ''}
+
+    carried = db._carry_read_pins(pinned_handler)
+    pin_header = carried({'httpMethod': 'POST', 'headers': {}}, make_context())['headers'][db.READ_PIN_HEADER]
+    db._pins.clear()
+    carried({'httpMethod': 'GET', 'headers': {db.READ_PIN_HEADER: pin_header}}, make_context())
+    checks.append(('client-carried pin uses primary', served['server'], lambda server: server == primary))
+    carried({'httpMethod': 'GET', 'headers': {}}, make_context())
+    checks.append(('no pin header uses replica', served['server'], lambda server: server != primary))
+
+    if db.POOL_SIZE > 0:
+        pool_timeout = db.get_replica_pool().timeout
+        db.get_replica_pool().timeout = 0.1
+        held = [db.get_replica_pool().getconn(True) for _ in range(db.POOL_SIZE)]
+        checks.append(('saturated replica pool falls back', route(db, 'user:6'), lambda server: server == primary))
+        for conn in held:
+            db.release_connection(conn)
+        db.get_replica_pool().timeout = pool_timeout
+        checks.append(('replica stays in use after a pool timeout', route(db, 'user:6'), lambda server: server != primary))
+
+    max_lag = db.REPLICA_MAX_LAG
+    db.REPLICA_MAX_LAG = -1
+    db._replica_checked_at = 0.0
+    checks.append(('lagging replica is skipped', route(db, 'user:3'), lambda server: server == primary))
+    db.REPLICA_MAX_LAG = max_lag
+    db._replica_checked_at = 0.0
+
+    replica_url = db.REPLICA_URL
+    db.close_pool()
+    db._replica_pool = None
+    db.REPLICA_URL = 'postgresql://127.0.0.1:1/unreachable?connect_timeout=1'
+    checks.append(('unreachable replica falls back', route(db, 'user:4'), lambda server: server == primary))
+    db.REPLICA_URL = replica_url
+    db._replica_pool = None
+    db._replica_down_until = 0.0
+
+    timings = []
+    for label, key in (('replica', None), ('primary (pinned)', 'catalog')):
+        if key:
+            db.READ_PIN_SECONDS = 3600
+            db.pin_primary(key)
+        plants.catalog_cache.invalidate()
+        started = time.perf_counter()
+        for _ in range(200):
+            plants.catalog_cache.invalidate()
+            plants.handler({'httpMethod': 'GET', 'queryStringParameters': {}}, make_context())
+        timings.append({'catalog reads from': label, 'requests': 200,
+                        'mean_ms': round((time.perf_counter() - started) / 200 * 1000, 3)})
+
+    print_table([{'check': name, 'served by': server, 'ok': ok(server)} for name, server, ok in checks])
+    print()
+    print_table(timings)
+    if not all(ok(server) for _, server, ok in checks):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+'''
+Load-test harness that drives the backend handlers in-process.
+
+Replays scenario files from benchmarks/scenarios/ (the tests.json format plus
+weights, payload templates, request count and concurrency) against a local
+Postgres prepared by dataset.py, and reports req/s, p50/p95/p99 latency,
+queries per request (from the DB_INSTRUMENT stats in db.py) and status
+mismatches. Results can be written as JSON and compared with an earlier run.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/run.py --setup --scale 1000
+    python benchmarks/run.py storefront checkout --output results.json --compare baseline.json
+'''
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import dataset
+from common import load_function, make_context, percentile, print_table
+
+SCENARIOS_DIR = Path(__file__).resolve().parent / 'scenarios'
+TEMPLATE = re.compile(r'\{\{(\w+)\}\}')
+
+
+def enable_instrumentation() -> None:
+    '''Turns on the backend DB instrumentation (without per-request log lines) before db.py is imported.'''
+    os.environ['DB_INSTRUMENT'] = '1'
+    os.environ['DB_INSTRUMENT_LOG'] = '0'
+
+
+class Context:
+    '''Per-request template values; one user is picked per request so its id and token agree.'''
+
+    def __init__(self, ranges: Dict[str, int], rng: random.Random, tokens: Dict[str, str]):
+        self.ranges = ranges
+        self.rng = rng
+        self.tokens = tokens
+
+    def values(self, index: int) -> Dict[str, Any]:
+        from user_tokens import issue_user_token
+
+        user_id = self.rng.randint(self.ranges['user_min'], self.ranges['user_max'])
+        return {
+            'n': index,
+            'user_id': user_id,
+            'user_token': issue_user_token(user_id),
+            'plant_id': self.rng.randint(self.ranges['plant_min'], self.ranges['plant_max']),
+            'order_id': self.rng.randint(self.ranges['order_min'], self.ranges['order_max']),
+            'quantity': self.rng.randint(1, 3),
+            **self.tokens,
+        }
+
+
+def render(value: Any, values: Dict[str, Any]) -> Any:
+    if isinstance(value, dict):
+        return {key: render(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [render(item, values) for item in value]
+    if isinstance(value, str):
+        whole = TEMPLATE.fullmatch(value)
+        if whole:
+            return values[whole.group(1)]
+        return TEMPLATE.sub(lambda m: str(values[m.group(1)]), value)
+    return value
+
+
+def build_event(test: Dict[str, Any]) -> Dict[str, Any]:
+    parts = urlsplit(test.get('path', '/'))
+    event = {
+        'httpMethod': test.get('method', 'GET'),
+        'headers': test.get('headers', {}),
+        'queryStringParameters': dict(parse_qsl(parts.query)),
+    }
+    if 'body' in test:
+        event['body'] = json.dumps(test['body'])
+    return event
+
+
+def run_scenario(scenario: Dict[str, Any], context: Context, overrides: Dict[str, Optional[int]]) -> Dict[str, Any]:
+    handler = load_function(scenario['function']).handler
+    import db
+    tests = scenario['tests']
+    weights = [test.get('weight', 1) for test in tests]
+    requests = overrides.get('requests') or scenario.get('requests', 1000)
+    concurrency = overrides.get('concurrency') or scenario.get('concurrency', 4)
+    rng = random.Random(scenario.get('seed', 1))
+    plan = rng.choices(range(len(tests)), weights=weights, k=requests)
+
+    latencies: List[float] = []
+    queries: List[int] = []
+    mismatches: Dict[str, int] = {}
+    lock = threading.Lock()
+    next_index = iter(range(requests))
+
+    def worker() -> None:
+        while True:
+            with lock:
+                index = next(next_index, None)
+                if index is None:
+                    return
+                test = tests[plan[index]]
+                values = context.values(index)
+            event = build_event(render(test, values))
+            started = time.perf_counter()
+            response = handler(event, make_context('bench-%d' % index))
+            elapsed = (time.perf_counter() - started) * 1000
+            stats = db.last_request_stats()
+            with lock:
+                latencies.append(elapsed)
+                queries.append(stats.queries if stats else 0)
+                expected = test.get('expectedStatus')
+                if expected is not None and response['statusCode'] != expected:
+                    key = '%s: %s' % (test['name'], response['statusCode'])
+                    mismatches[key] = mismatches.get(key, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'scenario': scenario['name'],
+        'requests': requests,
+        'concurrency': concurrency,
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'status_mismatches': sum(mismatches.values()),
+        'mismatch_detail': mismatches,
+    }
+
+
+def admin_tokens() -> Dict[str, str]:
+    settings = load_function('settings')
+    login = settings.handler({'httpMethod': 'POST', 'body': json.dumps({'password': 'admin123'})}, make_context())
+    token = json.loads(login['body']).get('token', '') if login['statusCode'] == 200 else ''
+    return {'admin_password': 'admin123', 'admin_token': token}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    baseline = {row['scenario']: row for row in json.loads(Path(baseline_path).read_text())['results']}
+    rows = []
+    for row in results:
+        before = baseline.get(row['scenario'])
+        if not before:
+            continue
+        rows.append({
+            'scenario': row['scenario'],
+            'rps': '%s -> %s' % (before['rps'], row['rps']),
+            'rps_change': '%+.1f%%' % ((row['rps'] / before['rps'] - 1) * 100 if before['rps'] else 0),
+            'p99_ms': '%s -> %s' % (before['p99_ms'], row['p99_ms']),
+            'queries': '%s -> %s' % (before['queries_per_request'], row['queries_per_request']),
+        })
+    print('\ncompared with %s' % baseline_path)
+    print_table(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help='scenario names from benchmarks/scenarios (default: all)')
+    parser.add_argument('--setup', action='store_true', help='apply migrations and seed before running')
+    parser.add_argument('--reset', action='store_true', help='with --setup, recreate the schema first')
+    parser.add_argument('--scale', type=int, default=1000, help='with --setup, synthetic data size')
+    parser.add_argument('--requests', type=int, help='override requests per scenario')
+    parser.add_argument('--concurrency', type=int, help='override concurrency per scenario')
+    parser.add_argument('--output', help='write machine-readable results to this JSON file')
+    parser.add_argument('--compare', help='earlier --output file to compare against')
+    args = parser.parse_args()
+
+    conn = dataset.connect()
+    try:
+        if args.setup:
+            dataset.apply_migrations(conn, args.reset)
+            dataset.seed(conn, args.scale)
+        ranges = dataset.seeded_ranges(conn)
+    finally:
+        conn.close()
+
+    enable_instrumentation()
+    names = args.scenarios or sorted(path.stem for path in SCENARIOS_DIR.glob('*.json'))
+    context = Context(ranges, random.Random(1), admin_tokens())
+    overrides = {'requests': args.requests, 'concurrency': args.concurrency}
+
+    results = []
+    for name in names:
+        for scenario in json.loads((SCENARIOS_DIR / f'{name}.json').read_text(encoding='utf-8'))['scenarios']:
+            scenario.setdefault('name', name)
+            results.append(run_scenario(scenario, context, overrides))
+
+    print_table([{k: v for k, v in row.items() if k != 'mismatch_detail'} for row in results])
+    for row in results:
+        for detail, count in row['mismatch_detail'].items():
+            print('  %s  %s x%d' % (row['scenario'], detail, count))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'ranges': ranges,
+            'results': results,
+        }, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+'''
+Sales analytics at scale: seeds order history until there are at least 10M
+order items (dataset.py averages 3 items per order), then measures
+  - catch-up throughput when folding the change log written by the triggers,
+  - a full rebuild,
+  - the analytics endpoint (summary tables only) against the same report
+    computed from raw orders/order_items, which is what the admin screen did,
+  - catch-up latency after a burst of fresh checkouts.
+
+Usage: DATABASE_URL=... python benchmarks/sales_analytics.py [--items 10000000] [--repeat 20]
+'''
+import argparse
+import json
+import random
+import statistics
+import time
+
+import dataset
+from common import load_function, make_context, print_table
+
+ADMIN_HEADERS = {'X-Admin-Password': 'admin123'}
+
+RAW_REPORT_SQL = [
+    """
+    SELECT created_at::date, COUNT(*), SUM(total_amount) FROM orders
+    WHERE status IS DISTINCT FROM 'cancelled'
+    GROUP BY 1 ORDER BY 1
+    """,
+    "SELECT status, COUNT(*) FROM orders GROUP BY status",
+    """
+    SELECT oi.plant_id, SUM(oi.quantity) AS quantity FROM order_items oi
+    JOIN orders o ON o.id = oi.order_id
+    WHERE o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY oi.plant_id ORDER BY quantity DESC LIMIT 10
+    """,
+]
+
+
+def ensure_items(conn, items: int) -> int:
+    dataset.apply_migrations(conn)
+    with conn.cursor() as cur:
+        cur.execute('SELECT COUNT(*) FROM order_items')
+        existing = cur.fetchone()[0]
+    conn.rollback()
+    if existing < items:
+        scale = -(-(items - existing) // 30)
+        print('seeding about %d order items' % (scale * 30))
+        dataset.seed(conn, scale)
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM order_items')
+            existing = cur.fetchone()[0]
+        conn.rollback()
+    return existing
+
+
+def timed_ms(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--burst', type=int, default=200, help='orders placed before the final catch-up')
+    args = parser.parse_args()
+
+    orders = load_function('orders')
+    import analytics
+
+    conn = dataset.connect()
+    rows = []
+    try:
+        item_count = ensure_items(conn, args.items)
+
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM sales_changes')
+            pending = cur.fetchone()[0]
+        conn.rollback()
+        if pending:
+            with conn.cursor() as cur:
+                elapsed = timed_ms(lambda: analytics.catch_up(cur))
+            rows.append({'step': 'catch-up of seeded change log', 'changes': pending,
+                         'ms': round(elapsed), 'changes_per_s': round(pending / elapsed * 1000)})
+
+        elapsed = timed_ms(lambda: analytics.rebuild(conn))
+        rows.append({'step': 'rebuild from %d items' % item_count, 'changes': '', 'ms': round(elapsed), 'changes_per_s': ''})
+
+        event = {'httpMethod': 'GET', 'headers': ADMIN_HEADERS,
+                 'queryStringParameters': {'analytics': '1', 'date_from': '2020-01-01', 'date_to': '2030-12-31'}}
+        endpoint = [timed_ms(lambda: orders.handler(event, make_context())) for _ in range(args.repeat)]
+        rows.append({'step': 'analytics endpoint (summaries)', 'changes': '',
+                     'ms': round(statistics.median(endpoint), 2), 'changes_per_s': ''})
+
+        def raw_report() -> None:
+            with conn.cursor() as cur:
+                for sql in RAW_REPORT_SQL:
+                    cur.execute(sql)
+                    cur.fetchall()
+            conn.rollback()
+
+        raw = [timed_ms(raw_report) for _ in range(max(1, args.repeat // 10))]
+        rows.append({'step': 'same report from raw history', 'changes': '',
+                     'ms': round(statistics.median(raw), 2), 'changes_per_s': ''})
+
+        ranges = dataset.seeded_ranges(conn)
+        from user_tokens import issue_user_token
+        rng = random.Random(9)
+        for _ in range(args.burst):
+            user_id = rng.randint(ranges['user_min'], ranges['user_max'])
+            orders.handler({
+                'httpMethod': 'POST',
+                'headers': {'X-Auth-Token': issue_user_token(user_id)},
+                'body': json.dumps({'items': [
+                    {'plant_id': rng.randint(ranges['plant_min'], ranges['plant_max']), 'quantity': rng.randint(1, 3)}
+                    for _ in range(3)
+                ]})
+            }, make_context())
+        with conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM sales_changes')
+            pending = cur.fetchone()[0]
+            conn.rollback()
+            elapsed = timed_ms(lambda: analytics.catch_up(cur))
+        rows.append({'step': 'catch-up after %d checkouts' % args.burst, 'changes': pending,
+                     'ms': round(elapsed, 2), 'changes_per_s': round(pending / elapsed * 1000) if elapsed else ''})
+    finally:
+        conn.close()
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Serializes a synthetic 10k-row orders payload through the old inline
+json.dumps(default=str) path and the shared response builder. Needs no database.
+
+Usage: python benchmarks/serialization.py [--rows N] [--repeat N]
+'''
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from common import BACKEND_DIR, print_table
+
+sys.path.insert(0, str(BACKEND_DIR / 'orders'))
+import response  # noqa: E402
+
+
+def make_orders(count: int):
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    return [{
+        'id': i,
+        'user_id': i % 500,
+        'total_amount': Decimal('%d.50' % (1000 + i % 9000)),
+        'status': 'pending',
+        'delivery_address': 'г. Москва, ул. Садовая, д. %d' % (i % 100),
+        'created_at': started + timedelta(minutes=i),
+        'full_name': 'Покупатель %d' % i,
+        'email': 'user%d@example.com' % i,
+        'phone': '+7 900 000-00-00',
+        'items': [{'quantity': q, 'price': Decimal('499.00'), 'name': 'Монстера деликатесная'} for q in (1, 2, 3)],
+    } for i in range(count)]
+
+
+def timed(fn, repeat: int):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.mean(samples), 2), round(min(samples), 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    orders = make_orders(args.rows)
+    gzip_event = {'headers': {'Accept-Encoding': 'gzip'}}
+    paths = {
+        'old: inline headers + json.dumps(default=str)': lambda: {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(orders, default=str)
+        },
+        'new: json_response (%s)' % ('orjson' if response.orjson else 'stdlib'): lambda: response.json_response(200, orders),
+        'new: json_response + gzip': lambda: response.json_response(200, orders, gzip_event),
+    }
+
+    rows = []
+    for label, fn in paths.items():
+        mean_ms, best_ms = timed(fn, args.repeat)
+        result = fn()
+        rows.append({'path': label, 'mean_ms': mean_ms, 'best_ms': best_ms, 'body_bytes': len(result['body'])})
+
+    print('%d orders' % args.rows)
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
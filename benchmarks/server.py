@@ -0,0 +1,110 @@
+'''
+Compares the per-invocation model (every request pays a fresh interpreter,
+imports and a new DB connection, like a cold function) with server/serve.py
+serving the same requests from one warm process over HTTP keep-alive.
+
+Usage: DATABASE_URL=... DB_POOL_SIZE=16 python benchmarks/server.py [--requests 2000] [--workers 16] [--cold 30]
+'''
+import argparse
+import http.client
+import json
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from common import BACKEND_DIR, percentile, print_table
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'server'))
+import serve  # noqa: E402
+
+PATHS = ['/plants', '/settings', '/plants?category=fruit&limit=12', '/plants?id=1']
+
+COLD_SCRIPT = '''
+import json, sys, time
+from types import SimpleNamespace
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+response = index.handler(json.loads(sys.argv[2]), SimpleNamespace(request_id='cold', function_name='cold'))
+print(response['statusCode'], (time.perf_counter() - started) * 1000)
+'''
+
+
+def cold_invocations(count: int):
+    latencies = []
+    for i in range(count):
+        path = PATHS[i % len(PATHS)]
+        name = path.strip('/').split('?')[0]
+        event = serve.build_event('GET', path, {}, b'')
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', COLD_SCRIPT, str(BACKEND_DIR / name), json.dumps(event)],
+                       check=True, capture_output=True)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def warm_server(requests: int, concurrency: int, workers: int):
+    server = serve.create_server('127.0.0.1', 0, workers)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client() -> None:
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            started = time.perf_counter()
+            conn.request('GET', PATHS[index % len(PATHS)])
+            conn.getresponse().read()
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+        conn.close()
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    server.server_close()
+    server.drain()
+    serve.close_pools()
+    return latencies, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cold', type=int, default=30, help='cold invocations to sample')
+    args = parser.parse_args()
+
+    cold = cold_invocations(args.cold)
+    warm, elapsed = warm_server(args.requests, args.concurrency, args.workers)
+
+    print_table([
+        {'model': 'cold invocation per request', 'requests': len(cold), 'concurrency': 1,
+         'rps': round(len(cold) / (sum(cold) / 1000), 1),
+         'p50_ms': round(percentile(cold, 50), 1), 'p99_ms': round(percentile(cold, 99), 1)},
+        {'model': 'server/serve.py (warm, shared pool)', 'requests': len(warm), 'concurrency': args.concurrency,
+         'rps': round(len(warm) / elapsed, 1),
+         'p50_ms': round(percentile(warm, 50), 1), 'p99_ms': round(percentile(warm, 99), 1)},
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Settings snapshot hit ratio under repeated GETs and bulk PUT latency for
+1 vs 100 keys.
+
+Usage: DATABASE_URL=... python benchmarks/settings_cache.py [--requests N] [--repeat N]
+'''
+import argparse
+import json
+import statistics
+import time
+
+from common import load_function, make_context, percentile, print_table, run_load
+
+BENCH_PREFIX = 'bench_setting_'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    settings = load_function('settings')
+    import db
+    import settings_snapshot
+
+    get_event = {'httpMethod': 'GET', 'headers': {}}
+    reads = run_load(lambda i: settings.handler(get_event, make_context()), args.requests, args.concurrency)
+    print('GET with snapshot cache')
+    print_table([{**reads, **settings_snapshot.cache_stats()}])
+
+    rows = []
+    headers = {'X-Admin-Password': 'admin123'}
+    try:
+        for size in (1, 100):
+            body = json.dumps({'%s%d' % (BENCH_PREFIX, i): 'value %d' % i for i in range(size)})
+            event = {'httpMethod': 'PUT', 'headers': headers, 'body': body}
+            assert settings.handler(event, make_context())['statusCode'] == 200
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                settings.handler(event, make_context())
+                samples.append((time.perf_counter() - started) * 1000)
+            rows.append({'keys': size, 'mean_ms': round(statistics.mean(samples), 2),
+                         'p99_ms': round(percentile(samples, 99), 2)})
+    finally:
+        conn = db.get_connection()
+        with conn.cursor() as cur:
+            cur.execute('DELETE FROM site_settings WHERE key LIKE %s', (BENCH_PREFIX + '%',))
+        conn.commit()
+        db.release_connection(conn)
+        settings_snapshot.invalidate()
+
+    print('\nPUT latency')
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+'''
+Flash-sale stress test: hundreds of buyers check out the same SKU (and, in
+the second round, two SKUs in random order) through orders.handler at the
+same time. Verifies that nothing is oversold, that the stock ends at zero,
+and that no checkout dies on a deadlock or lock timeout.
+
+Usage: DATABASE_URL=... DB_POOL_SIZE=32 python benchmarks/stock_contention.py [--buyers 300] [--stock 100]
+'''
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import execute_values
+
+from common import load_function, make_context, percentile, print_table
+
+EMAIL_PREFIX = 'bench-flash-'
+
+
+def seed(conn, buyers: int, stock: int):
+    with conn.cursor() as cur:
+        user_ids = [row[0] for row in execute_values(
+            cur,
+            "INSERT INTO users (email, password_hash, full_name) VALUES %s "
+            "ON CONFLICT (email) DO UPDATE SET full_name = EXCLUDED.full_name RETURNING id",
+            [(f'{EMAIL_PREFIX}{i}@example.com', '', 'Flash buyer') for i in range(buyers)],
+            fetch=True
+        )]
+        plant_ids = [row[0] for row in execute_values(
+            cur,
+            "INSERT INTO plants (name, price, category, image, description, stock) VALUES %s RETURNING id",
+            [('flash sale plant %d' % i, 990, 'decorative', '', 'flash sale', stock) for i in range(2)],
+            fetch=True
+        )]
+    conn.commit()
+    return user_ids, plant_ids
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM users WHERE email LIKE %s", (EMAIL_PREFIX + '%',))
+        user_ids = [row[0] for row in cur.fetchall()]
+        cur.execute('DELETE FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE user_id = ANY(%s))', (user_ids,))
+        cur.execute('DELETE FROM orders WHERE user_id = ANY(%s)', (user_ids,))
+        cur.execute('DELETE FROM cart_items WHERE user_id = ANY(%s)', (user_ids,))
+        cur.execute('DELETE FROM users WHERE id = ANY(%s)', (user_ids,))
+        cur.execute("DELETE FROM plants WHERE name LIKE 'flash sale plant %'")
+    conn.commit()
+
+
+def run_round(orders, tokens, lines_for, buyers: int):
+    statuses = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def buy(i: int) -> None:
+        started = time.perf_counter()
+        response = orders.handler({
+            'httpMethod': 'POST',
+            'headers': {'X-Auth-Token': tokens[i]},
+            'body': json.dumps({'items': lines_for(i), 'delivery_address': 'flash'})
+        }, make_context('flash-%d' % i))
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=buyers) as pool:
+        list(pool.map(buy, range(buyers)))
+    return statuses, time.perf_counter() - started, latencies
+
+
+def sold(conn, plant_ids):
+    with conn.cursor() as cur:
+        cur.execute('SELECT id, stock FROM plants WHERE id = ANY(%s) ORDER BY id', (plant_ids,))
+        stock = dict(cur.fetchall())
+        cur.execute('SELECT plant_id, SUM(quantity) FROM order_items WHERE plant_id = ANY(%s) GROUP BY plant_id', (plant_ids,))
+        units = dict(cur.fetchall())
+    conn.rollback()
+    return stock, units
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--buyers', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=100)
+    args = parser.parse_args()
+
+    orders = load_function('orders')
+    from user_tokens import issue_user_token
+
+    rng = random.Random(5)
+    rows = []
+    failures = []
+    for name, lines_for in (
+        ('same SKU', lambda plant_ids: lambda i: [{'plant_id': plant_ids[0], 'quantity': 1}]),
+        ('two SKUs, random order', lambda plant_ids: lambda i: rng.sample(
+            [{'plant_id': plant_ids[0], 'quantity': 1}, {'plant_id': plant_ids[1], 'quantity': 1}], 2)),
+    ):
+        conn = orders.get_connection()
+        try:
+            cleanup(conn)
+            user_ids, plant_ids = seed(conn, args.buyers, args.stock)
+        finally:
+            orders.release_connection(conn)
+        tokens = [issue_user_token(user_id) for user_id in user_ids]
+
+        statuses, elapsed, latencies = run_round(orders, tokens, lines_for(plant_ids), args.buyers)
+
+        conn = orders.get_connection()
+        try:
+            stock, units = sold(conn, plant_ids)
+        finally:
+            orders.release_connection(conn)
+        expected = min(args.buyers, args.stock)
+        checked = plant_ids[:1] if name == 'same SKU' else plant_ids
+        if statuses.get(201, 0) != expected or any(units.get(p, 0) != expected for p in checked):
+            failures.append('%s: expected %d sales, got %s (units %s)' % (name, expected, statuses, units))
+        if any(stock[p] != args.stock - expected for p in checked):
+            failures.append('%s: stock left %s' % (name, stock))
+        if set(statuses) - {201, 409}:
+            failures.append('%s: unexpected statuses %s' % (name, statuses))
+
+        rows.append({
+            'round': name,
+            'buyers': args.buyers,
+            'stock': args.stock,
+            'sold': statuses.get(201, 0),
+            'rejected_409': statuses.get(409, 0),
+            'other': sum(count for status, count in statuses.items() if status not in (201, 409)),
+            'seconds': round(elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+        })
+
+    conn = orders.get_connection()
+    try:
+        cleanup(conn)
+    finally:
+        orders.release_connection(conn)
+
+    print_table(rows)
+    if failures:
+        print('\n'.join('FAIL: ' + failure for failure in failures))
+        raise SystemExit(1)
+    print('OK: no overselling, no deadlocks')
+
+
+if __name__ == '__main__':
+    main()
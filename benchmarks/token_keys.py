@@ -0,0 +1,79 @@
+'''
+User token keys: checks that tokens survive the supported key changes and
+times issuing and verifying. Each case issues a token under one environment
+and verifies it under another:
+  - USER_TOKEN_SECRET=s, then USER_TOKEN_KEYS=default:s (secret moved into the list),
+  - USER_TOKEN_SECRET=s, then USER_TOKEN_KEYS=new:t with the secret still set,
+  - USER_TOKEN_KEYS=old:s, then USER_TOKEN_KEYS=new:t,old:s (rotation),
+and that a token from a dropped key, or with no key configured, is refused.
+Needs no database.
+
+Usage: python benchmarks/token_keys.py [--tokens N]
+'''
+import argparse
+import importlib.util
+import os
+import time
+
+from common import BACKEND_DIR, print_table
+
+ENV_NAMES = ('USER_TOKEN_SECRET', 'USER_TOKEN_KEYS')
+
+CASES = [
+    ('secret moved into the key list', {'USER_TOKEN_SECRET': 's'}, {'USER_TOKEN_KEYS': 'default:s'}, True),
+    ('secret kept next to new keys', {'USER_TOKEN_SECRET': 's'}, {'USER_TOKEN_KEYS': 'new:t', 'USER_TOKEN_SECRET': 's'}, True),
+    ('key rotation', {'USER_TOKEN_KEYS': 'old:s'}, {'USER_TOKEN_KEYS': 'new:t,old:s'}, True),
+    ('dropped key', {'USER_TOKEN_KEYS': 'old:s'}, {'USER_TOKEN_KEYS': 'new:t'}, False),
+    ('no key configured', {'USER_TOKEN_SECRET': 's'}, {}, False),
+]
+
+
+def load_tokens(env):
+    '''A fresh copy of backend/auth/user_tokens.py with only the given key settings.'''
+    saved = {name: os.environ.pop(name, None) for name in ENV_NAMES}
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location('user_tokens_%d' % id(env), BACKEND_DIR / 'auth' / 'user_tokens.py')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        for name in ENV_NAMES:
+            os.environ.pop(name, None)
+            if saved[name] is not None:
+                os.environ[name] = saved[name]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tokens', type=int, default=20000)
+    args = parser.parse_args()
+
+    checks = []
+    for name, issue_env, verify_env, expected in CASES:
+        token = load_tokens(issue_env).issue_user_token(42)
+        claims = load_tokens(verify_env).verify_user_token(token)
+        accepted = claims is not None and claims['uid'] == 42
+        checks.append({'case': name, 'expected': 'accepted' if expected else 'refused',
+                       'got': 'accepted' if accepted else 'refused', 'ok': accepted == expected})
+
+    tokens = load_tokens({'USER_TOKEN_KEYS': 'new:t,old:s'})
+    started = time.perf_counter()
+    issued = [tokens.issue_user_token(i) for i in range(args.tokens)]
+    issue_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for token in issued:
+        tokens.verify_user_token(token)
+    verify_s = time.perf_counter() - started
+
+    print_table(checks)
+    print()
+    print_table([{'tokens': args.tokens,
+                  'issue_per_s': round(args.tokens / issue_s),
+                  'verify_per_s': round(args.tokens / verify_s)}])
+    if not all(check['ok'] for check in checks):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+-- Индексы для постраничной выдачи заказов по курсору (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_orders_created_at_id
+    ON t_p64494902_farm_registry_system.orders(created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_at_id
+    ON t_p64494902_farm_registry_system.orders(status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_orders_user_created_at_id
+    ON t_p64494902_farm_registry_system.orders(user_id, created_at DESC, id DESC);
+
+-- Индекс для пакетной загрузки позиций заказов
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id
+    ON t_p64494902_farm_registry_system.order_items(order_id);
@@ -0,0 +1,24 @@
+-- Триграммный поиск по названию и описанию растений
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_plants_name_trgm
+    ON t_p64494902_farm_registry_system.plants USING GIN (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_plants_description_trgm
+    ON t_p64494902_farm_registry_system.plants USING GIN (description gin_trgm_ops);
+
+-- Индексы для фильтрации по категории и постраничной сортировки
+CREATE INDEX IF NOT EXISTS idx_plants_category_id
+    ON t_p64494902_farm_registry_system.plants(category, id);
+
+CREATE INDEX IF NOT EXISTS idx_plants_price_id
+    ON t_p64494902_farm_registry_system.plants(price, id);
+
+CREATE INDEX IF NOT EXISTS idx_plants_category_price_id
+    ON t_p64494902_farm_registry_system.plants(category, price, id);
+
+CREATE INDEX IF NOT EXISTS idx_plants_created_at_id
+    ON t_p64494902_farm_registry_system.plants(created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_plants_name_id
+    ON t_p64494902_farm_registry_system.plants(name, id);
@@ -0,0 +1,7 @@
+-- Категория растения проверяется по справочнику categories вместо фиксированного списка
+ALTER TABLE t_p64494902_farm_registry_system.plants
+    DROP CONSTRAINT IF EXISTS plants_category_check;
+
+ALTER TABLE t_p64494902_farm_registry_system.plants
+    ADD CONSTRAINT plants_category_fkey
+    FOREIGN KEY (category) REFERENCES t_p64494902_farm_registry_system.categories(name);
@@ -0,0 +1,11 @@
+-- Остаток на складе: NULL означает, что количество не ограничено
+ALTER TABLE t_p64494902_farm_registry_system.plants
+    ADD COLUMN IF NOT EXISTS stock INTEGER CHECK (stock IS NULL OR stock >= 0);
+
+-- Резерв позиции корзины действует до reserved_until
+ALTER TABLE t_p64494902_farm_registry_system.cart_items
+    ADD COLUMN IF NOT EXISTS reserved_until TIMESTAMP;
+
+-- Индекс для подсчёта активных резервов по растению
+CREATE INDEX IF NOT EXISTS idx_cart_items_plant_reserved_until
+    ON t_p64494902_farm_registry_system.cart_items(plant_id, reserved_until);
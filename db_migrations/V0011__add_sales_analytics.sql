@@ -0,0 +1,108 @@
+-- Журнал изменений для аналитики продаж: триггеры только добавляют строки,
+-- поэтому оформление заказа не конкурирует за строки сводных таблиц
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.sales_changes (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(10) NOT NULL,
+    day DATE NOT NULL,
+    plant_id INTEGER,
+    quantity INTEGER,
+    amount DECIMAL(14, 2),
+    old_status VARCHAR(50),
+    new_status VARCHAR(50)
+);
+
+-- Сводные таблицы по дням
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.sales_daily (
+    day DATE PRIMARY KEY,
+    orders INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.sales_status_daily (
+    day DATE NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status)
+);
+
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.sales_plants_daily (
+    day DATE NOT NULL,
+    plant_id INTEGER NOT NULL,
+    quantity BIGINT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, plant_id)
+);
+
+-- Оформление заказов ждёт до конца миграции: заказ, зафиксированный во время пересчёта,
+-- иначе попал бы и в пересчёт, и в журнал изменений (как в analytics.REBUILD_SQL)
+LOCK TABLE t_p64494902_farm_registry_system.orders, t_p64494902_farm_registry_system.order_items IN SHARE MODE;
+
+-- Триггеры уровня оператора с таблицами переходов: одна вставка в журнал на оператор
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, amount, new_status)
+    SELECT 'order', n.created_at::date, n.total_amount, n.status FROM new_rows n;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_status_changes() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, old_status, new_status)
+    SELECT 'status', n.created_at::date, o.status, n.status
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    WHERE o.status IS DISTINCT FROM n.status;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_item_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, plant_id, quantity, amount)
+    SELECT 'item', o.created_at::date, n.plant_id, n.quantity, n.quantity * n.price
+    FROM new_rows n
+    JOIN t_p64494902_farm_registry_system.orders o ON o.id = n.order_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_sales_insert ON t_p64494902_farm_registry_system.orders;
+CREATE TRIGGER trg_orders_sales_insert
+    AFTER INSERT ON t_p64494902_farm_registry_system.orders
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p64494902_farm_registry_system.log_order_inserts();
+
+DROP TRIGGER IF EXISTS trg_orders_sales_status ON t_p64494902_farm_registry_system.orders;
+CREATE TRIGGER trg_orders_sales_status
+    AFTER UPDATE ON t_p64494902_farm_registry_system.orders
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p64494902_farm_registry_system.log_order_status_changes();
+
+DROP TRIGGER IF EXISTS trg_order_items_sales_insert ON t_p64494902_farm_registry_system.order_items;
+CREATE TRIGGER trg_order_items_sales_insert
+    AFTER INSERT ON t_p64494902_farm_registry_system.order_items
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p64494902_farm_registry_system.log_order_item_inserts();
+
+-- Начальное заполнение сводных таблиц по существующей истории
+INSERT INTO t_p64494902_farm_registry_system.sales_daily (day, orders, revenue)
+SELECT created_at::date, COUNT(*), COALESCE(SUM(total_amount), 0)
+FROM t_p64494902_farm_registry_system.orders
+GROUP BY created_at::date
+ON CONFLICT (day) DO NOTHING;
+
+INSERT INTO t_p64494902_farm_registry_system.sales_status_daily (day, status, orders)
+SELECT created_at::date, status, COUNT(*)
+FROM t_p64494902_farm_registry_system.orders
+WHERE status IS NOT NULL
+GROUP BY created_at::date, status
+ON CONFLICT (day, status) DO NOTHING;
+
+INSERT INTO t_p64494902_farm_registry_system.sales_plants_daily (day, plant_id, quantity, revenue)
+SELECT o.created_at::date, oi.plant_id, SUM(oi.quantity), SUM(oi.quantity * oi.price)
+FROM t_p64494902_farm_registry_system.order_items oi
+JOIN t_p64494902_farm_registry_system.orders o ON o.id = oi.order_id
+WHERE oi.plant_id IS NOT NULL
+GROUP BY o.created_at::date, oi.plant_id
+ON CONFLICT (day, plant_id) DO NOTHING;
@@ -0,0 +1,29 @@
+-- Допустимые переходы статусов заказа
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.order_status_transitions (
+    from_status VARCHAR(50) NOT NULL,
+    to_status VARCHAR(50) NOT NULL,
+    PRIMARY KEY (from_status, to_status)
+);
+
+INSERT INTO t_p64494902_farm_registry_system.order_status_transitions (from_status, to_status) VALUES
+    ('pending', 'paid'),
+    ('pending', 'processing'),
+    ('pending', 'cancelled'),
+    ('paid', 'processing'),
+    ('paid', 'cancelled'),
+    ('processing', 'shipped'),
+    ('processing', 'cancelled'),
+    ('shipped', 'delivered')
+ON CONFLICT DO NOTHING;
+
+-- История смены статусов заказа
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.order_status_history (
+    id BIGSERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES t_p64494902_farm_registry_system.orders(id),
+    old_status VARCHAR(50),
+    new_status VARCHAR(50) NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_status_history_order_id
+    ON t_p64494902_farm_registry_system.order_status_history(order_id, changed_at);
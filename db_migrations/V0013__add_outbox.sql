@@ -0,0 +1,17 @@
+-- Очередь фоновых задач (transactional outbox): записывается в транзакции оформления заказа
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.outbox (
+    id BIGSERIAL PRIMARY KEY,
+    topic VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    failed_at TIMESTAMP
+);
+
+-- Индекс для выборки готовых к обработке задач воркерами
+CREATE INDEX IF NOT EXISTS idx_outbox_pending
+    ON t_p64494902_farm_registry_system.outbox(available_at, id)
+    WHERE processed_at IS NULL AND failed_at IS NULL;
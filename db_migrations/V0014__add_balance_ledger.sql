@@ -0,0 +1,40 @@
+-- Журнал операций по балансу и кэшбеку: только добавление строк,
+-- user_balances хранит текущие суммы по журналу
+CREATE TABLE IF NOT EXISTS t_p64494902_farm_registry_system.balance_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    order_id INTEGER REFERENCES t_p64494902_farm_registry_system.orders(id),
+    kind VARCHAR(20) NOT NULL,
+    balance_delta INTEGER NOT NULL DEFAULT 0,
+    cashback_delta INTEGER NOT NULL DEFAULT 0,
+    comment TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_email_id
+    ON t_p64494902_farm_registry_system.balance_ledger(email, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_balance_ledger_order_id
+    ON t_p64494902_farm_registry_system.balance_ledger(order_id)
+    WHERE order_id IS NOT NULL;
+
+-- Запрет изменения и удаления записей журнала
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.balance_ledger_append_only() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'balance_ledger is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_balance_ledger_append_only ON t_p64494902_farm_registry_system.balance_ledger;
+CREATE TRIGGER trg_balance_ledger_append_only
+    BEFORE UPDATE OR DELETE ON t_p64494902_farm_registry_system.balance_ledger
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p64494902_farm_registry_system.balance_ledger_append_only();
+
+-- Начальные записи для уже существующих балансов, чтобы сверка с журналом сходилась
+INSERT INTO t_p64494902_farm_registry_system.balance_ledger (email, kind, balance_delta, cashback_delta, comment)
+SELECT b.email, 'opening', COALESCE(b.balance, 0), COALESCE(b.cashback, 0), 'Остаток на момент ведения журнала'
+FROM t_p64494902_farm_registry_system.user_balances b
+WHERE (COALESCE(b.balance, 0) <> 0 OR COALESCE(b.cashback, 0) <> 0)
+  AND NOT EXISTS (
+      SELECT 1 FROM t_p64494902_farm_registry_system.balance_ledger l WHERE l.email = b.email
+  );
@@ -0,0 +1,84 @@
+-- Оформление заказов ждёт до конца миграции: заказ, зафиксированный во время пересчёта,
+-- иначе попал бы и в пересчёт, и в журнал изменений (как в analytics.REBUILD_SQL)
+LOCK TABLE t_p64494902_farm_registry_system.orders, t_p64494902_farm_registry_system.order_items IN SHARE MODE;
+
+-- Знак изменения в журнале аналитики: -1 снимает заказ с учёта при отмене, 1 возвращает
+ALTER TABLE t_p64494902_farm_registry_system.sales_changes
+    ADD COLUMN IF NOT EXISTS sign SMALLINT NOT NULL DEFAULT 1;
+
+-- Отменённые при создании заказы не дают выручки
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, amount, new_status, sign)
+    SELECT 'order', n.created_at::date,
+           CASE WHEN n.status = 'cancelled' THEN 0 ELSE n.total_amount END,
+           n.status,
+           CASE WHEN n.status = 'cancelled' THEN 0 ELSE 1 END
+    FROM new_rows n;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_item_inserts() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, plant_id, quantity, amount)
+    SELECT 'item', o.created_at::date, n.plant_id, n.quantity, n.quantity * n.price
+    FROM new_rows n
+    JOIN t_p64494902_farm_registry_system.orders o ON o.id = n.order_id
+    WHERE o.status IS DISTINCT FROM 'cancelled';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- При переходе в статус cancelled выручка и количество по растениям списываются,
+-- при выходе из него возвращаются
+CREATE OR REPLACE FUNCTION t_p64494902_farm_registry_system.log_order_status_changes() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, old_status, new_status)
+    SELECT 'status', n.created_at::date, o.status, n.status
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id
+    WHERE o.status IS DISTINCT FROM n.status;
+
+    WITH moved AS (
+        SELECT n.id, n.created_at::date AS day, n.total_amount,
+               CASE WHEN n.status = 'cancelled' THEN -1 ELSE 1 END AS sign
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE (COALESCE(n.status, '') = 'cancelled') <> (COALESCE(o.status, '') = 'cancelled')
+    )
+    INSERT INTO t_p64494902_farm_registry_system.sales_changes (kind, day, plant_id, quantity, amount, sign)
+    SELECT 'order', m.day, NULL, NULL, m.sign * m.total_amount, m.sign
+    FROM moved m
+    UNION ALL
+    SELECT 'item', m.day, oi.plant_id, m.sign * oi.quantity, m.sign * oi.quantity * oi.price, m.sign
+    FROM moved m
+    JOIN t_p64494902_farm_registry_system.order_items oi ON oi.order_id = m.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пересчёт сводных таблиц без отменённых заказов
+DELETE FROM t_p64494902_farm_registry_system.sales_changes;
+TRUNCATE t_p64494902_farm_registry_system.sales_daily,
+         t_p64494902_farm_registry_system.sales_status_daily,
+         t_p64494902_farm_registry_system.sales_plants_daily;
+
+INSERT INTO t_p64494902_farm_registry_system.sales_daily (day, orders, revenue)
+SELECT created_at::date, COUNT(*), COALESCE(SUM(total_amount), 0)
+FROM t_p64494902_farm_registry_system.orders
+WHERE status IS DISTINCT FROM 'cancelled'
+GROUP BY created_at::date;
+
+INSERT INTO t_p64494902_farm_registry_system.sales_status_daily (day, status, orders)
+SELECT created_at::date, status, COUNT(*)
+FROM t_p64494902_farm_registry_system.orders
+WHERE status IS NOT NULL
+GROUP BY created_at::date, status;
+
+INSERT INTO t_p64494902_farm_registry_system.sales_plants_daily (day, plant_id, quantity, revenue)
+SELECT o.created_at::date, oi.plant_id, SUM(oi.quantity), SUM(oi.quantity * oi.price)
+FROM t_p64494902_farm_registry_system.order_items oi
+JOIN t_p64494902_farm_registry_system.orders o ON o.id = oi.order_id
+WHERE oi.plant_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+GROUP BY o.created_at::date, oi.plant_id;
@@ -0,0 +1,219 @@
+'''
+Self-hosted entry point that serves every function in backend/ from one warm
+process. A request to /<function>[/...] is turned into the same event the
+cloud runtime passes to handler(event, context) (httpMethod, headers,
+queryStringParameters, body, isBase64Encoded, path).
+
+All functions share one copy of the helper modules (db, response,
+admin_session, user_tokens, settings_snapshot), so they share the DB pool and
+in-process caches. The copies in each function directory must therefore be
+identical, and startup refuses to run if they are not.
+
+Usage: DATABASE_URL=... python server/serve.py [--port 8000] [--workers 16]
+'''
+import argparse
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import signal
+import sys
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '5'))
+
+Handler = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+
+
+def check_shared_modules(names: List[str]) -> None:
+    '''Fails when a helper module differs between function directories, since only one copy gets imported.'''
+    copies: Dict[str, Dict[str, List[str]]] = {}
+    for name in names:
+        for path in (BACKEND_DIR / name).glob('*.py'):
+            if path.name == 'index.py':
+                continue
+            digest = hashlib.sha1(path.read_bytes()).hexdigest()
+            copies.setdefault(path.name, {}).setdefault(digest, []).append(name)
+    diverged = {module: versions for module, versions in copies.items() if len(versions) > 1}
+    if diverged:
+        details = '; '.join('%s differs between %s' % (module, ' / '.join(', '.join(fns) for fns in versions.values()))
+                            for module, versions in diverged.items())
+        raise SystemExit('Shared modules are out of sync: ' + details)
+
+
+def load_handlers(names: List[str]) -> Dict[str, Handler]:
+    check_shared_modules(names)
+    for name in names:
+        fn_dir = str(BACKEND_DIR / name)
+        if fn_dir not in sys.path:
+            sys.path.append(fn_dir)
+
+    handlers = {}
+    for name in names:
+        module_name = '%s_index' % name
+        spec = importlib.util.spec_from_file_location(module_name, BACKEND_DIR / name / 'index.py')
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        handlers[name] = module.handler
+    return handlers
+
+
+def discover_functions() -> List[str]:
+    return sorted(path.parent.name for path in BACKEND_DIR.glob('*/index.py'))
+
+
+def header_name(name: str) -> str:
+    '''Title-Cases a header name (x-auth-token -> X-Auth-Token), as the cloud runtime passes them.'''
+    return '-'.join(part.capitalize() for part in name.split('-'))
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    parts = urlsplit(target)
+    event: Dict[str, Any] = {
+        'httpMethod': method,
+        'path': parts.path,
+        'headers': {header_name(name): value for name, value in headers.items()},
+        'queryStringParameters': dict(parse_qsl(parts.query, keep_blank_values=True)),
+        'isBase64Encoded': False,
+        'body': '',
+    }
+    if body:
+        try:
+            event['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            event['body'] = base64.b64encode(body).decode()
+            event['isBase64Encoded'] = True
+    return event
+
+
+class PooledHTTPServer(HTTPServer):
+    '''HTTPServer that handles each connection on a fixed-size worker pool instead of a thread per connection.'''
+
+    def __init__(self, address, request_handler, handlers: Dict[str, Handler], workers: int):
+        super().__init__(address, request_handler)
+        self.handlers = handlers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self) -> None:
+        '''Waits for in-flight requests; idle keep-alive connections end after SERVER_KEEPALIVE_TIMEOUT.'''
+        self.executor.shutdown(wait=True)
+
+
+class FunctionRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    server: PooledHTTPServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if os.environ.get('SERVER_ACCESS_LOG', '1') != '0':
+            super().log_message(format, *args)
+
+    def _dispatch(self) -> None:
+        path = urlsplit(self.path).path
+        name = path.strip('/').split('/', 1)[0]
+
+        if name == 'healthz':
+            self._send(200, {'Content-Type': 'application/json'}, b'{"status":"ok"}')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        handler = self.server.handlers.get(name)
+        if handler is None:
+            self._send(404, {'Content-Type': 'application/json'}, json.dumps({'error': 'Unknown function'}).encode())
+            return
+
+        event = build_event(self.command, self.path, dict(self.headers.items()), body)
+        context = SimpleNamespace(request_id=uuid.uuid4().hex, function_name=name)
+        try:
+            response = handler(event, context)
+        except Exception:
+            traceback.print_exc()
+            self._send(500, {'Content-Type': 'application/json'}, b'{"error":"Internal server error"}')
+            return
+
+        payload = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            data = base64.b64decode(payload)
+        else:
+            data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        self._send(response.get('statusCode', 200), response.get('headers') or {}, data)
+
+    def _send(self, status: int, headers: Dict[str, str], data: bytes) -> None:
+        self.send_response(status)
+        for key, value in headers.items():
+            if key.lower() not in ('content-length', 'connection'):
+                self.send_header(key, str(value))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = _dispatch
+
+
+def close_pools() -> None:
+    db = sys.modules.get('db')
+    if db is not None:
+        db.close_pool()
+
+
+def create_server(host: str, port: int, workers: int, names: Optional[List[str]] = None) -> PooledHTTPServer:
+    handlers = load_handlers(names or discover_functions())
+    return PooledHTTPServer((host, port), FunctionRequestHandler, handlers, workers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('SERVER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVER_PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', '16')),
+                        help='concurrent connections served; size DB_POOL_SIZE to match')
+    parser.add_argument('functions', nargs='*', help='functions to serve (default: every backend/*/index.py)')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.workers, args.functions)
+
+    def stop(signum: int, frame: Any) -> None:
+        print('received signal %d, draining' % signum, flush=True)
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print('serving %s on http://%s:%d with %d workers' % (
+        ', '.join(sorted(server.handlers)), args.host, args.port, args.workers), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.drain()
+        close_pools()
+        print('stopped', flush=True)
+
+
+if __name__ == '__main__':
+    main()
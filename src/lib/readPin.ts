@@ -0,0 +1,42 @@
+const API_HOST = "functions.poehali.dev"
+const HEADER = "X-Read-Pin"
+
+// key -> "key|until|signature" entry as issued by the backend after a write
+const pins = new Map<string, string>()
+
+function activePins(): string {
+  const now = Date.now() / 1000
+  for (const [key, entry] of pins) {
+    const parts = entry.split("|")
+    if (Number(parts[parts.length - 2]) <= now) pins.delete(key)
+  }
+  return [...pins.values()].join(",")
+}
+
+function remember(header: string | null) {
+  if (!header) return
+  for (const entry of header.split(",")) {
+    const key = entry.trim().split("|").slice(0, -2).join("|")
+    if (key) pins.set(key, entry.trim())
+  }
+}
+
+// Sends the read pins from recent writes back to the backend, so reads served
+// by another function instance still go to the primary and see those writes
+export function installReadPins() {
+  const baseFetch = window.fetch.bind(window)
+  window.fetch = async (input: RequestInfo | URL, init?: RequestInit) => {
+    const url = input instanceof Request ? input.url : String(input)
+    if (!url.includes(API_HOST)) return baseFetch(input, init)
+
+    const active = activePins()
+    if (active) {
+      const headers = new Headers(init?.headers ?? (input instanceof Request ? input.headers : undefined))
+      headers.set(HEADER, active)
+      init = { ...init, headers }
+    }
+    const response = await baseFetch(input, init)
+    remember(response.headers.get(HEADER))
+    return response
+  }
+}
@@ -1,6 +1,9 @@
 import * as React from 'react';
 import { createRoot } from 'react-dom/client'
 import App from './App'
+import { installReadPins } from './lib/readPin'
 import './index.css'
 
+installReadPins();
+
 createRoot(document.getElementById("root")!).render(<App />);
\ No newline at end of file